@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+benchmark_vector_dtype.py
+对比 float32 / float16 / int8 向量存储的召回率、检索延迟和存储占用
+
+召回率以 float32 精确搜索为基准（recall@k = 结果中属于真实top-k的比例）。
+默认使用随机生成的聚类向量，也可用 KnowledgeBase.export_vectors 导出的 npz 文件。
+
+用法：
+    python benchmark_vector_dtype.py --num-vectors 50000 --dim 1024
+    python benchmark_vector_dtype.py --vectors exported.npz --index-type hnsw
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
+
+from rag_core import vector_search
+from rag_core.vector_store import VectorStore
+
+
+def make_vectors(num_vectors: int, dim: int, seed: int = 0) -> np.ndarray:
+    """生成聚类分布的随机向量，近似真实embedding的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, num_vectors // 500), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), num_vectors)
+    return centers[labels] + 0.3 * rng.normal(size=(num_vectors, dim)).astype(np.float32)
+
+
+def run(vectors, queries, ground_truth, vector_dtype, args, work_dir):
+    """按指定存储类型入库并检索，返回统计结果"""
+    store = VectorStore(os.path.join(work_dir, vector_dtype, "vector_store.db"))
+    store.set_index_config(
+        rebuild=False,
+        vector_dtype=vector_dtype,
+        metric=args.metric,
+        index_type=args.index_type,
+        rescore_factor=args.rescore_factor,
+    )
+    doc_path = os.path.join(work_dir, "doc.txt")
+    chunks = [str(i) for i in range(len(vectors))]
+    store.add_document(doc_path, chunks, vectors)
+    store.flush()
+
+    latencies = []
+    hits = 0
+    for query, truth in zip(queries, ground_truth):
+        start = time.perf_counter()
+        results = store.search(query.tolist(), top_k=args.top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len({int(r["content"]) for r in results} & set(truth.tolist()))
+
+    stats = store.get_stats()
+    store.close()
+    return {
+        "dtype": vector_dtype,
+        "recall": hits / (len(queries) * args.top_k),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "file_mb": stats["vector_file_size_bytes"] / 1024 / 1024,
+        "index_mb": stats.get("index_memory_bytes", 0) / 1024 / 1024,
+        "index_type": stats["index_type"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量存储类型基准测试")
+    parser.add_argument("--vectors", help="export_vectors 导出的 npz 文件，不指定时随机生成")
+    parser.add_argument("--num-vectors", type=int, default=20000, help="随机生成的向量数")
+    parser.add_argument("--dim", type=int, default=384, help="随机生成的向量维度")
+    parser.add_argument("--num-queries", type=int, default=200, help="查询数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--metric", default="cosine", choices=vector_search.METRICS)
+    parser.add_argument("--index-type", default="auto", help="auto / flat / ivf_flat / hnsw / ivf_pq")
+    parser.add_argument("--rescore-factor", type=int, default=4, help="重排候选数为 top_k 的倍数")
+    parser.add_argument(
+        "--dtypes", default="float32,float16,int8", help="参与对比的存储类型，逗号分隔"
+    )
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors)["vectors"].astype(np.float32)
+    else:
+        vectors = make_vectors(args.num_vectors, args.dim)
+    rng = np.random.default_rng(1)
+    # 查询取自已有向量并加噪声，模拟与文档相近的问题
+    queries = vectors[rng.integers(0, len(vectors), args.num_queries)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+    _, ground_truth = vector_search.search_matrix(vectors, queries, args.top_k, metric=args.metric)
+
+    print(
+        f"向量: {len(vectors)} x {vectors.shape[1]}，查询: {len(queries)}，"
+        f"top_k={args.top_k}，metric={args.metric}，rescore_factor={args.rescore_factor}"
+    )
+    print(f"{'dtype':<8} {'index':<16} {'recall':>7} {'p50(ms)':>8} {'p95(ms)':>8} {'file(MB)':>9} {'index(MB)':>10}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, "doc.txt"), "w", encoding="utf-8") as f:
+            f.write("benchmark")
+        for vector_dtype in args.dtypes.split(","):
+            result = run(vectors, queries, ground_truth, vector_dtype.strip(), args, work_dir)
+            print(
+                f"{result['dtype']:<8} {result['index_type']:<16} {result['recall']:>7.4f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['file_mb']:>9.1f} {result['index_mb']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
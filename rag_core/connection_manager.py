@@ -0,0 +1,175 @@
+"""
+connection_manager.py
+SQLite连接管理：每个线程复用自己的读连接和写连接，语句缓存复用预编译语句，
+检索使用只读连接，线程结束时连接自动关闭。同一数据库在进程内共享一个管理器。
+"""
+
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+# 每个连接缓存的预编译语句数
+CACHED_STATEMENTS = 256
+# 写锁被占用时的等待时间（秒）
+BUSY_TIMEOUT = 30.0
+
+
+class _ThreadConnections:
+    """
+    一个线程持有的读连接和写连接
+
+    只由线程局部变量引用：线程结束后对象被回收，连接随之关闭，
+    因此每个请求一个线程的服务器不会累积连接和文件描述符。
+    """
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.read: Optional[sqlite3.Connection] = None
+        self.write: Optional[sqlite3.Connection] = None
+
+    def close(self):
+        for attr in ("read", "write"):
+            conn = getattr(self, attr)
+            if conn is not None:
+                setattr(self, attr, None)
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+
+    def __del__(self):
+        self.close()
+
+
+class ConnectionManager:
+    """
+    单个SQLite数据库的连接管理器
+
+    - read()：当前线程的只读连接（mode=ro），检索路径使用
+    - write()：当前线程的读写连接，配合 transaction() 使用
+    - close_all()：数据库文件被删除或替换后关闭全部连接，各线程下次使用时重新打开
+
+    连接只在创建它的线程中使用，线程结束时自动关闭；close_all 可能从其他线程关闭连接，
+    因此创建时关闭 check_same_thread 检查。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 各线程的连接（弱引用，线程结束后自动移除）
+        self._threads: "weakref.WeakSet[_ThreadConnections]" = weakref.WeakSet()
+        self._generation = 0  # close_all 后递增，线程据此丢弃旧连接
+
+    def _open(self, read_only: bool) -> sqlite3.Connection:
+        if read_only:
+            uri = "file:" + os.path.abspath(self.db_path).replace("?", "%3f") + "?mode=ro"
+            conn = sqlite3.connect(
+                uri,
+                uri=True,
+                timeout=BUSY_TIMEOUT,
+                cached_statements=CACHED_STATEMENTS,
+                check_same_thread=False,
+            )
+        else:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=BUSY_TIMEOUT,
+                cached_statements=CACHED_STATEMENTS,
+                check_same_thread=False,
+            )
+            # synchronous=NORMAL 在WAL模式下只在检查点时同步磁盘
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA temp_store = MEMORY")
+        # 加大页缓存，减少重复查询时的磁盘读取
+        conn.execute("PRAGMA cache_size = -65536")
+        return conn
+
+    def _get(self, attr: str, read_only: bool) -> sqlite3.Connection:
+        holder = getattr(self._local, "connections", None)
+        if holder is None or holder.generation != self._generation:
+            if holder is not None:
+                holder.close()
+            holder = _ThreadConnections(self._generation)
+            self._local.connections = holder
+            with self._lock:
+                self._threads.add(holder)
+        conn = getattr(holder, attr)
+        if conn is None:
+            conn = self._open(read_only)
+            setattr(holder, attr, conn)
+        return conn
+
+    def read(self) -> sqlite3.Connection:
+        """当前线程复用的只读连接"""
+        return self._get("read", read_only=True)
+
+    def write(self) -> sqlite3.Connection:
+        """当前线程复用的读写连接"""
+        return self._get("write", read_only=False)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        在当前线程的写连接上开启写事务（BEGIN IMMEDIATE），正常退出时提交，异常时回滚
+        """
+        conn = self.write()
+        if conn.in_transaction:
+            # 嵌套调用时并入外层事务
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def close_thread(self):
+        """关闭当前线程的连接"""
+        holder = getattr(self._local, "connections", None)
+        if holder is not None:
+            holder.close()
+
+    def open_connections(self) -> int:
+        """当前打开的连接数"""
+        with self._lock:
+            holders = list(self._threads)
+        return sum((h.read is not None) + (h.write is not None) for h in holders)
+
+    def close_all(self):
+        """关闭所有线程的连接"""
+        with self._lock:
+            holders = list(self._threads)
+            self._threads = weakref.WeakSet()
+            self._generation += 1
+        for holder in holders:
+            holder.close()
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path: str) -> ConnectionManager:
+    """获取数据库对应的连接管理器（进程内按绝对路径共享）"""
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ConnectionManager(key)
+            _managers[key] = manager
+        return manager
+
+
+def close_all_connections():
+    """关闭进程内所有数据库连接"""
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.close_all()
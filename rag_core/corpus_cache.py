@@ -0,0 +1,282 @@
+"""
+corpus_cache.py
+进程内语料视图缓存：混合检索需要知识库全部有效文本块的ID、内容和向量，
+同一知识库的视图按语料版本（corpus_version，每次写入递增）只构建一次，版本变化后重建。
+
+所有知识库的视图合计不超过内存上限，超出时按最近最少使用淘汰；
+单个知识库放不下时，文本内容改为按需从数据库分批读取，仍放不下时向量也按需从向量文件读取。
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+from utils.config import get_corpus_cache_config
+
+# 估算Python字符串占用：对象头 + 每字符字节数（中文文本按UCS-2计）
+STR_OVERHEAD_BYTES = 64
+STR_BYTES_PER_CHAR = 2
+
+
+def estimate_contents_bytes(total_chars: int, count: int) -> int:
+    """估算 count 个共 total_chars 个字符的文本块载入内存后的字节数"""
+    return total_chars * STR_BYTES_PER_CHAR + count * (STR_OVERHEAD_BYTES + 8)
+
+
+class LazyContents(Sequence):
+    """
+    按需读取的文本块内容：只保存chunk_id，访问时从数据库读取
+
+    遍历时按 batch_size 分批读取，任何时刻只有一批内容在内存中。
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[List[int]], List[str]],
+        chunk_ids: np.ndarray,
+        batch_size: int = 2048,
+    ):
+        """
+        :param loader: 按chunk_id列表返回对应内容（顺序一致）
+        :param chunk_ids: 文本块ID
+        """
+        self._loader = loader
+        self.chunk_ids = chunk_ids
+        self.batch_size = batch_size
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.take(range(len(self))[key])
+        return self._loader([int(self.chunk_ids[key])])[0]
+
+    def __iter__(self) -> Iterator[str]:
+        for start in range(0, len(self.chunk_ids), self.batch_size):
+            yield from self._loader(self.chunk_ids[start : start + self.batch_size].tolist())
+
+    def take(self, positions) -> List[str]:
+        """按位置批量读取内容"""
+        ids = self.chunk_ids[np.asarray(positions, dtype=np.int64)].tolist()
+        contents: List[str] = []
+        for start in range(0, len(ids), self.batch_size):
+            contents.extend(self._loader(ids[start : start + self.batch_size]))
+        return contents
+
+    def subset(self, positions) -> "LazyContents":
+        return LazyContents(self._loader, self.chunk_ids[positions], self.batch_size)
+
+
+class LazyVectors:
+    """按需从向量文件读取的向量：只保存行号，调用时读出 float32 矩阵"""
+
+    def __init__(self, matrix, rows: np.ndarray):
+        # 构建视图时的向量文件映射；压缩替换向量文件后旧映射仍指向原文件，行号保持一致
+        self._matrix = matrix
+        self.rows = rows
+
+    def __call__(self) -> np.ndarray:
+        if len(self.rows) == 0:
+            return np.zeros((0, self._matrix.shape[1]), dtype=np.float32)
+        return np.asarray(self._matrix[self.rows], dtype=np.float32)
+
+    def subset(self, positions) -> "LazyVectors":
+        return LazyVectors(self._matrix, self.rows[positions])
+
+
+VectorsSource = Union[np.ndarray, LazyVectors, Callable[[], np.ndarray], None]
+
+
+class CorpusView:
+    """
+    某一语料版本的有效文本块（按chunk_id排序），构建后不再修改
+
+    - chunk_ids / document_ids：int64 数组
+    - contents：字符串列表，或按需读取的 LazyContents
+    - vectors：float32 矩阵；按需读取时每次访问读出一份；存在缺失向量时为 None
+    """
+
+    def __init__(
+        self,
+        version,
+        chunk_ids: np.ndarray,
+        document_ids: np.ndarray,
+        contents: Sequence[str],
+        vectors: VectorsSource = None,
+    ):
+        self.version = version
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self.contents = contents
+        self._vectors = vectors
+        self._nbytes: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def vectors(self) -> Optional[np.ndarray]:
+        if self._vectors is None or isinstance(self._vectors, np.ndarray):
+            return self._vectors
+        return self._vectors()
+
+    @property
+    def has_vectors(self) -> bool:
+        return self._vectors is not None
+
+    @property
+    def contents_cached(self) -> bool:
+        return not isinstance(self.contents, LazyContents)
+
+    @property
+    def vectors_cached(self) -> bool:
+        return isinstance(self._vectors, np.ndarray)
+
+    @property
+    def nbytes(self) -> int:
+        """视图常驻内存的字节数（首次访问时计算）"""
+        if self._nbytes is not None:
+            return self._nbytes
+        total = self.chunk_ids.nbytes + self.document_ids.nbytes
+        if isinstance(self._vectors, np.ndarray):
+            total += self._vectors.nbytes
+        elif isinstance(self._vectors, LazyVectors):
+            total += self._vectors.rows.nbytes
+        if isinstance(self.contents, LazyContents):
+            total += self.contents.chunk_ids.nbytes
+        else:
+            total += sum(sys.getsizeof(content) for content in self.contents) + 8 * len(self.contents)
+        self._nbytes = total
+        return total
+
+    def subset(self, positions) -> "CorpusView":
+        """按位置取出部分文本块（如满足过滤条件的文档），与原视图共享同一版本"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if isinstance(self.contents, LazyContents):
+            contents = self.contents.subset(positions)
+        else:
+            contents = [self.contents[i] for i in positions]
+        source = self._vectors
+        if isinstance(source, np.ndarray):
+            vectors: VectorsSource = source[positions]
+        elif isinstance(source, LazyVectors):
+            vectors = source.subset(positions)
+        elif source is not None:
+            vectors = lambda: source()[positions]  # noqa: E731
+        else:
+            vectors = None
+        return CorpusView(
+            self.version, self.chunk_ids[positions], self.document_ids[positions], contents, vectors
+        )
+
+
+_views: "OrderedDict[str, CorpusView]" = OrderedDict()
+_views_lock = threading.Lock()
+_build_locks: Dict[str, threading.Lock] = {}
+_config: Optional[Dict] = None
+
+
+def _get_config() -> Dict:
+    """缓存配置，首次使用时读取一次，检索时不再读取 config.json"""
+    global _config
+    config = _config
+    if config is None:
+        config = _config = get_corpus_cache_config()
+    return config
+
+
+def memory_budget_bytes() -> int:
+    """语料视图缓存的内存上限（字节）"""
+    return int(float(_get_config().get("max_memory_mb", 1024)) * 1024 * 1024)
+
+
+def _lookup(key: str, version) -> Optional[CorpusView]:
+    with _views_lock:
+        view = _views.get(key)
+        if view is None or view.version != version:
+            return None
+        _views.move_to_end(key)
+        return view
+
+
+def get_corpus_view(
+    db_path: str, version, build: Callable[[int], CorpusView]
+) -> CorpusView:
+    """
+    获取知识库指定语料版本的视图，缓存中没有或版本不同时调用 build(内存上限) 构建
+
+    同一知识库同时只有一个线程构建，其他线程等待后直接使用构建结果。
+    """
+    config = _get_config()
+    budget = memory_budget_bytes()
+    if not config.get("enabled", True):
+        return build(budget)
+    key = os.path.abspath(db_path)
+    view = _lookup(key, version)
+    if view is not None:
+        return view
+    with _views_lock:
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+    with build_lock:
+        view = _lookup(key, version)
+        if view is not None:
+            return view
+        view = build(budget)
+        size = view.nbytes
+        with _views_lock:
+            _views.pop(key, None)
+            if size <= budget:
+                _views[key] = view
+                # 超出上限时淘汰最近最少使用的其他知识库
+                used = sum(v.nbytes for v in _views.values())
+                while used > budget and len(_views) > 1:
+                    _, evicted = _views.popitem(last=False)
+                    used -= evicted.nbytes
+        print(
+            f"[corpus_cache] 构建语料视图: {len(view)} 个文本块，占用 {size / 1024 / 1024:.1f} MB"
+            f"（内容{'常驻' if view.contents_cached else '按需读取'}，"
+            f"向量{'常驻' if view.vectors_cached else '按需读取'}）"
+        )
+        return view
+
+
+def invalidate_corpus_view(db_path: str) -> bool:
+    """从缓存中移除知识库的语料视图，返回是否存在"""
+    with _views_lock:
+        return _views.pop(os.path.abspath(db_path), None) is not None
+
+
+def clear_corpus_cache():
+    """清空全部缓存的语料视图"""
+    with _views_lock:
+        _views.clear()
+
+
+def reset_corpus_cache():
+    """清空语料视图并在下次使用时重新读取配置（配置修改后或测试中使用）"""
+    global _config
+    with _views_lock:
+        _views.clear()
+        _config = None
+
+
+def list_cached_corpora() -> List[Dict]:
+    """列出缓存中的语料视图"""
+    with _views_lock:
+        views = list(_views.items())
+    return [
+        {
+            "db_path": key,
+            "version": view.version,
+            "chunk_count": len(view),
+            "memory_bytes": view.nbytes,
+            "contents_cached": view.contents_cached,
+            "vectors_cached": view.vectors_cached,
+        }
+        for key, view in views
+    ]
@@ -7,6 +7,7 @@ data_loader.py
 import os
 from .text_splitter import TextSplitter
 from .document_processor import DocumentProcessor
+from .near_duplicate import collapse_near_duplicates
 from utils.config import get_text_chunk_config
 
 
@@ -43,7 +44,10 @@ def load_documents_with_metadata(file_path, chunk_config=None, processor_config=
     :param file_path: 文档文件路径
     :param chunk_config: 切片配置字典
     :param processor_config: 预处理器配置字典
-    :return: Dict，包含文本块列表和元数据
+    :return: Dict，包含文本块列表和元数据；启用近似重复合并
+             （chunk_config 的 collapse_near_duplicates）时 near_duplicates 为合并报告，
+             aliases 为被合并的文本块
+             [{"content", "canonical": 保留文本块在 chunks 中的位置, "position": 合并前的位置}]
     """
     # 使用增强版文档预处理器
     processor = DocumentProcessor(processor_config)
@@ -58,8 +62,25 @@ def load_documents_with_metadata(file_path, chunk_config=None, processor_config=
     splitter = TextSplitter(chunk_config)
     chunks = splitter.split_text(content)
 
+    # 合并近似重复的文本块（重复的页眉页脚、模板段落等）
+    near_duplicates = None
+    aliases = []
+    if splitter.config.get("collapse_near_duplicates"):
+        near_duplicates = collapse_near_duplicates(
+            chunks, float(splitter.config.get("near_duplicate_threshold", 0.9))
+        )
+        # 被合并的文本块不单独向量化，入库时作为指向保留文本块的别名保存
+        duplicate_of = near_duplicates["duplicate_of"]
+        merged = sorted(p for group in near_duplicates["groups"] for p in group["positions"])
+        aliases = [
+            {"content": chunks[p], "canonical": duplicate_of[p], "position": p} for p in merged
+        ]
+        chunks = near_duplicates.pop("chunks")
+
     return {
         "chunks": chunks,
+        "aliases": aliases,
+        "near_duplicates": near_duplicates,
         "metadata": result["metadata"],
         "format": result.get("format", "unknown"),
         "processing_time": result.get("processing_time", 0),
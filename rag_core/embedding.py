@@ -4,108 +4,427 @@ embedding.py
 """
 
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 from utils.config import get_embedding_config
+from .embedding_cache import get_embedding_cache
+
+# 进程级 embedding 模型注册表：(模型路径, 设备) -> SentenceTransformer 实例
+_model_registry = {}
+_model_registry_lock = threading.Lock()
+_model_load_locks = {}
+_default_device = None
+
+# 进程级 SiliconFlow 客户端缓存：相同配置共享连接池和线程池
+_siliconflow_clients = {}
+_siliconflow_clients_lock = threading.Lock()
+
+
+class EmbeddingAPIError(Exception):
+    """
+    在线 embedding 调用在重试后仍有批次失败。
+
+    :ivar failed_indices: 失败文本在输入列表中的下标
+    :ivar embeddings: 与输入等长的结果列表，失败位置为 None
+    """
+
+    def __init__(self, message, failed_indices, embeddings):
+        super().__init__(message)
+        self.failed_indices = failed_indices
+        self.embeddings = embeddings
+
+
+class SiliconFlowEmbeddingClient:
+    """
+    SiliconFlow 在线 embedding 客户端
+
+    - 批量发送：每个请求的 input 为文本数组
+    - 连接复用：通过 Session 池复用 keep-alive 连接
+    - 并发控制：最多 max_workers 个请求同时进行
+    - 失败重试：失败批次进入重试队列，指数退避，结果保持输入顺序
+    """
+
+    def __init__(
+        self,
+        api_key,
+        model_name,
+        api_url,
+        batch_size=32,
+        max_workers=4,
+        max_retries=3,
+        backoff_factor=0.5,
+        timeout=30,
+    ):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.api_url = api_url
+        self.batch_size = max(1, int(batch_size))
+        self.max_workers = max(1, int(max_workers))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="siliconflow-embed"
+        )
+        # Session 池：每个并发请求独占一个 Session，请求结束后归还
+        self._sessions = queue.Queue()
+        for _ in range(self.max_workers):
+            self._sessions.put(self._create_session())
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def _post_batch(self, texts):
+        """发送一个批次，返回与 texts 顺序一致的向量列表"""
+        session = self._sessions.get()
+        try:
+            resp = session.post(
+                self.api_url,
+                json={"model": self.model_name, "input": texts},
+                timeout=self.timeout,
+            )
+            resp.raise_for_status()
+            data = resp.json()["data"]
+        finally:
+            self._sessions.put(session)
+        if len(data) != len(texts):
+            raise ValueError(f"返回向量数量 {len(data)} 与请求文本数量 {len(texts)} 不一致")
+        data = sorted(data, key=lambda item: item.get("index", 0))
+        return [item["embedding"] for item in data]
+
+    def embed(self, docs):
+        """
+        对文本列表进行向量化。
+        :param docs: List[str]
+        :return: List[List[float]]，与 docs 顺序一致
+        :raises EmbeddingAPIError: 重试耗尽后仍有批次失败
+        """
+        results = [None] * len(docs)
+        pending = [
+            (start, docs[start : start + self.batch_size])
+            for start in range(0, len(docs), self.batch_size)
+        ]
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if not pending:
+                break
+            if attempt > 0:
+                delay = self.backoff_factor * (2 ** (attempt - 1))
+                print(
+                    f"[embedding] {len(pending)} 个批次失败，{delay:.1f}秒后第 {attempt} 次重试"
+                )
+                time.sleep(delay)
+
+            futures = {
+                self._executor.submit(self._post_batch, texts): (start, texts)
+                for start, texts in pending
+            }
+            failed = []
+            for future, (start, texts) in futures.items():
+                try:
+                    results[start : start + len(texts)] = future.result()
+                except Exception as e:
+                    last_error = e
+                    failed.append((start, texts))
+            # 按原始位置排序，保证重试顺序稳定
+            pending = sorted(failed)
+
+        if pending:
+            failed_indices = [
+                start + i for start, texts in pending for i in range(len(texts))
+            ]
+            raise EmbeddingAPIError(
+                f"SiliconFlow API 调用失败: {len(failed_indices)}/{len(docs)} 个文本未能向量化 ({last_error})",
+                failed_indices,
+                results,
+            )
+        return results
+
+    def close(self):
+        """关闭线程池和所有连接"""
+        self._executor.shutdown(wait=False)
+        while not self._sessions.empty():
+            self._sessions.get_nowait().close()
+
+
+def get_siliconflow_client(api_key, model_name, api_url, **options):
+    """
+    获取进程内共享的 SiliconFlow 客户端（相同配置复用同一连接池）。
+    :param options: batch_size / max_workers / max_retries / backoff_factor / timeout
+    :return: SiliconFlowEmbeddingClient
+    """
+    key = (api_key, model_name, api_url, tuple(sorted(options.items())))
+    with _siliconflow_clients_lock:
+        client = _siliconflow_clients.get(key)
+        if client is None:
+            client = SiliconFlowEmbeddingClient(api_key, model_name, api_url, **options)
+            _siliconflow_clients[key] = client
+        return client
 
 
-def embed_with_siliconflow(docs, api_key, model_name, api_url):
+def close_siliconflow_clients():
+    """关闭并清空所有共享的 SiliconFlow 客户端"""
+    with _siliconflow_clients_lock:
+        for client in _siliconflow_clients.values():
+            client.close()
+        _siliconflow_clients.clear()
+
+
+def embed_with_siliconflow(docs, api_key, model_name, api_url, **options):
     """
     使用 SiliconFlow 在线 API 进行文本向量化。
     :param docs: List[str]
     :param api_key: str
     :param model_name: str
     :param api_url: str
+    :param options: 客户端参数，见 SiliconFlowEmbeddingClient
     :return: List[List[float]]
+    :raises EmbeddingAPIError: 部分批次重试后仍失败
     """
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    embeddings = []
-    for idx, doc in enumerate(docs):
-        payload = {
-            "model": model_name,
-            "input": doc
-        }
-        try:
-            resp = requests.post(api_url, headers=headers, json=payload, timeout=15)
-            resp.raise_for_status()
-            data = resp.json()
-            emb = data["data"][0]["embedding"]
-            embeddings.append(emb)
-        except Exception as e:
-            print(f"[embedding] SiliconFlow API 调用失败: {e}")
-            embeddings.append([0.0] * 8)  # fallback
+    if not docs:
+        return []
+    client = get_siliconflow_client(api_key, model_name, api_url, **options)
+    return client.embed(list(docs))
+
+
+def _get_default_device():
+    """检测默认推理设备（只检测一次）"""
+    global _default_device
+    if _default_device is None:
+        import torch
+
+        # 检查是否有可用的GPU，如果没有则使用CPU
+        _default_device = "cuda" if torch.cuda.is_available() else "cpu"
+    return _default_device
+
+
+def _resolve_local_model_path(model_name=None):
+    """
+    解析本地 embedding 模型路径。
+    :return: (model_name, use_cloud, default_local_path)
+    """
+    # 统一用项目根目录的绝对路径
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    default_local_path = os.path.join(project_root, "models", "all-MiniLM-L6-v2")
+    if model_name is None:
+        model_name = default_local_path
+    use_cloud = False  # 标记是否使用云端模型
+
+    if not os.path.isdir(model_name) and not (
+        model_name.startswith("sentence-transformers/")
+    ):
+        print(
+            f"[embedding] 本地模型目录不存在，自动切换为云模型: sentence-transformers/all-MiniLM-L6-v2"
+        )
+        model_name = "sentence-transformers/all-MiniLM-L6-v2"
+        use_cloud = True
+    return model_name, use_cloud, default_local_path
+
+
+def get_embedding_model(model_name=None, device=None):
+    """
+    获取已加载的 SentenceTransformer 模型，未加载时加载一次并放入注册表。
+    同一 (模型路径, 设备) 在进程内只加载一次，可被多个线程共享。
+    :param model_name: str，本地模型路径或模型名（如不指定则用 config）
+    :param device: str，推理设备（如不指定则自动检测）
+    :return: SentenceTransformer
+    """
+    if model_name is None:
+        _, config = get_embedding_config()
+        model_name = config.get("model_path")
+    model_name, use_cloud, default_local_path = _resolve_local_model_path(model_name)
+    if device is None:
+        device = _get_default_device()
+    key = (model_name, device)
+
+    model = _model_registry.get(key)
+    if model is not None:
+        return model
+
+    with _model_registry_lock:
+        load_lock = _model_load_locks.setdefault(key, threading.Lock())
+
+    # 按 key 加锁：同一模型只加载一次，不同模型可并行加载
+    with load_lock:
+        model = _model_registry.get(key)
+        if model is not None:
+            return model
+
+        from sentence_transformers import SentenceTransformer
+
+        print(f"[embedding] 加载模型: {model_name}，设备: {device}")
+        model = SentenceTransformer(model_name, device=device)
+
+        # 如果首次用云模型，自动保存到本地，便于后续离线加载
+        if use_cloud and not os.path.isdir(default_local_path):
+            print(f"[embedding] 正在将云端模型保存到本地: {default_local_path}")
+            model.save(default_local_path)
+
+        with _model_registry_lock:
+            _model_registry[key] = model
+        return model
+
+
+def warmup_embedding_model(model_name=None, device=None):
+    """
+    预热 embedding 模型：提前加载模型并执行一次编码，避免首个查询承担加载耗时。
+    :return: bool，预热是否成功
+    """
+    try:
+        model = get_embedding_model(model_name, device)
+        model.encode(["warmup"], show_progress_bar=False)
+        return True
+    except Exception as e:
+        print(f"[embedding] 模型预热失败: {e}")
+        return False
+
+
+def evict_embedding_model(model_name=None, device=None):
+    """
+    从注册表中移除已加载的模型，释放内存。
+    :param model_name: str，模型路径；为 None 时移除全部模型
+    :param device: str，设备；为 None 时移除该模型在所有设备上的实例
+    :return: int，移除的模型数量
+    """
+    with _model_registry_lock:
+        if model_name is None:
+            keys = list(_model_registry.keys())
+        else:
+            model_name, _, _ = _resolve_local_model_path(model_name)
+            keys = [
+                key
+                for key in _model_registry
+                if key[0] == model_name and (device is None or key[1] == device)
+            ]
+        for key in keys:
+            del _model_registry[key]
+            _model_load_locks.pop(key, None)
+    if keys:
+        print(f"[embedding] 已释放 {len(keys)} 个模型")
+    return len(keys)
+
+
+def list_loaded_embedding_models():
+    """
+    列出当前进程已加载的模型。
+    :return: List[Tuple[str, str]]，(模型路径, 设备)
+    """
+    with _model_registry_lock:
+        return list(_model_registry.keys())
+
+
+def get_embedding_model_id(model_name=None):
+    """
+    获取当前 embedding 模型的简短标识，如 "local:all-MiniLM-L6-v2"。
+    用于记录向量文件由哪个模型生成。
+    :return: str
+    """
+    provider, config = get_embedding_config()
+    if provider == "online":
+        model = config.get("model_name", "BAAI/bge-large-zh-v1.5")
+    else:
+        model = model_name or config.get("model_path") or "all-MiniLM-L6-v2"
+    return f"{provider}:{os.path.basename(os.path.normpath(model))}"
+
+
+def _embed_with_cache(provider, model_id, docs, compute):
+    """
+    先查询持久化缓存，只对未命中的文本调用 compute，并把新结果写回缓存。
+    :param compute: Callable[[List[str]], List[List[float]]]
+    :return: List[List[float]]
+    """
+    cache = get_embedding_cache()
+    if cache is None or not docs:
+        return compute(docs)
+
+    cached = cache.get_many(provider, model_id, docs)
+    missing = [i for i, vec in enumerate(cached) if vec is None]
+    print(f"[embedding] 缓存命中 {len(docs) - len(missing)}/{len(docs)}")
+    if missing:
+        # 同一批次内重复文本只计算一次
+        unique_texts = list(dict.fromkeys(docs[i] for i in missing))
+        computed = compute(unique_texts)
+        cache.put_many(provider, model_id, unique_texts, computed)
+        by_text = dict(zip(unique_texts, computed))
+        for i in missing:
+            cached[i] = by_text[docs[i]]
+    return [vec.tolist() if hasattr(vec, "tolist") else list(vec) for vec in cached]
+
+
+def _embed_local(docs, model_name):
+    """使用本地 SentenceTransformer 模型向量化"""
+    # 从注册表获取模型（进程内只加载一次）
+    model = get_embedding_model(model_name)
+
+    # 进行文本向量化
+    embeddings = model.encode(docs, show_progress_bar=False)
+    # 兼容 numpy/tensor 类型
+    if hasattr(embeddings, 'tolist'):
+        embeddings = embeddings.tolist()
+    elif isinstance(embeddings, list) and hasattr(embeddings[0], 'tolist'):
+        embeddings = [e.tolist() for e in embeddings]
+    if embeddings is not None and len(embeddings) > 0:
+        print(
+            f"[embedding] 输出向量数量: {len(embeddings)}，每个向量长度: {len(embeddings[0])}"
+        )
+    else:
+        print("[embedding] 输出为空")
     return embeddings
 
 
 def embed_documents(docs, model_name=None):
     """
     对文本列表进行向量化。根据 config 自动选择本地或在线 embedding。
+    已向量化过的文本直接从持久化缓存读取。
     :param docs: List[str]，文本分段
     :param model_name: str，手动指定本地模型路径（如不指定则用 config）
     :return: List[List[float]]
     """
     provider, config = get_embedding_config()
+    docs = list(docs)
     if provider == "online":
         print("[embedding] 使用 SiliconFlow 在线 embedding 服务")
         api_key = config.get("api_key", "")
         model_name = config.get("model_name", "BAAI/bge-large-zh-v1.5")
         api_url = config.get("api_url", "https://api.siliconflow.cn/v1/embeddings")
-        return embed_with_siliconflow(docs, api_key, model_name, api_url)
+        options = {
+            key: config[key]
+            for key in ("batch_size", "max_workers", "max_retries", "backoff_factor", "timeout")
+            if key in config
+        }
+        return _embed_with_cache(
+            provider,
+            model_name,
+            docs,
+            lambda texts: embed_with_siliconflow(
+                texts, api_key, model_name, api_url, **options
+            ),
+        )
     else:
         # 本地 embedding 逻辑
         if model_name is None:
             model_name = config.get("model_path")
-        # 统一用项目根目录的绝对路径
-        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        default_local_path = os.path.join(project_root, "models", "all-MiniLM-L6-v2")
-        if model_name is None:
-            model_name = default_local_path
-        use_cloud = False  # 标记是否使用云端模型
-
-        if not os.path.isdir(model_name) and not (
-            model_name.startswith("sentence-transformers/")
-        ):
-            print(
-                f"[embedding] 本地模型目录不存在，自动切换为云模型: sentence-transformers/all-MiniLM-L6-v2"
-            )
-            model_name = "sentence-transformers/all-MiniLM-L6-v2"
-            use_cloud = True
-        print(f"[embedding] 实际加载模型路径/名: {model_name}")
         print(f"[embedding] 输入文本数量: {len(docs)}")
         try:
-            from sentence_transformers import SentenceTransformer
-            import torch
-
-            # 检查是否有可用的GPU，如果没有则使用CPU
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            print(f"[embedding] 使用设备: {device}")
-
-            model = SentenceTransformer(model_name, device=device)
-
-            # 如果首次用云模型，自动保存到本地，便于后续离线加载
-            if use_cloud and not os.path.isdir(default_local_path):
-                print(f"[embedding] 正在将云端模型保存到本地: {default_local_path}")
-                model.save(default_local_path)
-
-            # 进行文本向量化
-            embeddings = model.encode(docs, show_progress_bar=False)
-            # 兼容 numpy/tensor 类型
-            if hasattr(embeddings, 'tolist'):
-                embeddings = embeddings.tolist()
-            elif isinstance(embeddings, list) and hasattr(embeddings[0], 'tolist'):
-                embeddings = [e.tolist() for e in embeddings]
-            if embeddings is not None and len(embeddings) > 0:
-                print(
-                    f"[embedding] 输出向量数量: {len(embeddings)}，每个向量长度: {len(embeddings[0])}"
-                )
-                print(
-                    f"[embedding] 向量类型: {type(embeddings)}, 单个向量类型: {type(embeddings[0])}"
-                )
-            else:
-                print("[embedding] 输出为空")
-            return embeddings
+            model_id = _resolve_local_model_path(model_name)[0]
+            return _embed_with_cache(
+                "local", model_id, docs, lambda texts: _embed_local(texts, model_name)
+            )
         except ImportError:
             # 未安装sentence-transformers时返回mock向量
             print("[embedding] 未安装sentence-transformers，返回mock向量")
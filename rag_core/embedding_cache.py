@@ -0,0 +1,244 @@
+"""
+embedding_cache.py
+持久化 embedding 缓存，按 (embedding 服务, 模型名, 文本SHA-256) 寻址，入库和检索共享。
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from typing import List, Dict, Optional, Sequence
+
+import numpy as np
+
+from utils.config import get_embedding_cache_config
+
+
+def text_hash(text: str) -> str:
+    """计算文本的 SHA-256 摘要"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    磁盘 embedding 缓存
+
+    支持功能：
+    - 内容寻址：相同文本在同一模型下只向量化一次
+    - float32 向量存储
+    - 条数上限 + 近似 LRU 淘汰（命中时的访问时间在内存中累积，写入或累积到一定数量时批量落盘）
+    - 命中/未命中计数
+    """
+
+    # 存储的访问时间比当前早不超过该秒数时，命中不再更新访问时间
+    access_update_interval = 60.0
+    # 累积的访问时间达到该条数时批量写回
+    access_flush_size = 1000
+
+    def __init__(self, db_path: str, max_entries: int = 200000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 待写回的访问时间：(provider, model_name, text_hash) -> last_access
+        self._pending_access: Dict[tuple, float] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_database()
+
+    def _init_database(self):
+        """初始化缓存表结构"""
+        with self._lock:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    provider TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (provider, model_name, text_hash)
+                )
+            """
+            )
+            self._conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access
+                ON embedding_cache (last_access)
+            """
+            )
+            self._conn.commit()
+
+    def get_many(
+        self, provider: str, model_name: str, texts: Sequence[str]
+    ) -> List[Optional[np.ndarray]]:
+        """
+        批量查询缓存
+
+        :return: 与 texts 等长的列表，未命中位置为 None
+        """
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        unique_hashes = list(set(hashes))
+        now = time.time()
+
+        with self._lock:
+            # SQLite 变量数上限，分批查询
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start : start + 500]
+                rows = self._conn.execute(
+                    """
+                    SELECT text_hash, vector, last_access FROM embedding_cache
+                    WHERE provider = ? AND model_name = ? AND text_hash IN ({})
+                    """.format(
+                        ",".join("?" * len(batch))
+                    ),
+                    [provider, model_name, *batch],
+                ).fetchall()
+                for h, blob, last_access in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+                    # 检索路径不写数据库：访问时间只在明显过期时记入内存，之后批量写回
+                    if now - last_access > self.access_update_interval:
+                        self._pending_access[(provider, model_name, h)] = now
+            if len(self._pending_access) >= self.access_flush_size:
+                self._flush_access()
+                self._conn.commit()
+
+            results = [found.get(h) for h in hashes]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(
+        self,
+        provider: str,
+        model_name: str,
+        texts: Sequence[str],
+        vectors: Sequence[Sequence[float]],
+    ):
+        """批量写入缓存，写入后按 LRU 淘汰超出上限的条目"""
+        if not texts:
+            return
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            arr = np.asarray(vector, dtype=np.float32)
+            rows.append(
+                (provider, model_name, text_hash(text), arr.shape[0], arr.tobytes(), now)
+            )
+
+        with self._lock:
+            # 淘汰按访问时间排序，先写回累积的访问时间
+            self._flush_access()
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO embedding_cache
+                (provider, model_name, text_hash, dim, vector, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _flush_access(self):
+        """把累积的访问时间写回数据库（调用方持有锁并负责提交）"""
+        if not self._pending_access:
+            return
+        self._conn.executemany(
+            """
+            UPDATE embedding_cache SET last_access = ?
+            WHERE provider = ? AND model_name = ? AND text_hash = ?
+            """,
+            [(t, *key) for key, t in self._pending_access.items()],
+        )
+        self._pending_access = {}
+
+    def _evict(self):
+        """淘汰最近最少使用的条目（调用方持有锁）"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                """
+                DELETE FROM embedding_cache WHERE rowid IN (
+                    SELECT rowid FROM embedding_cache ORDER BY last_access LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+            print(f"[embedding_cache] 淘汰 {overflow} 条缓存")
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM embedding_cache"
+            ).fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "database_path": self.db_path,
+        }
+
+    def clear(self):
+        """清空缓存和计数"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embedding_cache")
+            self._pending_access = {}
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        """写回累积的访问时间并关闭数据库连接"""
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
+
+
+_cache_instance: Optional[EmbeddingCache] = None
+_cache_initialized = False
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    获取进程内共享的 embedding 缓存，配置关闭时返回 None。
+
+    配置只在首次获取时读取，之后向量化不再读取 config.json；
+    修改配置后调用 reset_embedding_cache 使新配置生效。
+    """
+    global _cache_instance, _cache_initialized
+    if _cache_initialized:
+        return _cache_instance
+    with _cache_lock:
+        if not _cache_initialized:
+            config = get_embedding_cache_config()
+            if config.get("enabled", True):
+                _cache_instance = EmbeddingCache(
+                    os.path.abspath(config["path"]), int(config.get("max_entries", 200000))
+                )
+            _cache_initialized = True
+        return _cache_instance
+
+
+def reset_embedding_cache():
+    """关闭共享的 embedding 缓存，下次获取时重新读取配置（配置修改后或测试中使用）"""
+    global _cache_instance, _cache_initialized
+    with _cache_lock:
+        if _cache_instance is not None:
+            _cache_instance.close()
+        _cache_instance = None
+        _cache_initialized = False
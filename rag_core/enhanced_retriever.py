@@ -5,8 +5,9 @@ enhanced_retriever.py
 
 import re
 import json
+import threading
 import hashlib
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 from collections import defaultdict, Counter
 from datetime import datetime
 import numpy as np
@@ -36,6 +37,8 @@ class EnhancedRetriever:
         """
         self.history_file = Path(history_file)
         self.search_history = self._load_history()
+        # 知识库实例在请求线程间共享，写历史文件时串行
+        self._history_lock = threading.Lock()
         self.keyword_cache = {}  # 关键词缓存
 
     def _load_history(self) -> List[Dict]:
@@ -65,11 +68,15 @@ class EnhancedRetriever:
         top_k: int = 5,
         vector_weight: float = 0.7,
         keyword_weight: float = 0.3,
+        chunk_ids: Optional[Sequence[int]] = None,
+        document_ids: Optional[Sequence[int]] = None,
         **kwargs,
     ) -> List[Dict]:
         """
         混合检索：结合向量搜索和关键词搜索
 
+        两路结果按片段在 docs 中的位置融合，内容相同的片段（如不同文档中的相同段落）不会被合并。
+
         :param query: 查询文本
         :param doc_vectors: 文档向量列表
         :param docs: 原始文档片段
@@ -77,8 +84,10 @@ class EnhancedRetriever:
         :param top_k: 返回结果数量
         :param vector_weight: 向量搜索权重
         :param keyword_weight: 关键词搜索权重
+        :param chunk_ids: 与 docs 一一对应的文本块ID，结果中以 chunk_id 返回
+        :param document_ids: 与 docs 一一对应的文档ID，结果中以 document_id 返回
         :param kwargs: 其他检索参数
-        :return: 混合检索结果
+        :return: 混合检索结果，每项包含 position（在 docs 中的位置）、chunk_id、document_id
         """
         print(f"[enhanced_retriever] 开始混合检索: {query}")
 
@@ -95,7 +104,15 @@ class EnhancedRetriever:
             vector_results, keyword_results, vector_weight, keyword_weight, top_k
         )
 
-        # 4. 记录检索历史
+        # 4. 附上文本块和文档ID
+        for result in hybrid_results:
+            position = result["position"]
+            result["chunk_id"] = int(chunk_ids[position]) if chunk_ids is not None else None
+            result["document_id"] = (
+                int(document_ids[position]) if document_ids is not None else None
+            )
+
+        # 5. 记录检索历史
         self._record_search(query, hybrid_results)
 
         print(f"[enhanced_retriever] 混合检索完成，返回 {len(hybrid_results)} 个结果")
@@ -112,18 +129,19 @@ class EnhancedRetriever:
     ) -> List[Dict]:
         """向量搜索"""
         try:
-            # 使用原有的向量检索
-            retrieved_docs = vector_retrieve(
-                query, doc_vectors, docs, model_path, top_k, **kwargs
+            # 使用原有的向量检索，返回片段位置
+            positions = vector_retrieve(
+                query, doc_vectors, docs, model_path, top_k, return_indices=True, **kwargs
             )
 
             # 转换为统一格式
             results = []
-            for i, doc in enumerate(retrieved_docs):
+            for i, position in enumerate(positions):
                 results.append(
                     {
-                        "content": doc,
-                        "score": 1.0 - (i / len(retrieved_docs)),  # 简化分数计算
+                        "content": docs[position],
+                        "position": position,
+                        "score": 1.0 - (i / len(positions)),  # 简化分数计算
                         "source": "vector",
                         "rank": i + 1,
                     }
@@ -150,6 +168,7 @@ class EnhancedRetriever:
                     doc_scores.append(
                         {
                             "content": doc,
+                            "position": i,
                             "score": score,
                             "source": "keyword",
                             "rank": len(doc_scores) + 1,
@@ -237,15 +256,15 @@ class EnhancedRetriever:
         top_k: int,
     ) -> List[Dict]:
         """融合向量搜索和关键词搜索结果"""
-        # 创建文档到结果的映射
+        # 按片段位置建立结果映射
         doc_to_results = {}
 
         # 处理向量搜索结果
         for result in vector_results:
-            content = result["content"]
-            if content not in doc_to_results:
-                doc_to_results[content] = {
-                    "content": content,
+            position = result["position"]
+            if position not in doc_to_results:
+                doc_to_results[position] = {
+                    "content": result["content"],
                     "vector_score": result["score"],
                     "keyword_score": 0.0,
                     "vector_rank": result["rank"],
@@ -256,17 +275,17 @@ class EnhancedRetriever:
 
         # 处理关键词搜索结果
         for result in keyword_results:
-            content = result["content"]
-            if content in doc_to_results:
-                doc_to_results[content]["keyword_score"] = result["score"]
-                doc_to_results[content]["keyword_rank"] = result["rank"]
-                doc_to_results[content]["matched_keywords"] = result.get(
+            position = result["position"]
+            if position in doc_to_results:
+                doc_to_results[position]["keyword_score"] = result["score"]
+                doc_to_results[position]["keyword_rank"] = result["rank"]
+                doc_to_results[position]["matched_keywords"] = result.get(
                     "matched_keywords", []
                 )
-                doc_to_results[content]["source"] = "hybrid"
+                doc_to_results[position]["source"] = "hybrid"
             else:
-                doc_to_results[content] = {
-                    "content": content,
+                doc_to_results[position] = {
+                    "content": result["content"],
                     "vector_score": 0.0,
                     "keyword_score": result["score"],
                     "vector_rank": float("inf"),
@@ -277,7 +296,7 @@ class EnhancedRetriever:
 
         # 计算融合分数
         fused_results = []
-        for content, result in doc_to_results.items():
+        for position, result in doc_to_results.items():
             fused_score = (
                 vector_weight * result["vector_score"]
                 + keyword_weight * result["keyword_score"]
@@ -287,7 +306,8 @@ class EnhancedRetriever:
 
             fused_results.append(
                 {
-                    "content": content,
+                    "content": result["content"],
+                    "position": position,
                     "fused_score": fused_score,
                     "vector_score": result["vector_score"],
                     "keyword_score": result["keyword_score"],
@@ -316,15 +336,16 @@ class EnhancedRetriever:
             "query_hash": hashlib.md5(query.encode()).hexdigest(),
         }
 
-        # 添加到历史记录
-        self.search_history.append(search_record)
+        with self._history_lock:
+            # 添加到历史记录
+            self.search_history.append(search_record)
 
-        # 保持历史记录数量限制（最多1000条）
-        if len(self.search_history) > 1000:
-            self.search_history = self.search_history[-1000:]
+            # 保持历史记录数量限制（最多1000条）
+            if len(self.search_history) > 1000:
+                self.search_history = self.search_history[-1000:]
 
-        # 保存历史记录
-        self._save_history()
+            # 保存历史记录
+            self._save_history()
 
     def get_search_suggestions(self, partial_query: str, limit: int = 5) -> List[str]:
         """获取搜索建议"""
@@ -350,8 +371,9 @@ class EnhancedRetriever:
 
     def clear_search_history(self):
         """清空检索历史"""
-        self.search_history = []
-        self._save_history()
+        with self._history_lock:
+            self.search_history = []
+            self._save_history()
 
     def export_results(
         self, results: List[Dict], format: str = "json", file_path: Optional[str] = None
@@ -0,0 +1,266 @@
+"""
+index_cache.py
+进程内FAISS索引缓存：同一知识库的索引只加载一次，在所有请求线程间共享；
+按索引文件版本发现其他进程写入的新索引，后台加载完成后再替换。
+
+索引以快照（generation）发布：写入方复制出下一代修改后原子替换，
+检索方在整个查询期间固定使用同一代，不等待写入；旧的一代在没有检索方使用后释放。
+已删除（墓碑）的向量在快照中以ID掩码排除，压缩时才从索引和向量文件中真正移除。
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from . import index_factory
+
+if index_factory.FAISS_AVAILABLE:
+    import faiss  # type: ignore
+
+
+def file_version(path: str) -> Optional[Tuple[int, int, int]]:
+    """索引文件版本：(修改时间, 大小, inode)，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class Snapshot:
+    """
+    一代已发布的索引，发布后不再修改
+
+    - base：主索引（来自索引文件或重建）
+    - delta：base 之后新增向量组成的小型Flat索引，写回索引文件时并入 base
+    - tombstones：已删除文本块的chunk_id，搜索时排除
+
+    新增向量只需复制 delta 再发布，不必复制整个主索引。
+    """
+
+    def __init__(self, generation: int, base, delta=None, tombstones: Optional[np.ndarray] = None):
+        self.generation = generation
+        self.base = base
+        self.delta = delta
+        self.tombstones = (
+            tombstones if tombstones is not None else np.zeros(0, dtype=np.int64)
+        )
+        self.readers = 0  # 固定使用这一代的查询数
+        self._tombstone_selector = None
+
+    def _mask(self, selector):
+        """在过滤器上叠加墓碑掩码（IDSelectorBatch 每代只构建一次）"""
+        if len(self.tombstones) == 0:
+            return selector
+        if self._tombstone_selector is None:
+            batch = faiss.IDSelectorBatch(self.tombstones)
+            # 保留 batch 的引用，FAISS 的 IDSelectorNot 不持有它
+            self._tombstone_selector = (faiss.IDSelectorNot(batch), batch)
+        masked = self._tombstone_selector[0]
+        if selector is None:
+            return masked
+        combined = faiss.IDSelectorAnd(selector, masked)
+        combined.referenced_objects = [selector, masked]
+        return combined
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + (self.delta.ntotal if self.delta is not None else 0)
+
+    @property
+    def d(self) -> int:
+        return self.base.d
+
+    def search(self, queries: np.ndarray, k: int, config: Optional[Dict] = None, selector=None):
+        """
+        在 base 和 delta 上搜索并合并结果
+
+        :param config: 索引配置，传入时显式带上 nprobe / efSearch 等查询参数
+        :param selector: FAISS ID过滤器
+        :return: (distances, ids)，与 faiss 的 search 一致
+        """
+        selector = self._mask(selector)
+        indexes = [self.base]
+        if self.delta is not None and self.delta.ntotal:
+            indexes.append(self.delta)
+        results = []
+        for index in indexes:
+            params = None
+            if config is not None or selector is not None:
+                params = index_factory.make_search_params(index, config or {}, selector)
+            results.append(index.search(queries, k, params=params))
+        if len(results) == 1:
+            return results[0]
+        distances = np.concatenate([r[0] for r in results], axis=1)
+        ids = np.concatenate([r[1] for r in results], axis=1)
+        # 内积越大越相似，L2距离越小越相似；无效结果的距离为极值，排在最后
+        keys = -distances if index_factory.uses_inner_product(self.base) else distances
+        order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class IndexHandle:
+    """
+    一个知识库索引在进程内的共享状态
+
+    所有VectorStore实例通过同一个handle读写索引：
+    - 写入方（入库、删除、重建、写回文件）持有 lock，修改副本后用 publish 发布新一代
+    - 检索方用 pin 固定当前一代，不需要 lock，不会被写入阻塞
+    - 压缩替换向量文件时用 exclusive 等待进行中的查询结束，替换期间新查询短暂等待
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.lock = threading.RLock()
+        self.snapshot: Optional[Snapshot] = None  # 当前发布的一代
+        self.generation = 0
+        self.retired: Dict[int, Snapshot] = {}  # 已被替换但仍有查询在使用的旧代
+        self._pin_lock = threading.Condition()
+        self._local = threading.local()
+        self.active_readers = 0  # 进行中的查询数（含未使用FAISS的查询）
+        self._exclusive = False
+        self.compacting = False  # 是否正在压缩
+        self.loaded = False  # 是否已尝试加载
+        self.mmapped = False  # base 是否以只读mmap方式加载
+        self.indexed_rows = 0  # 索引已覆盖的向量文件行数
+        self.unsaved_vectors = 0  # 已加入索引但尚未写回文件的向量数
+        self.file_version: Optional[Tuple[int, int, int]] = None  # 当前索引对应的文件版本
+        self.last_check = 0.0  # 上次检查文件版本的时间
+        self.reloading = False  # 是否正在后台加载新版本
+
+    @property
+    def index(self) -> Optional[Snapshot]:
+        """当前发布的一代（未加载时为None）"""
+        return self.snapshot
+
+    def publish(
+        self, base, delta=None, tombstones: Optional[np.ndarray] = None
+    ) -> Optional[Snapshot]:
+        """
+        原子发布新一代索引（调用方需持有 lock）；旧一代仍有查询使用时保留到查询结束
+
+        :param base: 主索引，None 表示清空
+        :param tombstones: 墓碑chunk_id，None 表示沿用当前一代的墓碑
+        """
+        with self._pin_lock:
+            old = self.snapshot
+            if tombstones is None and old is not None:
+                tombstones = old.tombstones
+            if base is None:
+                self.snapshot = None
+            else:
+                self.generation += 1
+                self.snapshot = Snapshot(self.generation, base, delta, tombstones)
+            if old is not None and old.readers > 0:
+                self.retired[old.generation] = old
+            return self.snapshot
+
+    @contextmanager
+    def pin(self) -> Iterator[Optional[Snapshot]]:
+        """
+        在查询期间固定当前一代，期间发布的新一代不影响本次查询；
+        同时保证查询期间向量文件和数据库中的行号不被压缩改写。同一线程可嵌套调用
+        """
+        depth = getattr(self._local, "depth", 0)
+        with self._pin_lock:
+            while self._exclusive and depth == 0:
+                self._pin_lock.wait()
+            self.active_readers += 1
+            snapshot = self.snapshot
+            if snapshot is not None:
+                snapshot.readers += 1
+        self._local.depth = depth + 1
+        try:
+            yield snapshot
+        finally:
+            self._local.depth = depth
+            with self._pin_lock:
+                self.active_readers -= 1
+                if snapshot is not None:
+                    snapshot.readers -= 1
+                    if snapshot.readers == 0 and snapshot is not self.snapshot:
+                        # 最后一个查询结束，释放旧一代
+                        self.retired.pop(snapshot.generation, None)
+                if self.active_readers == 0:
+                    self._pin_lock.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """等待进行中的查询全部结束，并在退出前暂停新查询（调用方需持有 lock）"""
+        with self._pin_lock:
+            self._exclusive = True
+            while self.active_readers:
+                self._pin_lock.wait()
+        try:
+            yield
+        finally:
+            with self._pin_lock:
+                self._exclusive = False
+                self._pin_lock.notify_all()
+
+    def reset(self):
+        """丢弃已加载的索引，下次访问时重新加载"""
+        with self.lock:
+            self.publish(None)
+            self.loaded = False
+            self.mmapped = False
+            self.indexed_rows = 0
+            self.unsaved_vectors = 0
+            self.file_version = None
+            self.last_check = 0.0
+
+
+_handles: Dict[str, IndexHandle] = {}
+_handles_lock = threading.Lock()
+
+
+def get_index_handle(index_path: str) -> IndexHandle:
+    """获取索引文件对应的共享handle（按绝对路径区分知识库）"""
+    key = os.path.abspath(index_path)
+    with _handles_lock:
+        handle = _handles.get(key)
+        if handle is None:
+            handle = IndexHandle(key)
+            _handles[key] = handle
+        return handle
+
+
+def evict_index(index_path: str) -> bool:
+    """从缓存中移除索引，返回是否存在"""
+    with _handles_lock:
+        handle = _handles.pop(os.path.abspath(index_path), None)
+    if handle is None:
+        return False
+    handle.reset()
+    return True
+
+
+def clear_index_cache():
+    """清空全部缓存的索引"""
+    with _handles_lock:
+        handles = list(_handles.values())
+        _handles.clear()
+    for handle in handles:
+        handle.reset()
+
+
+def list_cached_indexes() -> List[Dict]:
+    """列出缓存中的索引及其向量数"""
+    with _handles_lock:
+        handles = list(_handles.values())
+    return [
+        {
+            "index_path": handle.index_path,
+            "loaded": handle.snapshot is not None,
+            "vector_count": handle.snapshot.ntotal if handle.snapshot is not None else 0,
+            "generation": handle.generation,
+            "retired_generations": len(handle.retired),
+            "tombstones": len(handle.snapshot.tombstones) if handle.snapshot is not None else 0,
+            "mmapped": handle.mmapped,
+            "unsaved_vectors": handle.unsaved_vectors,
+        }
+        for handle in handles
+    ]
@@ -0,0 +1,288 @@
+"""
+index_factory.py
+FAISS索引工厂，支持 Flat / IVF-Flat / HNSW / IVF-PQ，并可按向量规模自动选择索引类型；
+Flat / IVF-Flat / HNSW 可用 float16 或 int8 标量量化存储向量。
+"""
+
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+try:
+    import faiss  # type: ignore
+
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+# cosine：向量归一化后用内积索引；ip：原始向量内积；l2：欧氏距离
+METRICS = ("cosine", "ip", "l2")
+# 向量存储类型：float32 原始向量；float16 半精度；int8 标量量化（需训练各维取值范围）
+VECTOR_DTYPES = ("float32", "float16", "int8")
+VECTOR_DTYPE_BYTES = {"float32": 4, "float16": 2, "int8": 1}
+
+# 默认索引配置，可在每个知识库的 index_config.json 中覆盖
+DEFAULT_INDEX_CONFIG = {
+    "index_type": "auto",  # auto / flat / ivf_flat / hnsw / ivf_pq
+    "metric": "cosine",  # 相似度度量：cosine / ip / l2，新建知识库时记录
+    "memory_budget_mb": 2048,  # auto 模式下索引可用的内存预算
+    "nlist": None,  # IVF 聚类中心数，None 表示按向量数自动计算
+    "nprobe": 16,  # IVF 查询时访问的聚类数
+    "hnsw_m": 32,  # HNSW 每个节点的连接数
+    "ef_construction": 200,  # HNSW 构建时的候选数
+    "ef_search": 64,  # HNSW 查询时的候选数
+    "pq_m": None,  # PQ 子空间数，None 表示按维度自动计算
+    "pq_nbits": 8,  # PQ 每个子空间的编码位数
+    "vector_dtype": "float32",  # 索引的向量存储类型：float32 / float16 / int8，压缩时向量文件按 float16 存储
+    "rescore_factor": 4,  # 有损索引（压缩存储、IVF-PQ）先取 top_k x 该倍数个候选，再用向量文件精确重排
+}
+
+# 向量数低于该值时暴力搜索已足够快
+FLAT_MAX_VECTORS = 50000
+# 向量数低于该值且内存允许时优先使用 HNSW
+HNSW_MAX_VECTORS = 2000000
+# int8 量化器训练各维取值范围所需的最少向量数，不足时索引暂用 float32
+SQ8_MIN_TRAIN_VECTORS = 1000
+
+
+def default_nlist(n_vectors: int) -> int:
+    """按向量数计算 IVF 聚类中心数（约 4·sqrt(n)，且每个中心至少39个训练样本）"""
+    if n_vectors <= 0:
+        return 1
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def default_pq_m(dim: int) -> int:
+    """按维度选择 PQ 子空间数：不超过64且能整除维度的最大值"""
+    for m in range(min(64, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def min_train_vectors(index_type: str, n_vectors: int, config: Dict) -> int:
+    """索引类型所需的最少训练向量数"""
+    if index_type == "ivf_flat":
+        return 39 * (config.get("nlist") or default_nlist(n_vectors))
+    if index_type == "ivf_pq":
+        nlist = config.get("nlist") or default_nlist(n_vectors)
+        return max(39 * nlist, 2 ** config.get("pq_nbits", 8))
+    return 0
+
+
+def estimate_memory_bytes(index_type: str, n_vectors: int, dim: int, config: Dict) -> int:
+    """估算索引常驻内存（字节），包含 chunk_id 映射"""
+    id_map = n_vectors * 16
+    vector_bytes = dim * VECTOR_DTYPE_BYTES[config.get("vector_dtype", "float32")]
+    if index_type == "flat":
+        return n_vectors * vector_bytes + id_map
+    if index_type == "hnsw":
+        links = n_vectors * config.get("hnsw_m", 32) * 2 * 4
+        return n_vectors * vector_bytes + links + id_map
+    nlist = config.get("nlist") or default_nlist(n_vectors)
+    centroids = nlist * dim * 4
+    if index_type == "ivf_flat":
+        return n_vectors * (vector_bytes + 8) + centroids + id_map
+    if index_type == "ivf_pq":
+        m = config.get("pq_m") or default_pq_m(dim)
+        code_size = math.ceil(m * config.get("pq_nbits", 8) / 8)
+        codebooks = dim * (2 ** config.get("pq_nbits", 8)) * 4
+        return n_vectors * (code_size + 8) + centroids + codebooks + id_map
+    raise ValueError(f"不支持的索引类型: {index_type}")
+
+
+def select_index_type(n_vectors: int, dim: int, config: Optional[Dict] = None) -> str:
+    """
+    根据向量数和内存预算选择索引类型
+
+    - 小规模：flat（精确搜索）
+    - 中等规模且内存允许：hnsw
+    - 内存放得下原始向量：ivf_flat
+    - 否则：ivf_pq（压缩编码）
+    """
+    config = {**DEFAULT_INDEX_CONFIG, **(config or {})}
+    budget = config["memory_budget_mb"] * 1024 * 1024
+    if n_vectors < FLAT_MAX_VECTORS:
+        return "flat"
+    if n_vectors < HNSW_MAX_VECTORS and estimate_memory_bytes("hnsw", n_vectors, dim, config) <= budget:
+        return "hnsw"
+    if estimate_memory_bytes("ivf_flat", n_vectors, dim, config) <= budget:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def resolve_index_type(n_vectors: int, dim: int, config: Optional[Dict] = None) -> str:
+    """
+    解析实际使用的索引类型：auto 按规模选择；
+    需要训练的类型在向量不足时暂用 flat
+    """
+    config = {**DEFAULT_INDEX_CONFIG, **(config or {})}
+    index_type = config["index_type"]
+    if index_type == "auto":
+        index_type = select_index_type(n_vectors, dim, config)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}")
+    if n_vectors < min_train_vectors(index_type, n_vectors, config):
+        return "flat"
+    return index_type
+
+
+def resolve_vector_dtype(index_type: str, n_vectors: int, config: Optional[Dict] = None) -> str:
+    """
+    解析索引实际使用的存储类型：IVF-PQ 自带压缩编码，按 float32 处理；
+    int8 在训练样本不足时暂用 float32
+    """
+    config = {**DEFAULT_INDEX_CONFIG, **(config or {})}
+    dtype = config["vector_dtype"]
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"不支持的向量存储类型: {dtype}")
+    if index_type == "ivf_pq":
+        return "float32"
+    if dtype == "int8" and n_vectors < SQ8_MIN_TRAIN_VECTORS:
+        return "float32"
+    return dtype
+
+
+def vector_file_dtype(vector_dtype: str) -> str:
+    """
+    向量文件的存储类型：压缩索引时按 float16 存储，作为精确重排的数据来源；
+    向量文件经mmap按需读取，不常驻内存，int8 的精度损失留在索引内由重排弥补
+    """
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"不支持的向量存储类型: {vector_dtype}")
+    return "float32" if vector_dtype == "float32" else "float16"
+
+
+def _quantizer_type(dtype: str):
+    return faiss.ScalarQuantizer.QT_fp16 if dtype == "float16" else faiss.ScalarQuantizer.QT_8bit
+
+
+def faiss_metric(metric: str) -> int:
+    """度量对应的FAISS度量类型（cosine 使用归一化向量上的内积）"""
+    if metric not in METRICS:
+        raise ValueError(f"不支持的相似度度量: {metric}")
+    return faiss.METRIC_L2 if metric == "l2" else faiss.METRIC_INNER_PRODUCT
+
+
+def create_index(index_type: str, dim: int, n_vectors: int = 0, config: Optional[Dict] = None):
+    """
+    创建空索引（外层包装 IndexIDMap2，向量以 chunk_id 为ID）
+
+    :param index_type: flat / ivf_flat / hnsw / ivf_pq
+    :param dim: 向量维度
+    :param n_vectors: 预计向量数，用于计算 nlist
+    :param config: 索引配置，vector_dtype 应为 resolve_vector_dtype 解析后的存储类型
+    :return: faiss.IndexIDMap2
+    """
+    config = {**DEFAULT_INDEX_CONFIG, **(config or {})}
+    metric = faiss_metric(config["metric"])
+    dtype = config["vector_dtype"]
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"不支持的向量存储类型: {dtype}")
+    compressed = dtype != "float32"
+    if index_type == "flat":
+        if compressed:
+            inner = faiss.IndexScalarQuantizer(dim, _quantizer_type(dtype), metric)
+        else:
+            inner = faiss.IndexFlat(dim, metric)
+    elif index_type == "hnsw":
+        if compressed:
+            inner = faiss.IndexHNSWSQ(dim, _quantizer_type(dtype), config["hnsw_m"], metric)
+        else:
+            inner = faiss.IndexHNSWFlat(dim, config["hnsw_m"], metric)
+        inner.hnsw.efConstruction = config["ef_construction"]
+    elif index_type == "ivf_flat":
+        nlist = config["nlist"] or default_nlist(n_vectors)
+        if compressed:
+            inner = faiss.IndexIVFScalarQuantizer(
+                faiss.IndexFlat(dim, metric), dim, nlist, _quantizer_type(dtype), metric
+            )
+        else:
+            inner = faiss.IndexIVFFlat(faiss.IndexFlat(dim, metric), dim, nlist, metric)
+    elif index_type == "ivf_pq":
+        nlist = config["nlist"] or default_nlist(n_vectors)
+        m = config["pq_m"] or default_pq_m(dim)
+        inner = faiss.IndexIVFPQ(
+            faiss.IndexFlat(dim, metric), dim, nlist, m, config["pq_nbits"], metric
+        )
+    else:
+        raise ValueError(f"不支持的索引类型: {index_type}")
+    index = faiss.IndexIDMap2(inner)
+    apply_search_params(index, config)
+    return index
+
+
+def get_inner_index(index):
+    """取出 IndexIDMap 包装的实际索引"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return faiss.downcast_index(index)
+
+
+def index_type_of(index) -> str:
+    """识别索引类型"""
+    inner = get_inner_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, (faiss.IndexIVFFlat, faiss.IndexIVFScalarQuantizer)):
+        return "ivf_flat"
+    return "flat"
+
+
+def vector_dtype_of(index) -> str:
+    """识别索引的向量存储类型（IVF-PQ 视为 float32）"""
+    inner = get_inner_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16:
+            return "float16"
+        return "int8"
+    return "float32"
+
+
+def needs_rescore(index) -> bool:
+    """索引分数是否有损（压缩存储或PQ编码），需要用原始向量重排"""
+    return vector_dtype_of(index) != "float32" or index_type_of(index) == "ivf_pq"
+
+
+def uses_inner_product(index) -> bool:
+    """索引是否按内积排序（cosine / ip）"""
+    return get_inner_index(index).metric_type == faiss.METRIC_INNER_PRODUCT
+
+
+def apply_search_params(index, config: Dict):
+    """设置查询参数：IVF 的 nprobe、HNSW 的 efSearch"""
+    config = {**DEFAULT_INDEX_CONFIG, **(config or {})}
+    inner = get_inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(config["nprobe"], inner.nlist)
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = config["ef_search"]
+
+
+def make_search_params(index, config: Dict, selector=None):
+    """
+    构造单次查询的搜索参数，携带ID过滤器（IDSelector）；
+    IVF / HNSW 的参数对象需显式带上 nprobe / efSearch，否则会使用FAISS默认值
+    """
+    config = {**DEFAULT_INDEX_CONFIG, **(config or {})}
+    inner = get_inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=min(config["nprobe"], inner.nlist))
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=config["ef_search"])
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return params
+
+
+def sample_for_training(matrix, rows: np.ndarray, max_samples: int) -> np.ndarray:
+    """从向量矩阵中均匀抽取训练样本"""
+    if len(rows) > max_samples:
+        rows = rows[np.linspace(0, len(rows) - 1, max_samples).astype(np.int64)]
+    return np.ascontiguousarray(matrix[np.sort(rows)], dtype=np.float32)
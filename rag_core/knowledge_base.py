@@ -3,10 +3,13 @@ knowledge_base.py
 知识库管理器，整合文档处理、向量化和存储功能。
 """
 
+import atexit
 import os
 import shutil
-import sqlite3
-from typing import List, Dict, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 from datetime import datetime
 
@@ -15,11 +18,12 @@ from .data_loader import (
     load_documents_with_metadata,
     get_supported_formats,
 )
-from .embedding import embed_documents
+from .embedding import embed_documents, get_embedding_model_id
 from .text_splitter import TextSplitter
-from .vector_store import VectorStore
+from .vector_store import VectorStore, chunk_hash, document_hash
+from .sharded_vector_store import ShardedVectorStore, read_num_shards, write_num_shards
 from .enhanced_retriever import create_enhanced_retriever
-from utils.config import get_text_chunk_config
+from utils.config import get_kb_registry_config, get_text_chunk_config
 from utils.chunk_config import (
     get_default_chunk_config,
     get_recommended_configs,
@@ -38,12 +42,19 @@ class KnowledgeBase:
     - 文档版本管理
     """
 
-    def __init__(self, kb_name: str = "default", base_path: str = "knowledge_base"):
+    def __init__(
+        self,
+        kb_name: str = "default",
+        base_path: str = "knowledge_base",
+        num_shards: Optional[int] = None,
+    ):
         """
         初始化知识库
 
         :param kb_name: 知识库名称
         :param base_path: 知识库基础路径
+        :param num_shards: 新建知识库时按文档哈希分成的分片数（>1 时启用分片），
+                           已有知识库沿用创建时的分片数
         """
         self.kb_name = kb_name
         self.base_path = Path(base_path)
@@ -55,7 +66,8 @@ class KnowledgeBase:
         self.vectors_path.mkdir(parents=True, exist_ok=True)
 
         # 初始化组件
-        self.vector_store = VectorStore(str(self.vectors_path / "vector_store.db"))
+        self.num_shards = self._resolve_num_shards(num_shards)
+        self.vector_store = self._create_vector_store()
         self.text_splitter = TextSplitter()
         self.enhanced_retriever = create_enhanced_retriever(
             str(self.base_path / f"{kb_name}_search_history.json")
@@ -65,6 +77,29 @@ class KnowledgeBase:
         print(f"[knowledge_base] 文档路径: {self.documents_path}")
         print(f"[knowledge_base] 向量路径: {self.vectors_path}")
 
+    def _resolve_num_shards(self, num_shards: Optional[int]) -> int:
+        """确定知识库的分片数：已记录的分片数优先，已有未分片数据的知识库保持不分片"""
+        recorded = read_num_shards(str(self.vectors_path))
+        if recorded is not None:
+            if num_shards and num_shards != recorded:
+                print(
+                    f"[knowledge_base] 警告: 知识库已按 {recorded} 个分片创建，忽略 num_shards={num_shards}"
+                )
+            return recorded
+        if not num_shards or num_shards <= 1:
+            return 1
+        if (self.vectors_path / "vector_store.db").exists():
+            print("[knowledge_base] 警告: 知识库已有未分片的数据，忽略 num_shards")
+            return 1
+        write_num_shards(str(self.vectors_path), num_shards)
+        return num_shards
+
+    def _create_vector_store(self):
+        """按分片数创建向量存储"""
+        if self.num_shards > 1:
+            return ShardedVectorStore(str(self.vectors_path / "shards"), self.num_shards)
+        return VectorStore(str(self.vectors_path / "vector_store.db"))
+
     def add_document(
         self,
         file_path: str,
@@ -85,102 +120,47 @@ class KnowledgeBase:
             raise FileNotFoundError(f"文档不存在: {file_path}")
 
         original_filename = os.path.basename(file_path)
-        filename = original_filename
-        dest_path = self.documents_path / filename
-        # 如有重名，自动加后缀
-        count = 1
-        while dest_path.exists():
-            stem, suffix = os.path.splitext(original_filename)
-            filename = f"{stem}_{count}{suffix}"
-            dest_path = self.documents_path / filename
-            count += 1
+        dest_path = None
         print(f"[knowledge_base] 开始处理文档: {original_filename}")
 
         try:
-            # 1. 复制文档到知识库
-            shutil.copy2(file_path, dest_path)
-            print(f"[knowledge_base] 文档已复制到: {dest_path}")
-
-            # 2. 验证和合并切片配置
-            if chunk_config:
-                # 验证用户配置
-                errors = validate_chunk_config(chunk_config)
-                if errors:
-                    print(f"[knowledge_base] 切片配置验证警告: {errors}")
-
-                # 创建文档专用的切片器
-                doc_splitter = TextSplitter(chunk_config)
-            else:
-                doc_splitter = self.text_splitter
+            # 1. 内容相同的文件已入库时直接返回已有文档，不再复制、解析和向量化
+            content_hash = document_hash(file_path)
+            existing_id = self.vector_store.find_document_by_hash(content_hash)
+            if existing_id is not None:
+                return self._build_duplicate_result(existing_id, original_filename)
 
-            # 使用新的文档加载函数，获取详细元数据
-            doc_result = load_documents_with_metadata(
-                str(dest_path), doc_splitter.config, processor_config
-            )
+            # 2. 复制文档到知识库
+            dest_path, _ = self._copy_into_kb(file_path)
+
+            # 3. 验证切片配置并切片
+            doc_result = self._load_chunks(dest_path, chunk_config, processor_config)
             chunks = doc_result["chunks"]
 
             if not chunks:
+                dest_path.unlink()
                 return {"success": False, "error": "文档分段失败，未提取到有效内容", "filename": original_filename}
 
-            print(
-                f"[knowledge_base] 文档预处理完成，格式: {doc_result.get('format', 'unknown')}"
+            # 4. 向量化文档（已有相同内容的文本块复用其向量）
+            embeddings = self._embed_new_chunks([chunks], [content_hash], embedding_provider)[0]
+            vectors_count = sum(1 for e in embeddings if e is not None)
+            print(f"[knowledge_base] 向量化完成，共 {vectors_count} 个向量")
+
+            # 5. 存储到向量数据库（数据库filename字段始终用原始名）
+            document_id = self.vector_store.add_document(
+                str(dest_path),
+                chunks,
+                embeddings,
+                filename=original_filename,
+                model_id=get_embedding_model_id(),
+                content_hash=content_hash,
+                aliases=doc_result.get("aliases"),
             )
-            print(f"[knowledge_base] 文档切片完成，共 {len(chunks)} 个文本块")
-            print(
-                f"[knowledge_base] 处理时间: {doc_result.get('processing_time', 0):.2f}秒"
-            )
-
-            # 3. 向量化文档
-            # 如果指定 embedding_provider，则临时 patch config
-            if embedding_provider:
-                from unittest.mock import patch
-                from rag_core import embedding as embedding_mod
-                with patch("utils.config.get_embedding_config") as mock_get_config:
-                    import utils.config as config_mod
-                    provider, config = config_mod.get_embedding_config()
-                    # 用指定 provider 替换
-                    if embedding_provider == "local":
-                        provider = "local"
-                    elif embedding_provider == "online":
-                        provider = "online"
-                    mock_get_config.return_value = (provider, config_mod.load_global_config().get("embedding_configs", {}).get(provider, {}))
-                    embeddings = embedding_mod.embed_documents(chunks)
-            else:
-                embeddings = embed_documents(chunks)
-            print(f"[knowledge_base] 向量化完成，共 {len(embeddings)} 个向量")
-
-            # 4. 存储到向量数据库（数据库filename字段始终用原始名）
-            result_or_id = self.vector_store.add_document(
-                str(dest_path), chunks, embeddings, filename=original_filename
-            )
-            document_id = result_or_id
-
-            # 5. 获取文档信息
-            doc_info = self.vector_store.get_document_info(document_id)
-            if doc_info:
-                doc_info["filename"] = original_filename
-                # 添加预处理元数据
-                doc_info["format"] = doc_result.get("format", "unknown")
-                doc_info["processing_time"] = doc_result.get("processing_time", 0)
-                doc_info["original_metadata"] = doc_result.get("metadata", {})
-
-            result = {
-                "success": True,
-                "document_id": document_id,
-                "filename": original_filename,
-                "chunks_count": len(chunks),
-                "vectors_count": len(embeddings),
-                "file_size": os.path.getsize(dest_path),
-                "created_at": datetime.now().isoformat(),
-                "document_info": doc_info,
-                "format": doc_result.get("format", "unknown"),
-                "processing_time": doc_result.get("processing_time", 0),
-            }
 
-            print(
-                f"[knowledge_base] 文档添加成功: {original_filename} (ID: {document_id})"
+            # 6. 获取文档信息
+            return self._build_add_result(
+                document_id, original_filename, dest_path, doc_result, vectors_count
             )
-            return result
 
         except RuntimeError as e:
             # 捕获 embedding 维度变更自动清空的提示
@@ -190,13 +170,300 @@ class KnowledgeBase:
             print(f"[knowledge_base] 文档添加失败: {repr(e)}")
             traceback.print_exc()
             # 清理已复制的文件
-            if dest_path.exists():
+            if dest_path is not None and dest_path.exists():
                 dest_path.unlink()
 
             return {"success": False, "error": str(e), "filename": original_filename}
 
+    def add_documents(
+        self,
+        file_paths: List[str],
+        chunk_config: Optional[Dict] = None,
+        processor_config: Optional[Dict] = None,
+        embedding_provider: Optional[str] = None,
+        batch_size: int = 64,
+    ) -> List[Dict]:
+        """
+        批量添加文档到知识库
+
+        每批文档的文本块合并为一次向量化调用，并在一个数据库事务中入库。
+
+        :param file_paths: 文档路径列表
+        :param batch_size: 每批处理的文档数
+        :return: 每个文档的添加结果，与 file_paths 顺序一致
+        """
+        results: List[Dict] = []
+        for start in range(0, len(file_paths), batch_size):
+            results.extend(
+                self._add_document_batch(
+                    file_paths[start : start + batch_size],
+                    chunk_config,
+                    processor_config,
+                    embedding_provider,
+                )
+            )
+        success = sum(1 for r in results if r.get("success"))
+        print(f"[knowledge_base] 批量添加完成: 成功 {success}/{len(results)}")
+        return results
+
+    def _add_document_batch(
+        self,
+        file_paths: List[str],
+        chunk_config: Optional[Dict],
+        processor_config: Optional[Dict],
+        embedding_provider: Optional[str],
+    ) -> List[Dict]:
+        """处理一批文档：逐个切片，合并向量化，一次入库；内容重复的文件不重复入库"""
+        results: List[Optional[Dict]] = [None] * len(file_paths)
+        prepared = []  # (结果位置, 目标路径, 原始文件名, 切片结果, 文件哈希)
+        duplicates = []  # (结果位置, 原始文件名, 本批中相同文件的结果位置)
+        batch_hashes: Dict[str, int] = {}
+        for pos, file_path in enumerate(file_paths):
+            if not os.path.exists(file_path):
+                results[pos] = {"success": False, "error": f"文档不存在: {file_path}", "filename": os.path.basename(file_path)}
+                continue
+            content_hash = document_hash(file_path)
+            if content_hash in batch_hashes:
+                duplicates.append((pos, os.path.basename(file_path), batch_hashes[content_hash]))
+                continue
+            existing_id = self.vector_store.find_document_by_hash(content_hash)
+            if existing_id is not None:
+                results[pos] = self._build_duplicate_result(existing_id, os.path.basename(file_path))
+                continue
+            batch_hashes[content_hash] = pos
+            dest_path, original_filename = self._copy_into_kb(file_path)
+            try:
+                doc_result = self._load_chunks(dest_path, chunk_config, processor_config)
+            except Exception as e:
+                print(f"[knowledge_base] 文档处理失败: {original_filename}: {repr(e)}")
+                dest_path.unlink()
+                results[pos] = {"success": False, "error": str(e), "filename": original_filename}
+                continue
+            if not doc_result["chunks"]:
+                dest_path.unlink()
+                results[pos] = {"success": False, "error": "文档分段失败，未提取到有效内容", "filename": original_filename}
+                continue
+            prepared.append((pos, dest_path, original_filename, doc_result, content_hash))
+
+        if prepared:
+            try:
+                embeddings = self._embed_new_chunks(
+                    [doc_result["chunks"] for *_, doc_result, _ in prepared],
+                    [content_hash for *_, content_hash in prepared],
+                    embedding_provider,
+                )
+                documents = [
+                    {
+                        "file_path": str(dest_path),
+                        "chunks": doc_result["chunks"],
+                        "embeddings": doc_embeddings,
+                        "filename": original_filename,
+                        "content_hash": content_hash,
+                        "aliases": doc_result.get("aliases") or [],
+                    }
+                    for (_, dest_path, original_filename, doc_result, content_hash), doc_embeddings in zip(
+                        prepared, embeddings
+                    )
+                ]
+                document_ids = self.vector_store.add_documents(
+                    documents, model_id=get_embedding_model_id()
+                )
+                for (pos, dest_path, original_filename, doc_result, _), document_id, doc_embeddings in zip(
+                    prepared, document_ids, embeddings
+                ):
+                    results[pos] = self._build_add_result(
+                        document_id,
+                        original_filename,
+                        dest_path,
+                        doc_result,
+                        sum(1 for e in doc_embeddings if e is not None),
+                    )
+            except Exception as e:
+                print(f"[knowledge_base] 批量入库失败: {repr(e)}")
+                for pos, dest_path, original_filename, *_ in prepared:
+                    # 维度变更时保留已复制的文件，与单文档添加一致
+                    if not isinstance(e, RuntimeError) and dest_path.exists():
+                        dest_path.unlink()
+                    results[pos] = {"success": False, "error": str(e), "filename": original_filename}
+
+        for pos, original_filename, first_pos in duplicates:
+            first = results[first_pos]
+            if first and first.get("success"):
+                results[pos] = self._build_duplicate_result(first["document_id"], original_filename)
+            else:
+                results[pos] = {**first, "filename": original_filename}
+        return results
+
+    def _copy_into_kb(self, file_path: str):
+        """
+        复制文档到知识库目录，如有重名自动加后缀
+
+        :return: (目标路径, 原始文件名)
+        """
+        original_filename = os.path.basename(file_path)
+        filename = original_filename
+        dest_path = self.documents_path / filename
+        count = 1
+        while dest_path.exists():
+            stem, suffix = os.path.splitext(original_filename)
+            filename = f"{stem}_{count}{suffix}"
+            dest_path = self.documents_path / filename
+            count += 1
+        shutil.copy2(file_path, dest_path)
+        print(f"[knowledge_base] 文档已复制到: {dest_path}")
+        return dest_path, original_filename
+
+    def _load_chunks(
+        self,
+        dest_path: Path,
+        chunk_config: Optional[Dict],
+        processor_config: Optional[Dict],
+    ) -> Dict:
+        """按切片配置加载并切分文档，返回 load_documents_with_metadata 的结果"""
+        if chunk_config:
+            # 验证用户配置
+            errors = validate_chunk_config(chunk_config)
+            if errors:
+                print(f"[knowledge_base] 切片配置验证警告: {errors}")
+
+            # 创建文档专用的切片器
+            doc_splitter = TextSplitter(chunk_config)
+        else:
+            doc_splitter = self.text_splitter
+
+        # 使用新的文档加载函数，获取详细元数据
+        doc_result = load_documents_with_metadata(
+            str(dest_path), doc_splitter.config, processor_config
+        )
+        if doc_result["chunks"]:
+            print(
+                f"[knowledge_base] 文档预处理完成，格式: {doc_result.get('format', 'unknown')}"
+            )
+            print(f"[knowledge_base] 文档切片完成，共 {len(doc_result['chunks'])} 个文本块")
+            print(
+                f"[knowledge_base] 处理时间: {doc_result.get('processing_time', 0):.2f}秒"
+            )
+            near_duplicates = doc_result.get("near_duplicates")
+            if near_duplicates and near_duplicates["collapsed_count"]:
+                print(
+                    f"[knowledge_base] 合并近似重复文本块 {near_duplicates['collapsed_count']}/"
+                    f"{near_duplicates['original_count']} 个，节省 {near_duplicates['saved_chars']} 字符"
+                )
+        return doc_result
+
+    def _embed_new_chunks(
+        self,
+        documents_chunks: List[List[str]],
+        content_hashes: List[str],
+        embedding_provider: Optional[str],
+    ) -> List[List[Optional[List[float]]]]:
+        """
+        只向量化知识库中还没有向量的文本块（按内容哈希），相同内容在一批中只向量化一次
+
+        :param documents_chunks: 每个文档的文本块
+        :param content_hashes: 每个文档的文件哈希（分片知识库据此确定所属分片）
+        :return: 每个文档的向量列表，已有向量的文本块位置为None
+        """
+        chunk_hashes = [[chunk_hash(c) for c in chunks] for chunks in documents_chunks]
+        reusable = set()
+        for hashes, content_hash in zip(chunk_hashes, content_hashes):
+            reusable.update(self.vector_store.find_chunks_by_hash(hashes, content_hash))
+
+        pending: Dict[str, str] = {}  # 内容哈希 -> 待向量化文本
+        for chunks, hashes in zip(documents_chunks, chunk_hashes):
+            for chunk, h in zip(chunks, hashes):
+                if h not in reusable:
+                    pending.setdefault(h, chunk)
+        total = sum(len(chunks) for chunks in documents_chunks)
+        if len(pending) < total:
+            print(f"[knowledge_base] {total - len(pending)} 个文本块与已有内容重复，复用已有向量")
+        vectors = (
+            dict(zip(pending, self._embed_chunks(list(pending.values()), embedding_provider)))
+            if pending
+            else {}
+        )
+        return [[vectors.get(h) for h in hashes] for hashes in chunk_hashes]
+
+    def _embed_chunks(self, chunks: List[str], embedding_provider: Optional[str]) -> List[List[float]]:
+        """向量化文本块，指定 embedding_provider 时临时替换全局配置"""
+        if not embedding_provider:
+            return embed_documents(chunks)
+        from unittest.mock import patch
+        from rag_core import embedding as embedding_mod
+        with patch("utils.config.get_embedding_config") as mock_get_config:
+            import utils.config as config_mod
+            provider, config = config_mod.get_embedding_config()
+            # 用指定 provider 替换
+            if embedding_provider == "local":
+                provider = "local"
+            elif embedding_provider == "online":
+                provider = "online"
+            mock_get_config.return_value = (provider, config_mod.load_global_config().get("embedding_configs", {}).get(provider, {}))
+            return embedding_mod.embed_documents(chunks)
+
+    def _build_duplicate_result(self, document_id: int, original_filename: str) -> Dict:
+        """内容相同的文件已入库时的添加结果，指向已有文档"""
+        doc_info = self.vector_store.get_document_info(document_id)
+        print(
+            f"[knowledge_base] 文档内容与已有文档相同，跳过入库: {original_filename} (ID: {document_id})"
+        )
+        return {
+            "success": True,
+            "duplicate": True,
+            "document_id": document_id,
+            "filename": original_filename,
+            # 与新增文档的结果一致：全部文本块，包括以别名保存的近似重复文本块
+            "chunks_count": doc_info["chunk_count"] if doc_info else 0,
+            "vectors_count": 0,
+            "file_size": doc_info["file_size"] if doc_info else 0,
+            "created_at": doc_info["created_at"] if doc_info else None,
+            "document_info": doc_info,
+        }
+
+    def _build_add_result(
+        self,
+        document_id: int,
+        original_filename: str,
+        dest_path: Path,
+        doc_result: Dict,
+        vectors_count: int,
+    ) -> Dict:
+        """组装文档添加结果"""
+        doc_info = self.vector_store.get_document_info(document_id)
+        if doc_info:
+            doc_info["filename"] = original_filename
+            # 添加预处理元数据
+            doc_info["format"] = doc_result.get("format", "unknown")
+            doc_info["processing_time"] = doc_result.get("processing_time", 0)
+            doc_info["original_metadata"] = doc_result.get("metadata", {})
+
+        result = {
+            "success": True,
+            "document_id": document_id,
+            "filename": original_filename,
+            # 文档的全部文本块，包括合并后以别名保存的近似重复文本块（与文档信息的 chunk_count 一致）
+            "chunks_count": len(doc_result["chunks"]) + len(doc_result.get("aliases") or []),
+            "vectors_count": vectors_count,
+            "file_size": os.path.getsize(dest_path),
+            "created_at": datetime.now().isoformat(),
+            "document_info": doc_info,
+            "format": doc_result.get("format", "unknown"),
+            "processing_time": doc_result.get("processing_time", 0),
+            "near_duplicates": doc_result.get("near_duplicates"),
+        }
+
+        print(
+            f"[knowledge_base] 文档添加成功: {original_filename} (ID: {document_id})"
+        )
+        return result
+
     def search(
-        self, query: str, top_k: int = 5, use_enhanced: bool = True, **kwargs
+        self,
+        query: str,
+        top_k: int = 5,
+        use_enhanced: bool = True,
+        filters: Optional[Dict] = None,
+        **kwargs,
     ) -> List[Dict]:
         """
         在知识库中搜索相关内容
@@ -204,74 +471,65 @@ class KnowledgeBase:
         :param query: 查询文本
         :param top_k: 返回结果数量
         :param use_enhanced: 是否使用增强检索
+        :param filters: 元数据过滤条件，如 {"document_ids": [1, 2], "file_types": [".pdf"],
+                        "filenames": [...], "created_after": "2024-01-01", "created_before": ...}
         :param kwargs: 其他检索参数
         :return: 搜索结果列表
         """
         print(f"[knowledge_base] 开始搜索: {query}")
 
         if use_enhanced:
-            return self._enhanced_search(query, top_k, **kwargs)
+            return self._enhanced_search(query, top_k, filters=filters, **kwargs)
         else:
-            return self._basic_search(query, top_k, **kwargs)
+            return self._basic_search(query, top_k, filters=filters, **kwargs)
 
-    def _enhanced_search(self, query: str, top_k: int = 5, **kwargs) -> List[Dict]:
+    def _enhanced_search(
+        self, query: str, top_k: int = 5, filters: Optional[Dict] = None, **kwargs
+    ) -> List[Dict]:
         """增强搜索：使用混合检索"""
         try:
-            # 获取所有文档的向量和内容
-            all_chunks = []
-            all_vectors = []
-
-            # 从向量存储中获取所有数据
-            with sqlite3.connect(self.vector_store.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT c.content, c.id
-                    FROM chunks c
-                    JOIN documents d ON c.document_id = d.id
-                    WHERE d.status = 'active'
-                    ORDER BY c.id
-                """
-                )
-
-                for row in cursor.fetchall():
-                    all_chunks.append(row[0])
-
-            # 重新向量化所有文档（简化处理，实际应该从存储中加载）
-            if all_chunks:
-                all_vectors = embed_documents(all_chunks)
+            # 语料视图按语料版本缓存，直接使用已持久化的向量，只需向量化查询；过滤条件在取候选时生效
+            view = self.vector_store.get_corpus_view(filters)
+            if len(view) == 0:
+                return []
+            all_chunks = view.contents
+            if view.has_vectors:
+                all_vectors = view.vectors
+            else:
+                # 旧知识库索引与数据库不一致时，回退为重新向量化
+                print("[knowledge_base] 未找到一致的持久化向量，重新向量化文本块")
+                all_vectors = embed_documents(list(all_chunks))
 
-            # 使用增强检索器进行混合搜索
+            # 使用增强检索器进行混合搜索，结果带回文本块和文档ID
             results = self.enhanced_retriever.hybrid_search(
-                query, all_vectors, all_chunks, top_k=top_k, **kwargs
+                query,
+                all_vectors,
+                all_chunks,
+                top_k=top_k,
+                chunk_ids=view.chunk_ids,
+                document_ids=view.document_ids,
+                **kwargs,
             )
 
-            # 转换为标准格式
+            # 转换为标准格式，文档名按chunk_id一次查询
+            try:
+                metadata = self.vector_store.get_chunk_metadata(
+                    [result["chunk_id"] for result in results]
+                )
+            except Exception:
+                metadata = {}
             standard_results = []
             for result in results:
-                # 查找文档名
-                filename = None
-                try:
-                    with sqlite3.connect(self.vector_store.db_path) as conn:
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            """
-                            SELECT d.filename FROM chunks c JOIN documents d ON c.document_id = d.id WHERE c.content = ? LIMIT 1
-                        """,
-                            (result["content"],),
-                        )
-                        row = cursor.fetchone()
-                        if row:
-                            filename = row[0]
-                except Exception:
-                    filename = None
+                info = metadata.get(result["chunk_id"], {})
                 standard_results.append(
                     {
                         "content": result["content"],
                         "score": result["fused_score"],
                         "source": result["source"],
                         "matched_keywords": result.get("matched_keywords", []),
-                        "filename": filename or "未知文档",
+                        "chunk_id": result["chunk_id"],
+                        "document_id": result["document_id"],
+                        "filename": info.get("filename") or "未知文档",
                     }
                 )
 
@@ -282,9 +540,11 @@ class KnowledgeBase:
 
         except Exception as e:
             print(f"[knowledge_base] 增强搜索失败: {e}")
-            return self._basic_search(query, top_k, **kwargs)
+            return self._basic_search(query, top_k, filters=filters, **kwargs)
 
-    def _basic_search(self, query: str, top_k: int = 5, **kwargs) -> List[Dict]:
+    def _basic_search(
+        self, query: str, top_k: int = 5, filters: Optional[Dict] = None, **kwargs
+    ) -> List[Dict]:
         """基础搜索：使用原有向量搜索"""
         try:
             # 1. 向量化查询
@@ -294,8 +554,14 @@ class KnowledgeBase:
 
             query_vector = query_embeddings[0]
 
-            # 2. 向量搜索
-            results = self.vector_store.search(query_vector, top_k)
+            # 2. 向量搜索，相似度阈值在索引命中后、查询数据库前过滤
+            similarity_threshold = kwargs.get("similarity_threshold", 0.0)
+            results = self.vector_store.search(
+                query_vector,
+                top_k,
+                score_threshold=similarity_threshold if similarity_threshold > 0 else None,
+                filters=filters,
+            )
 
             # 3. 应用检索参数过滤
             filtered_results = self._apply_retrieval_filters(results, **kwargs)
@@ -309,6 +575,40 @@ class KnowledgeBase:
             print(f"[knowledge_base] 基础搜索失败: {e}")
             return []
 
+    def search_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filters: Optional[Dict] = None,
+        **kwargs,
+    ) -> List[List[Dict]]:
+        """
+        批量检索：所有查询一次向量化、一次向量搜索、一次数据库查询，
+        适合评测和批量问答（使用基础向量检索）
+
+        :param queries: 查询文本列表
+        :param top_k: 每个查询返回的结果数量
+        :param filters: 元数据过滤条件，同 search
+        :param kwargs: 其他检索参数（similarity_threshold / deduplication）
+        :return: 每个查询的搜索结果列表，与 queries 顺序一致
+        """
+        if not queries:
+            return []
+        print(f"[knowledge_base] 开始批量搜索，共 {len(queries)} 个查询")
+        try:
+            query_vectors = embed_documents(list(queries))
+            similarity_threshold = kwargs.get("similarity_threshold", 0.0)
+            batch_results = self.vector_store.search_many(
+                query_vectors,
+                top_k,
+                score_threshold=similarity_threshold if similarity_threshold > 0 else None,
+                filters=filters,
+            )
+        except Exception as e:
+            print(f"[knowledge_base] 批量搜索失败: {e}")
+            return [[] for _ in queries]
+        return [self._apply_retrieval_filters(results, **kwargs) for results in batch_results]
+
     def _apply_retrieval_filters(self, results: List[Dict], **kwargs) -> List[Dict]:
         """应用检索参数过滤"""
         filtered_results = results
@@ -365,6 +665,10 @@ class KnowledgeBase:
             print(f"[knowledge_base] 删除文档失败: {e}")
             return False
 
+    def compact(self, force: bool = False) -> Dict:
+        """压缩知识库，回收已删除文档占用的空间（见 VectorStore.compact）"""
+        return self.vector_store.compact(force=force)
+
     def get_stats(self) -> Dict:
         """获取知识库统计信息"""
         stats = self.vector_store.get_stats()
@@ -399,19 +703,14 @@ class KnowledgeBase:
     def clear(self) -> bool:
         """清空知识库"""
         try:
-            # 删除所有文档
-            documents = self.list_documents()
-            for doc in documents:
-                self.delete_document(doc["id"])
+            # 一次清空所有记录、向量文件和索引，不逐个删除文档
+            self.vector_store.clear()
 
             # 清理目录
             if self.documents_path.exists():
                 shutil.rmtree(self.documents_path)
                 self.documents_path.mkdir(parents=True, exist_ok=True)
 
-            # 新增：重建 VectorStore 实例，确保内存索引与磁盘同步
-            self.vector_store = VectorStore(str(self.vectors_path / "vector_store.db"))
-
             print(f"[knowledge_base] 知识库已清空: {self.kb_name}")
             return True
 
@@ -419,6 +718,12 @@ class KnowledgeBase:
             print(f"[knowledge_base] 清空知识库失败: {e}")
             return False
 
+    def close(self):
+        """保存未写回的索引，释放进程内缓存的索引和语料视图并关闭数据库连接"""
+        self.vector_store.unload()
+        self.vector_store.close()
+        print(f"[knowledge_base] 已关闭知识库: {self.kb_name}")
+
     def export_documents(self, export_path: str) -> bool:
         """导出知识库文档"""
         try:
@@ -441,6 +746,15 @@ class KnowledgeBase:
             print(f"[knowledge_base] 导出文档失败: {e}")
             return False
 
+    def export_vectors(self, export_path: str) -> bool:
+        """导出知识库向量（npz格式）"""
+        try:
+            self.vector_store.export_vectors(export_path)
+            return True
+        except Exception as e:
+            print(f"[knowledge_base] 导出向量失败: {e}")
+            return False
+
     def get_supported_formats(self) -> List[str]:
         """
         获取支持的文件格式列表
@@ -474,16 +788,136 @@ class KnowledgeBase:
 
 
 def create_knowledge_base(
-    kb_name: str, base_path: str = "knowledge_base"
+    kb_name: str, base_path: str = "knowledge_base", num_shards: Optional[int] = None
 ) -> KnowledgeBase:
     """
     创建新的知识库
 
     :param kb_name: 知识库名称
     :param base_path: 基础路径
+    :param num_shards: 分片数，None 或 1 表示不分片
+    :return: 知识库实例
+    """
+    return KnowledgeBase(kb_name, base_path, num_shards)
+
+
+# 进程内已打开的知识库：(基础路径绝对路径, 知识库名称) -> [知识库, 最近使用时间]，按最近使用排序
+_open_kbs: "OrderedDict[Tuple[str, str], list]" = OrderedDict()
+_open_kbs_lock = threading.Lock()
+_registry_state = {"config": None, "last_sweep": 0.0}
+# 检查空闲知识库的最小间隔（秒）
+REGISTRY_SWEEP_INTERVAL = 60.0
+
+
+def _evict_knowledge_bases(now: float, force_sweep: bool = False) -> List[KnowledgeBase]:
+    """
+    从注册表移除空闲超时和超出数量上限的知识库（调用方需持有 _open_kbs_lock），返回待关闭的知识库
+
+    配置只在新打开知识库或定期检查时读取，命中已打开的知识库时不读取配置文件。
+    """
+    if force_sweep or _registry_state["config"] is None:
+        _registry_state["config"] = get_kb_registry_config()
+    elif now - _registry_state["last_sweep"] < REGISTRY_SWEEP_INTERVAL:
+        return []
+    _registry_state["last_sweep"] = now
+    config = _registry_state["config"]
+    idle_timeout = float(config.get("idle_timeout", 1800))
+    max_open = max(1, int(config.get("max_open", 16)))
+
+    evicted = []
+    for key, (kb, last_used) in list(_open_kbs.items()):
+        if len(_open_kbs) > max_open or (idle_timeout > 0 and now - last_used > idle_timeout):
+            del _open_kbs[key]
+            evicted.append(kb)
+    return evicted
+
+
+def get_knowledge_base(
+    kb_name: str, base_path: str = "knowledge_base", num_shards: Optional[int] = None
+) -> KnowledgeBase:
+    """
+    获取已打开的知识库，未打开时创建并登记（进程内按基础路径和名称共享）
+
+    Web 请求之间复用同一个实例，不再重复建目录、建表、加载检索历史和校验切片配置。
+    超过空闲时间或超出数量上限（最近最少使用）的知识库会被关闭。
+
+    :param kb_name: 知识库名称
+    :param base_path: 基础路径
+    :param num_shards: 首次创建时的分片数，已打开的知识库忽略
     :return: 知识库实例
     """
-    return KnowledgeBase(kb_name, base_path)
+    key = (os.path.abspath(base_path), kb_name)
+    now = time.monotonic()
+    with _open_kbs_lock:
+        entry = _open_kbs.get(key)
+        if entry is not None:
+            entry[1] = now
+            _open_kbs.move_to_end(key)
+            evicted = _evict_knowledge_bases(now)
+            kb = entry[0]
+        else:
+            kb = None
+    if kb is None:
+        # 创建在锁外进行；同时创建同一知识库时保留先登记的实例
+        created = KnowledgeBase(kb_name, base_path, num_shards)
+        with _open_kbs_lock:
+            entry = _open_kbs.get(key)
+            if entry is None:
+                entry = [created, now]
+                _open_kbs[key] = entry
+                created = None
+            else:
+                entry[1] = now
+                _open_kbs.move_to_end(key)
+            kb = entry[0]
+            evicted = _evict_knowledge_bases(now, force_sweep=True)
+        if created is not None:
+            created.vector_store.close()
+    for old in evicted:
+        if old is not kb:
+            old.close()
+    return kb
+
+
+def close_knowledge_base(kb_name: str, base_path: str = "knowledge_base") -> bool:
+    """关闭并移除已打开的知识库，返回是否已打开"""
+    with _open_kbs_lock:
+        entry = _open_kbs.pop((os.path.abspath(base_path), kb_name), None)
+    if entry is None:
+        return False
+    entry[0].close()
+    return True
+
+
+def close_all_knowledge_bases():
+    """关闭进程内所有已打开的知识库（进程退出时自动调用，保存未写回的索引）"""
+    with _open_kbs_lock:
+        entries = list(_open_kbs.values())
+        _open_kbs.clear()
+    for kb, _ in entries:
+        try:
+            kb.close()
+        except Exception as e:
+            print(f"[knowledge_base] 关闭知识库失败: {e}")
+
+
+def list_open_knowledge_bases() -> List[Dict]:
+    """列出已打开的知识库及其空闲时间（秒）"""
+    now = time.monotonic()
+    with _open_kbs_lock:
+        entries = list(_open_kbs.items())
+    return [
+        {
+            "kb_name": name,
+            "base_path": base_path,
+            "num_shards": kb.num_shards,
+            "idle_seconds": now - last_used,
+        }
+        for (base_path, name), (kb, last_used) in entries
+    ]
+
+
+atexit.register(close_all_knowledge_bases)
 
 
 def list_knowledge_bases(base_path: str = "knowledge_base") -> List[str]:
@@ -0,0 +1,148 @@
+"""
+near_duplicate.py
+近似重复文本块合并：切片后用 MinHash 签名估计文本块之间的 Jaccard 相似度，
+LSH 分桶只比较落入同一桶的候选，相似度不低于阈值的文本块合并到最先出现的文本块。
+用于扫描件、导出的wiki等重复页眉、模板段落较多的文档，减少索引规模并避免重复内容挤占 top-k。
+"""
+
+import re
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+# 哈希函数 (a * x + b) mod p，p 为梅森素数 2^31-1，乘积不超出 uint64
+_MERSENNE_PRIME = (1 << 31) - 1
+
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 5
+
+
+def shingles(text: str, size: int = DEFAULT_SHINGLE_SIZE) -> Set[int]:
+    """
+    文本的字符 n-gram 集合（按字符而不是按词，中文文本无需分词）
+
+    比较前统一小写并合并空白，只有空白或大小写不同的文本块视为相同
+    """
+    normalized = re.sub(r"\s+", " ", text.lower()).strip()
+    if len(normalized) <= size:
+        return {zlib.crc32(normalized.encode("utf-8"))}
+    return {
+        zlib.crc32(normalized[i : i + size].encode("utf-8"))
+        for i in range(len(normalized) - size + 1)
+    }
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    """两个 n-gram 集合的 Jaccard 相似度"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def choose_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    选择 LSH 的分段数和每段行数：两个签名在某一段完全相同即成为候选，
+    相似度为 s 时成为候选的概率为 1 - (1 - s^r)^b，曲线的拐点约为 (1/b)^(1/r)，
+    取拐点最接近且不高于阈值的组合（宁可多比较，不漏掉重复）
+
+    :return: (分段数 b, 每段行数 r)
+    """
+    best = (num_perm, 1)
+    best_gap = float("inf")
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        knee = (1.0 / bands) ** (1.0 / rows)
+        if knee <= threshold and threshold - knee < best_gap:
+            best, best_gap = (bands, rows), threshold - knee
+    return best
+
+
+class MinHasher:
+    """用 num_perm 个随机哈希函数计算 n-gram 集合的 MinHash 签名"""
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: Set[int]) -> np.ndarray:
+        """返回长度为 num_perm 的签名，两个签名相同位置相等的比例估计 Jaccard 相似度"""
+        values = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+        values %= np.uint64(_MERSENNE_PRIME)
+        hashed = (np.outer(values, self._a) + self._b) % np.uint64(_MERSENNE_PRIME)
+        return hashed.min(axis=0)
+
+
+def collapse_near_duplicates(
+    chunks: List[str],
+    threshold: float = DEFAULT_THRESHOLD,
+    num_perm: int = DEFAULT_NUM_PERM,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+) -> Dict:
+    """
+    合并近似重复的文本块
+
+    按顺序处理文本块：与已保留的文本块落入同一 LSH 桶、且 n-gram 集合的 Jaccard 相似度
+    不低于阈值时并入该文本块，否则保留。只和保留的文本块比较，不会沿相似链逐步漂移。
+
+    :param chunks: 切片后的文本块
+    :param threshold: Jaccard 相似度阈值
+    :return: {
+        "chunks": 保留的文本块（保持原顺序）,
+        "duplicate_of": 每个原文本块对应的保留文本块在 chunks 中的位置,
+        "groups": [{"canonical": 保留位置, "positions": [被合并的原文本块位置, ...]}]（只列出发生合并的）,
+        "original_count", "collapsed_count", "saved_chars"
+    }
+    """
+    if not 0.0 < threshold <= 1.0:
+        raise ValueError("近似重复阈值必须在 (0, 1] 范围内")
+    bands, rows = choose_bands(threshold, num_perm)
+    hasher = MinHasher(num_perm)
+
+    kept: List[str] = []
+    kept_shingles: List[Set[int]] = []
+    buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+    duplicate_of: List[int] = []
+    merged: Dict[int, List[int]] = {}
+    saved_chars = 0
+
+    for position, chunk in enumerate(chunks):
+        chunk_shingles = shingles(chunk, shingle_size)
+        keys = [
+            band.tobytes()
+            for band in hasher.signature(chunk_shingles)[: bands * rows].reshape(bands, rows)
+        ]
+        canonical: Optional[int] = None
+        candidates = sorted({k for band, key in zip(buckets, keys) for k in band.get(key, ())})
+        for candidate in candidates:
+            if jaccard(chunk_shingles, kept_shingles[candidate]) >= threshold:
+                canonical = candidate
+                break
+
+        if canonical is None:
+            canonical = len(kept)
+            kept.append(chunk)
+            kept_shingles.append(chunk_shingles)
+            for band, key in zip(buckets, keys):
+                band.setdefault(key, []).append(canonical)
+        else:
+            merged.setdefault(canonical, []).append(position)
+            saved_chars += len(chunk)
+        duplicate_of.append(canonical)
+
+    return {
+        "chunks": kept,
+        "duplicate_of": duplicate_of,
+        "groups": [
+            {"canonical": canonical, "positions": positions}
+            for canonical, positions in sorted(merged.items())
+        ],
+        "original_count": len(chunks),
+        "collapsed_count": len(chunks) - len(kept),
+        "saved_chars": saved_chars,
+    }
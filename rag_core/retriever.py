@@ -20,6 +20,7 @@ def retrieve(
     retrieval_strategy="cosine",
     weight_config=None,
     context_window=0,
+    return_indices=False,
 ):
     """
     基于向量相似度检索相关文档片段。
@@ -34,9 +35,10 @@ def retrieve(
     :param retrieval_strategy: str，检索策略，支持'cosine'、'dot_product'、'euclidean'
     :param weight_config: dict，权重配置，可对不同类型文档设置权重
     :param context_window: int，上下文窗口大小，包含相邻文档片段
-    :return: List[str]，检索到的相关片段
+    :param return_indices: bool，为True时返回片段在 docs 中的位置而不是片段内容
+    :return: List[str]，检索到的相关片段（return_indices 时为 List[int]）
     """
-    if not docs or not doc_vectors:
+    if not docs or len(doc_vectors) == 0:
         return []
 
     # 向量化用户问题
@@ -51,8 +53,10 @@ def retrieve(
     if weight_config and isinstance(weight_config, dict):
         sims = _apply_weights(sims, docs, weight_config)
 
-    # 应用相似度阈值过滤
+    # 应用相似度阈值过滤，positions 记录过滤后每个片段在原 docs 中的位置
+    positions = None
     if similarity_threshold > 0:
+        positions = [i for i, sim in enumerate(sims) if sim >= similarity_threshold]
         sims, docs, doc_vectors = _apply_threshold_filter(
             sims, docs, doc_vectors, similarity_threshold
         )
@@ -70,8 +74,11 @@ def retrieve(
     if context_window > 0:
         top_indices = _apply_context_window(top_indices, context_window, len(docs))
 
+    top_indices = [int(i) for i in top_indices if i < len(docs)]
+    if return_indices:
+        return top_indices if positions is None else [positions[i] for i in top_indices]
     # 返回对应的文档片段
-    return [docs[i] for i in top_indices if i < len(docs)]
+    return [docs[i] for i in top_indices]
 
 
 def _calculate_similarities(query_vec, doc_vectors, strategy="cosine"):
@@ -0,0 +1,486 @@
+"""
+sharded_vector_store.py
+分片向量存储：一个知识库的文档按内容哈希分布到 N 个分片，每个分片是独立的
+VectorStore（各自的 SQLite 数据库、向量文件和FAISS索引）。
+搜索在线程池中并行查询所有分片，再用堆合并各分片的top-k。
+"""
+
+import heapq
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import corpus_cache
+from .vector_store import VectorStore, document_hash
+
+SHARDS_CONFIG_FILE = "shards.json"
+
+
+def read_num_shards(vectors_dir: str) -> Optional[int]:
+    """读取知识库记录的分片数，未分片时返回None"""
+    path = os.path.join(vectors_dir, SHARDS_CONFIG_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return int(json.load(f)["num_shards"])
+
+
+def write_num_shards(vectors_dir: str, num_shards: int):
+    """记录知识库的分片数（创建后不可更改）"""
+    os.makedirs(vectors_dir, exist_ok=True)
+    with open(os.path.join(vectors_dir, SHARDS_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({"num_shards": num_shards}, f)
+
+
+class ShardedVectorStore:
+    """
+    分片向量存储，接口与 VectorStore 一致
+
+    分片内的文档ID和文本块ID按 全局ID = 分片内ID × 分片数 + 分片号 编码，
+    对外只暴露全局ID，按ID查询、删除时据此定位分片。
+    """
+
+    def __init__(self, base_dir: str, num_shards: int, max_workers: Optional[int] = None):
+        """
+        :param base_dir: 分片目录，分片位于 base_dir/shard_XXX/vector_store.db
+        :param num_shards: 分片数
+        :param max_workers: 并行查询的线程数，默认等于分片数
+        """
+        if num_shards < 1:
+            raise ValueError("分片数必须大于0")
+        self.base_dir = base_dir
+        self.db_path = base_dir
+        self.num_shards = num_shards
+        self.shards = [
+            VectorStore(os.path.join(base_dir, f"shard_{i:03d}", "vector_store.db"))
+            for i in range(num_shards)
+        ]
+        self.metric = self.shards[0].metric
+        # FAISS和numpy的矩阵运算会释放GIL，线程池即可让各分片并行搜索
+        self.max_workers = max_workers or num_shards
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # 合并后的完整语料视图，任一分片的语料版本变化后重新合并
+        self._corpus_view: Optional[corpus_cache.CorpusView] = None
+        self._corpus_lock = threading.Lock()
+        print(f"[sharded_vector_store] 加载 {num_shards} 个分片: {base_dir}")
+
+    # ---------- ID 编码 ----------
+
+    def to_global_id(self, shard: int, local_id: int) -> int:
+        """分片内ID转换为全局ID"""
+        return local_id * self.num_shards + shard
+
+    def from_global_id(self, global_id: int) -> Tuple[int, int]:
+        """全局ID转换为 (分片号, 分片内ID)"""
+        return global_id % self.num_shards, global_id // self.num_shards
+
+    def shard_for(self, file_path: str, content_hash: Optional[str] = None) -> int:
+        """文档所属分片：按内容哈希，同一文件始终路由到同一分片（分片内可按哈希去重）"""
+        content_hash = content_hash or document_hash(file_path)
+        return int(content_hash[:16], 16) % self.num_shards
+
+    def _map(self, fn: Callable, shards: Optional[List[int]] = None) -> List:
+        """在线程池中对各分片执行 fn(分片号, 分片)，按分片号顺序返回结果"""
+        shards = list(range(self.num_shards)) if shards is None else shards
+        if len(shards) <= 1:
+            return [fn(i, self.shards[i]) for i in shards]
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="vector_shard"
+                )
+            executor = self._executor
+        futures = [executor.submit(fn, i, self.shards[i]) for i in shards]
+        return [future.result() for future in futures]
+
+    def _shard_filters(self, filters: Optional[Dict]) -> Dict[int, Optional[Dict]]:
+        """把过滤条件中的全局文档ID拆分到各分片，不含指定文档的分片不参与查询"""
+        if not filters or filters.get("document_ids") is None:
+            return {i: filters for i in range(self.num_shards)}
+        local_ids: Dict[int, List[int]] = {}
+        for document_id in filters["document_ids"]:
+            shard, local_id = self.from_global_id(int(document_id))
+            local_ids.setdefault(shard, []).append(local_id)
+        return {
+            shard: {**filters, "document_ids": ids} for shard, ids in local_ids.items()
+        }
+
+    def _globalize(self, shard: int, result: Dict) -> Dict:
+        """把分片返回结果中的ID转换为全局ID"""
+        result = dict(result)
+        for key in ("chunk_id", "document_id", "id"):
+            if result.get(key) is not None:
+                result[key] = self.to_global_id(shard, result[key])
+        return result
+
+    # ---------- 写入 ----------
+
+    def add_document(
+        self,
+        file_path: str,
+        chunks: List[str],
+        embeddings: List[Optional[List[float]]],
+        filename: Optional[str] = None,
+        model_id: str = "",
+        content_hash: Optional[str] = None,
+        aliases: Optional[List[Dict]] = None,
+    ) -> int:
+        """添加文档及其向量到所属分片，返回全局文档ID"""
+        return self.add_documents(
+            [
+                {
+                    "file_path": file_path,
+                    "chunks": chunks,
+                    "embeddings": embeddings,
+                    "filename": filename,
+                    "content_hash": content_hash,
+                    "aliases": aliases or [],
+                }
+            ],
+            model_id=model_id,
+        )[0]
+
+    def find_document_by_hash(self, content_hash: str) -> Optional[int]:
+        """按文件内容哈希查找已入库的文档（只需查询所属分片），返回全局文档ID"""
+        shard = self.shard_for("", content_hash)
+        local_id = self.shards[shard].find_document_by_hash(content_hash)
+        return None if local_id is None else self.to_global_id(shard, local_id)
+
+    def find_chunks_by_hash(
+        self, chunk_hashes: List[str], content_hash: Optional[str] = None
+    ) -> Dict[str, int]:
+        """
+        在文档将要写入的分片中按内容哈希查找已有向量的文本块（不跨分片去重）
+
+        :param content_hash: 待入库文档的文件哈希，决定所属分片
+        :return: {内容哈希: 全局chunk_id}
+        """
+        if content_hash is None:
+            return {}
+        shard = self.shard_for("", content_hash)
+        found = self.shards[shard].find_chunks_by_hash(chunk_hashes)
+        return {h: self.to_global_id(shard, chunk_id) for h, chunk_id in found.items()}
+
+    def add_documents(self, documents: List[Dict], model_id: str = "") -> List[int]:
+        """
+        批量添加文档，按文档哈希分组后每个分片一次批量写入
+
+        :return: 全局文档ID列表，与 documents 顺序一致
+        """
+        documents = [
+            {**doc, "content_hash": doc.get("content_hash") or document_hash(doc["file_path"])}
+            for doc in documents
+        ]
+        groups: Dict[int, List[int]] = {}
+        for position, doc in enumerate(documents):
+            groups.setdefault(self.shard_for(doc["file_path"], doc["content_hash"]), []).append(position)
+
+        def add(shard: int, store: VectorStore) -> List[int]:
+            return store.add_documents(
+                [documents[position] for position in groups[shard]], model_id=model_id
+            )
+
+        document_ids: List[int] = [0] * len(documents)
+        shards = sorted(groups)
+        for shard, local_ids in zip(shards, self._map(add, shards)):
+            for position, local_id in zip(groups[shard], local_ids):
+                document_ids[position] = self.to_global_id(shard, local_id)
+        return document_ids
+
+    def delete_document(self, document_id: int) -> bool:
+        """删除文档"""
+        shard, local_id = self.from_global_id(document_id)
+        return self.shards[shard].delete_document(local_id)
+
+    # ---------- 搜索 ----------
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        score_threshold: Optional[float] = None,
+        filters: Optional[Dict] = None,
+    ) -> List[Dict]:
+        """向量相似度搜索，参数与 VectorStore.search 一致"""
+        return self.search_many([query_vector], top_k, score_threshold, filters)[0]
+
+    def search_many(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        score_threshold: Optional[float] = None,
+        filters: Optional[Dict] = None,
+    ) -> List[List[Dict]]:
+        """
+        批量向量搜索：各分片并行取top-k，再按分数（越大越相似）用堆合并
+
+        :return: 每个查询的搜索结果列表，与 query_vectors 顺序一致
+        """
+        if len(query_vectors) == 0:
+            return []
+        shard_filters = self._shard_filters(filters)
+
+        def search_shard(shard: int, store: VectorStore) -> List[List[Dict]]:
+            batch = store.search_many(query_vectors, top_k, score_threshold, shard_filters[shard])
+            return [[self._globalize(shard, hit) for hit in hits] for hits in batch]
+
+        # 从未入库的分片没有确定的维度，不参与搜索
+        shards = [i for i in sorted(shard_filters) if self.shards[i].has_recorded_dim()]
+        per_shard = self._map(search_shard, shards)
+        all_results = []
+        for query_no in range(len(query_vectors)):
+            merged = heapq.nlargest(
+                top_k,
+                (hit for shard_results in per_shard for hit in shard_results[query_no]),
+                key=lambda hit: hit["score"],
+            )
+            for rank, hit in enumerate(merged, 1):
+                hit["rank"] = rank
+            all_results.append(merged)
+        return all_results
+
+    def get_chunk_vectors(
+        self, filters: Optional[Dict] = None
+    ) -> Optional[Tuple[List[int], List[str], np.ndarray]]:
+        """获取所有分片的有效文本块及向量；任一分片存在缺失向量时返回None"""
+        shard_filters = self._shard_filters(filters)
+        shards = sorted(shard_filters)
+        corpora = self._map(lambda i, store: store.get_chunk_vectors(shard_filters[i]), shards)
+        if any(corpus is None for corpus in corpora):
+            return None
+        chunk_ids: List[int] = []
+        contents: List[str] = []
+        vectors = []
+        for shard, (ids, texts, matrix) in zip(shards, corpora):
+            chunk_ids.extend(self.to_global_id(shard, chunk_id) for chunk_id in ids)
+            contents.extend(texts)
+            vectors.append(np.asarray(matrix, dtype=np.float32))
+        if not vectors:
+            return [], [], np.zeros((0, 0), dtype=np.float32)
+        return chunk_ids, contents, np.concatenate(vectors)
+
+    def get_corpus_version(self) -> Tuple[int, ...]:
+        """各分片语料版本组成的元组"""
+        return tuple(store.get_corpus_version() for store in self.shards)
+
+    def get_corpus_view(self, filters: Optional[Dict] = None) -> corpus_cache.CorpusView:
+        """
+        合并各分片的语料视图（ID为全局ID，按分片顺序排列）
+
+        各分片的视图由分片自己按语料版本缓存；不带过滤条件的合并结果也按版本复用。
+        """
+        if filters:
+            shard_filters = self._shard_filters(filters)
+            shards = sorted(shard_filters)
+            views = self._map(lambda i, store: store.get_corpus_view(shard_filters[i]), shards)
+            return self._merge_corpus_views(shards, views)
+        with self._corpus_lock:
+            view = self._corpus_view
+            if view is None or view.version != self.get_corpus_version():
+                shards = list(range(self.num_shards))
+                view = self._merge_corpus_views(
+                    shards, self._map(lambda i, store: store.get_corpus_view(), shards)
+                )
+                self._corpus_view = view
+            return view
+
+    def _merge_corpus_views(
+        self, shards: List[int], views: List[corpus_cache.CorpusView]
+    ) -> corpus_cache.CorpusView:
+        """按分片顺序拼接语料视图，ID转换为全局ID"""
+        chunk_ids = np.concatenate(
+            [np.zeros(0, dtype=np.int64)]
+            + [view.chunk_ids * self.num_shards + shard for shard, view in zip(shards, views)]
+        )
+        document_ids = np.concatenate(
+            [np.zeros(0, dtype=np.int64)]
+            + [view.document_ids * self.num_shards + shard for shard, view in zip(shards, views)]
+        )
+        if all(view.contents_cached for view in views):
+            contents = [content for view in views for content in view.contents]
+        else:
+            contents = corpus_cache.LazyContents(self._load_chunk_contents, chunk_ids)
+        if not all(view.has_vectors for view in views):
+            vectors = None
+        elif all(view.vectors_cached for view in views):
+            vectors = self._concat_vectors([view.vectors for view in views])
+        else:
+            vectors = lambda: self._concat_vectors([view.vectors for view in views])  # noqa: E731
+        version = tuple(view.version for view in views)
+        return corpus_cache.CorpusView(version, chunk_ids, document_ids, contents, vectors)
+
+    @staticmethod
+    def _concat_vectors(matrices: List[np.ndarray]) -> np.ndarray:
+        matrices = [np.asarray(matrix, dtype=np.float32) for matrix in matrices if len(matrix)]
+        if not matrices:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(matrices)
+
+    def _load_chunk_contents(self, chunk_ids: List[int]) -> List[str]:
+        """按全局chunk_id批量读取文本块内容（顺序与 chunk_ids 一致）"""
+        by_shard: Dict[int, List[int]] = {}
+        for chunk_id in chunk_ids:
+            shard, local_id = self.from_global_id(chunk_id)
+            by_shard.setdefault(shard, []).append(local_id)
+        contents: Dict[int, str] = {}
+        for shard, local_ids in by_shard.items():
+            for local_id, content in zip(local_ids, self.shards[shard]._load_chunk_contents(local_ids)):
+                contents[self.to_global_id(shard, local_id)] = content
+        return [contents[chunk_id] for chunk_id in chunk_ids]
+
+    def get_chunk_texts(self, filters: Optional[Dict] = None) -> List[str]:
+        """获取所有分片的有效文本块内容"""
+        shard_filters = self._shard_filters(filters)
+        shards = sorted(shard_filters)
+        texts = self._map(lambda i, store: store.get_chunk_texts(shard_filters[i]), shards)
+        return [text for shard_texts in texts for text in shard_texts]
+
+    def get_chunk_metadata(self, chunk_ids: List[int]) -> Dict[int, Dict]:
+        """按全局chunk_id批量获取文本块所属文档，只查询涉及的分片"""
+        local_ids: Dict[int, List[int]] = {}
+        for chunk_id in chunk_ids:
+            shard, local_id = self.from_global_id(int(chunk_id))
+            local_ids.setdefault(shard, []).append(local_id)
+        shards = sorted(local_ids)
+        metadata: Dict[int, Dict] = {}
+        for shard, found in zip(
+            shards, self._map(lambda i, store: store.get_chunk_metadata(local_ids[i]), shards)
+        ):
+            for info in found.values():
+                info = self._globalize(shard, info)
+                metadata[info["chunk_id"]] = info
+        return metadata
+
+    # ---------- 文档 ----------
+
+    def get_document_info(self, document_id: int) -> Optional[Dict]:
+        """获取文档信息"""
+        shard, local_id = self.from_global_id(document_id)
+        info = self.shards[shard].get_document_info(local_id)
+        return self._globalize(shard, info) if info else None
+
+    def list_documents(self) -> List[Dict]:
+        """列出所有分片的文档（按上传时间倒序）"""
+        documents = [
+            self._globalize(shard, doc)
+            for shard, docs in enumerate(self._map(lambda i, store: store.list_documents()))
+            for doc in docs
+        ]
+        documents.sort(key=lambda doc: (doc["created_at"] or "", doc["id"]), reverse=True)
+        return documents
+
+    # ---------- 索引 ----------
+
+    def get_index_config(self) -> Dict:
+        """索引配置（各分片一致）"""
+        return self.shards[0].get_index_config()
+
+    def set_index_config(self, rebuild: bool = True, **updates) -> Dict:
+        """更新所有分片的索引配置"""
+        configs = self._map(lambda i, store: store.set_index_config(rebuild=rebuild, **updates))
+        self.metric = self.shards[0].metric
+        return configs[0]
+
+    def rebuild_index(
+        self,
+        batch_size: int = 65536,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
+        """并行重建各分片的索引，返回向量总数"""
+        counts = self._map(
+            lambda i, store: store.rebuild_index(batch_size, progress_callback)
+        )
+        return sum(counts)
+
+    def compact(self, force: bool = False) -> Dict:
+        """并行压缩各分片，汇总回收的空间"""
+        results = self._map(lambda i, store: store.compact(force=force))
+        return {
+            "compacted": any(r["compacted"] for r in results),
+            "removed_vectors": sum(r["removed_vectors"] for r in results),
+            "removed_documents": sum(r["removed_documents"] for r in results),
+            "reclaimed_bytes": sum(r["reclaimed_bytes"] for r in results),
+        }
+
+    def clear(self):
+        """清空所有分片"""
+        self._map(lambda i, store: store.clear())
+
+    def export_vectors(self, export_path: str) -> int:
+        """导出所有分片的向量（npz格式，chunk_ids 为全局ID）"""
+        corpus = self.get_chunk_vectors()
+        if corpus is None:
+            raise RuntimeError("存在缺失的向量，无法导出")
+        chunk_ids, _, vectors = corpus
+        np.savez(
+            export_path,
+            chunk_ids=np.array(chunk_ids, dtype=np.int64),
+            vectors=vectors,
+            model_id=self.shards[0].vector_file.model_id,
+        )
+        print(f"[sharded_vector_store] 已导出 {len(chunk_ids)} 个向量到: {export_path}")
+        return len(chunk_ids)
+
+    def flush(self):
+        """把各分片尚未写回的索引改动保存到文件"""
+        self._map(lambda i, store: store.flush())
+
+    def unload(self):
+        """释放各分片缓存的索引和语料视图"""
+        for store in self.shards:
+            store.unload()
+        with self._corpus_lock:
+            self._corpus_view = None
+
+    def close(self):
+        """保存索引、关闭连接并停止线程池（之后再使用时重新创建线程池）"""
+        for store in self.shards:
+            store.close()
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    # ---------- 统计 ----------
+
+    def get_stats(self) -> Dict:
+        """获取知识库统计信息，shards 中列出每个分片的规模"""
+        shard_stats = self._map(lambda i, store: store.get_stats())
+        totals = {
+            key: sum(stats.get(key, 0) for stats in shard_stats)
+            for key in (
+                "document_count",
+                "chunk_count",
+                "vector_count",
+                "total_size_bytes",
+                "vector_file_size_bytes",
+                "tombstone_count",
+            )
+        }
+        shards = [
+            {
+                "shard": shard,
+                "document_count": stats["document_count"],
+                "chunk_count": stats["chunk_count"],
+                "vector_count": stats["vector_count"],
+                "index_vector_count": stats.get("index_vector_count", 0),
+                "vector_file_size_bytes": stats["vector_file_size_bytes"],
+                "tombstone_ratio": stats["tombstone_ratio"],
+                "database_path": stats["database_path"],
+            }
+            for shard, stats in enumerate(shard_stats)
+        ]
+        return {
+            **totals,
+            "index_type": shard_stats[0]["index_type"],
+            "index_config": shard_stats[0]["index_config"],
+            "index_vector_count": sum(s["index_vector_count"] for s in shards),
+            "num_shards": self.num_shards,
+            "shards": shards,
+            "database_path": self.base_dir,
+        }
@@ -0,0 +1,273 @@
+"""
+vector_file.py
+追加写入的向量文件，固定头部 + 行优先向量矩阵，读取时使用np.memmap共享页缓存。
+向量可按 float32 或 float16 存储。
+"""
+
+import os
+import struct
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+# 头部布局：magic, 版本, 维度, 数据类型, 行数, 模型标识
+HEADER_FORMAT = "<8sIIIQ32s4x"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b"RAGVEC01"
+FORMAT_VERSION = 1
+DTYPE_FLOAT32 = 0
+DTYPE_FLOAT16 = 1
+
+# 存储类型名与头部编码
+VECTOR_DTYPES: Dict[str, int] = {"float32": DTYPE_FLOAT32, "float16": DTYPE_FLOAT16}
+_DTYPE_NAMES = {code: name for name, code in VECTOR_DTYPES.items()}
+_NUMPY_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+
+class Float32View:
+    """
+    float16 向量矩阵的只读视图，按下标读取时转换为float32
+
+    支持 shape / len / 切片 / 整数数组下标，与float32 memmap的用法一致
+    """
+
+    def __init__(self, raw: np.ndarray):
+        self.raw = raw
+        self.shape = raw.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        return np.asarray(self.raw[key], dtype=np.float32)
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+
+class VectorFile:
+    """
+    追加写入的向量文件
+
+    文件结构：
+    - 64字节头部：维度、存储类型、行数、模型标识
+    - 数据区：count x dim 的 float32 或 float16 矩阵，第i行即向量行号i
+
+    新向量只追加到文件末尾，写完数据后再更新头部行数，
+    因此读者看到的行数范围内的数据始终是完整的。
+
+    头部按文件状态（inode、大小、修改时间）缓存，查询路径读取 dim / count / dtype
+    只需一次 stat；本实例写入后直接更新缓存，其他进程写入后文件状态变化，下次访问时重新读取。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._memmap: Optional[np.memmap] = None
+        self._memmap_key: Optional[Tuple[int, int, int]] = None
+        # (文件状态, 头部)，整体替换，读取时无需加锁
+        self._header_cache: Optional[Tuple[Tuple[int, int, int], Tuple[int, int, str, str]]] = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    @staticmethod
+    def _stat_key(stat: os.stat_result) -> Tuple[int, int, int]:
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _cache_header(self, header: Tuple[int, int, str, str], stat: os.stat_result):
+        """
+        缓存头部；文件大小与头部行数不一致时不缓存
+        （另一个进程已写入数据、尚未更新头部，或文件末尾留有未提交的行）
+        """
+        dim, count, _, dtype = header
+        itemsize = np.dtype(_NUMPY_DTYPES[dtype]).itemsize
+        if stat.st_size == HEADER_SIZE + count * dim * itemsize:
+            self._header_cache = (self._stat_key(stat), header)
+        else:
+            self._header_cache = None
+
+    def _header(self) -> Optional[Tuple[os.stat_result, Tuple[int, int, str, str]]]:
+        """文件状态和头部 (dim, count, model_id, 存储类型)，文件不存在时返回None"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        cached = self._header_cache
+        if cached is not None and cached[0] == self._stat_key(stat):
+            return stat, cached[1]
+        header = self._read_header()
+        self._cache_header(header, stat)
+        return stat, header
+
+    def _read_header(self) -> Tuple[int, int, str, str]:
+        """读取头部，返回 (dim, count, model_id, 存储类型)"""
+        with open(self.path, "rb") as f:
+            raw = f.read(HEADER_SIZE)
+        if len(raw) != HEADER_SIZE:
+            raise ValueError(f"向量文件头部不完整: {self.path}")
+        magic, version, dim, dtype_code, count, model_id = struct.unpack(
+            HEADER_FORMAT, raw
+        )
+        if magic != MAGIC:
+            raise ValueError(f"不是有效的向量文件: {self.path}")
+        if version != FORMAT_VERSION or dtype_code not in _DTYPE_NAMES:
+            raise ValueError(f"不支持的向量文件版本: {version}")
+        return (
+            dim,
+            count,
+            model_id.rstrip(b"\0").decode("utf-8", errors="ignore"),
+            _DTYPE_NAMES[dtype_code],
+        )
+
+    @staticmethod
+    def _truncate_model_id(model_id: str) -> str:
+        # 模型标识截断到32字节，避免截断在多字节字符中间
+        return model_id.encode("utf-8")[:32].decode("utf-8", errors="ignore")
+
+    @classmethod
+    def _pack_header(cls, dim: int, count: int, model_id: str, dtype: str = "float32") -> bytes:
+        return struct.pack(
+            HEADER_FORMAT,
+            MAGIC,
+            FORMAT_VERSION,
+            dim,
+            VECTOR_DTYPES[dtype],
+            count,
+            cls._truncate_model_id(model_id).encode("utf-8"),
+        )
+
+    @property
+    def dim(self) -> int:
+        found = self._header()
+        return found[1][0] if found else 0
+
+    @property
+    def count(self) -> int:
+        found = self._header()
+        return found[1][1] if found else 0
+
+    @property
+    def model_id(self) -> str:
+        found = self._header()
+        return found[1][2] if found else ""
+
+    @property
+    def dtype(self) -> Optional[str]:
+        """存储类型，文件不存在时返回None"""
+        found = self._header()
+        return found[1][3] if found else None
+
+    def create(self, dim: int, model_id: str = "", dtype: str = "float32"):
+        """创建空向量文件（已存在时覆盖）"""
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"不支持的向量存储类型: {dtype}")
+        with self._lock:
+            with open(self.path, "wb") as f:
+                f.write(self._pack_header(dim, 0, model_id, dtype))
+            self._memmap = None
+            self._memmap_key = None
+            self._cache_header(
+                (dim, 0, self._truncate_model_id(model_id), dtype), os.stat(self.path)
+            )
+
+    def append(self, vectors, model_id: str = "", dtype: str = "float32") -> int:
+        """
+        追加向量，不重写已有数据
+
+        :param vectors: 二维数组或向量列表
+        :param model_id: 模型标识，文件首次创建时写入头部
+        :param dtype: 存储类型，文件首次创建时写入头部；已有文件沿用其存储类型
+        :return: 第一条新向量的行号
+        """
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("向量必须是二维数组")
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"不支持的向量存储类型: {dtype}")
+
+        with self._lock:
+            if not self.exists():
+                with open(self.path, "wb") as f:
+                    f.write(self._pack_header(matrix.shape[1], 0, model_id, dtype))
+
+            # 写入前总是重新读取头部，不使用缓存
+            dim, count, recorded_model_id, file_dtype = self._read_header()
+            if matrix.shape[1] != dim:
+                raise ValueError(f"向量文件维度为 {dim}，但追加向量为 {matrix.shape[1]} 维")
+            if (
+                model_id
+                and recorded_model_id
+                and self._truncate_model_id(model_id) != recorded_model_id
+            ):
+                print(
+                    f"[vector_file] 警告: 模型标识不一致（文件: {recorded_model_id}, 本次: {model_id}）"
+                )
+
+            with open(self.path, "r+b") as f:
+                # 先写数据，再更新头部行数
+                itemsize = np.dtype(_NUMPY_DTYPES[file_dtype]).itemsize
+                f.seek(HEADER_SIZE + count * dim * itemsize)
+                f.write(matrix.astype(_NUMPY_DTYPES[file_dtype]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+                f.seek(0)
+                f.write(
+                    self._pack_header(
+                        dim, count + matrix.shape[0], recorded_model_id or model_id, file_dtype
+                    )
+                )
+                f.flush()
+            self._cache_header(
+                (
+                    dim,
+                    count + matrix.shape[0],
+                    recorded_model_id or self._truncate_model_id(model_id),
+                    file_dtype,
+                ),
+                os.stat(self.path),
+            )
+            return count
+
+    def memmap(self) -> np.ndarray:
+        """
+        以只读memmap方式映射全部向量，多个进程/线程通过操作系统页缓存共享数据
+
+        :return: shape为 (count, dim) 的只读数组；float16 存储时为按需转换为float32的 Float32View
+        """
+        found = self._header()
+        if found is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        stat, (dim, count, _, dtype) = found
+        key = (count, dim, stat.st_ino)
+        with self._lock:
+            if self._memmap is None or self._memmap_key != key:
+                if count == 0:
+                    self._memmap = np.zeros((0, dim), dtype=np.float32)
+                else:
+                    self._memmap = np.memmap(
+                        self.path,
+                        dtype=_NUMPY_DTYPES[dtype],
+                        mode="r",
+                        offset=HEADER_SIZE,
+                        shape=(count, dim),
+                    )
+                    if dtype != "float32":
+                        self._memmap = Float32View(self._memmap)
+                self._memmap_key = key
+            return self._memmap
+
+    def iter_batches(self, batch_size: int = 65536) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        分批遍历全部向量
+
+        :return: 迭代 (起始行号, 向量块)
+        """
+        matrix = self.memmap()
+        for start in range(0, matrix.shape[0], batch_size):
+            yield start, np.asarray(matrix[start : start + batch_size])
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if self.exists() else 0
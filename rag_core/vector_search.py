@@ -0,0 +1,109 @@
+"""
+vector_search.py
+基于numpy的精确向量搜索，FAISS不可用时使用。
+按块做矩阵乘法控制内存占用，用argpartition取top-k。
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+METRICS = ("l2", "cosine", "ip")
+
+# 每块参与矩阵乘法的向量数，单块内存约为 查询数 x 块大小 x 4 字节
+DEFAULT_BLOCK_SIZE = 65536
+
+
+def higher_is_better(metric: str) -> bool:
+    """分数是否越大越相似（l2 距离越小越相似）"""
+    return metric != "l2"
+
+
+def to_similarity(scores: np.ndarray, metric: str) -> np.ndarray:
+    """
+    把原始分数转换为越大越相似的分数：cosine / ip 保持不变，
+    l2 距离映射为 1 / (1 + 距离)，取值 (0, 1]，与距离单调对应
+    """
+    if metric == "l2":
+        return 1.0 / (1.0 + np.maximum(scores, 0))
+    return scores
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行做L2归一化，零向量保持不变"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _block_keys(queries: np.ndarray, block: np.ndarray, metric: str, query_sq) -> np.ndarray:
+    """计算一块向量的排序键（越小越相似）"""
+    products = queries @ block.T
+    if metric == "l2":
+        block_sq = np.einsum("ij,ij->i", block, block)
+        return np.maximum(query_sq - 2 * products + block_sq[None, :], 0)
+    if metric == "cosine":
+        norms = np.linalg.norm(block, axis=1)
+        norms[norms == 0] = 1.0
+        return -(products / norms[None, :])
+    return -products
+
+
+def search_matrix(
+    matrix: np.ndarray,
+    queries,
+    top_k: int,
+    metric: str = "l2",
+    valid_mask: Optional[np.ndarray] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在向量矩阵上做精确top-k搜索
+
+    :param matrix: (n, dim) 向量矩阵，可以是np.memmap
+    :param queries: 单个查询向量或 (nq, dim) 查询矩阵
+    :param top_k: 每个查询返回的结果数
+    :param metric: l2（平方L2距离，越小越相似）/ cosine / ip（内积，越大越相似）
+    :param valid_mask: 长度为n的布尔数组，False的行不参与搜索（如已删除的向量）
+    :param block_size: 每块向量数
+    :return: (scores, rows)，形状均为 (nq, top_k)，按相似度从高到低排列；
+             不足top_k时rows以-1填充（与FAISS一致）
+    """
+    if metric not in METRICS:
+        raise ValueError(f"不支持的相似度度量: {metric}")
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    n_queries = queries.shape[0]
+    if metric == "cosine":
+        queries = normalize_rows(queries)
+    query_sq = np.einsum("ij,ij->i", queries, queries)[:, None] if metric == "l2" else None
+
+    best_keys = np.empty((n_queries, 0), dtype=np.float32)
+    best_rows = np.empty((n_queries, 0), dtype=np.int64)
+    for start in range(0, matrix.shape[0] if top_k > 0 else 0, block_size):
+        block = np.asarray(matrix[start : start + block_size], dtype=np.float32)
+        keys = _block_keys(queries, block, metric, query_sq)
+        if valid_mask is not None:
+            keys[:, ~valid_mask[start : start + len(block)]] = np.inf
+        rows = np.broadcast_to(np.arange(start, start + len(block), dtype=np.int64), keys.shape)
+
+        # 与之前各块的top-k合并，只保留当前top-k
+        cand_keys = np.concatenate([best_keys, keys], axis=1)
+        cand_rows = np.concatenate([best_rows, rows], axis=1)
+        if cand_keys.shape[1] > top_k:
+            part = np.argpartition(cand_keys, top_k - 1, axis=1)[:, :top_k]
+            cand_keys = np.take_along_axis(cand_keys, part, axis=1)
+            cand_rows = np.take_along_axis(cand_rows, part, axis=1)
+        best_keys, best_rows = cand_keys, cand_rows
+
+    order = np.argsort(best_keys, axis=1, kind="stable")
+    best_keys = np.take_along_axis(best_keys, order, axis=1)
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+
+    # 结果不足top_k或命中被屏蔽的行时，以-1填充
+    pad = top_k - best_keys.shape[1]
+    if pad > 0:
+        best_keys = np.pad(best_keys, ((0, 0), (0, pad)), constant_values=np.inf)
+        best_rows = np.pad(best_rows, ((0, 0), (0, pad)), constant_values=-1)
+    best_rows = np.where(np.isinf(best_keys), -1, best_rows)
+    scores = best_keys if metric == "l2" else -best_keys
+    return scores.astype(np.float32), best_rows
@@ -5,13 +5,23 @@ vector_store.py
 
 import os
 import json
+import hashlib
 import sqlite3
+import threading
+import time
 import numpy as np
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 from pathlib import Path
-import pickle
+import pickle  # 仅用于迁移旧版本索引
 from datetime import datetime
 
+from .vector_file import VectorFile
+from . import index_factory
+from . import vector_search
+from . import index_cache
+from . import corpus_cache
+from .connection_manager import get_connection_manager
+
 try:
     import faiss  # type: ignore
 
@@ -21,6 +31,73 @@ except ImportError:
     print("[vector_store] 警告: FAISS未安装，将使用基础向量存储")
 
 
+# 与同一文档中的文本块共用向量的文本块（入库前合并的近似重复、文档内重复的文本块）：
+# 内容已由持有向量的文本块代表，语料视图和按文本块读取向量时排除，避免同一内容重复命中
+NOT_SAME_DOCUMENT_ALIAS_SQL = """
+    NOT EXISTS (
+        SELECT 1 FROM chunks k
+        WHERE k.id = c.canonical_chunk_id AND k.document_id = c.document_id
+    )"""
+
+
+def build_filter_sql(filters: Optional[Dict]) -> Tuple[str, List]:
+    """
+    把元数据过滤条件转换为 documents 表上的 SQL 条件（以 AND 开头）
+
+    支持的条件：
+    - document_ids：文档ID列表
+    - file_types：文件类型列表，如 ".pdf" 或 "pdf"
+    - filenames：文件名列表
+    - created_after / created_before：上传时间范围（含下界、不含上界），
+      datetime 或 "YYYY-MM-DD[ HH:MM:SS]" 字符串（UTC，与 CURRENT_TIMESTAMP 一致）
+    """
+    if not filters:
+        return "", []
+    unknown = set(filters) - {"document_ids", "file_types", "filenames", "created_after", "created_before"}
+    if unknown:
+        raise ValueError(f"未知的过滤条件: {sorted(unknown)}")
+
+    clauses: List[str] = []
+    params: List = []
+
+    def add_in(column: str, values):
+        values = list(values)
+        clauses.append(f"{column} IN ({','.join('?' * len(values))})" if values else "0")
+        params.extend(values)
+
+    if filters.get("document_ids") is not None:
+        add_in("d.id", [int(v) for v in filters["document_ids"]])
+    if filters.get("file_types") is not None:
+        add_in(
+            "d.file_type",
+            [t.lower() if t.startswith(".") else f".{t.lower()}" for t in filters["file_types"]],
+        )
+    if filters.get("filenames") is not None:
+        add_in("d.filename", filters["filenames"])
+    for key, op in (("created_after", ">="), ("created_before", "<")):
+        value = filters.get(key)
+        if value is not None:
+            if isinstance(value, datetime):
+                value = value.strftime("%Y-%m-%d %H:%M:%S")
+            clauses.append(f"d.created_at {op} ?")
+            params.append(value)
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def document_hash(file_path: str) -> str:
+    """文档内容的sha256，用于识别重复上传的文件"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(content: str) -> str:
+    """文本块内容的sha256，内容相同的文本块共用一个向量"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
 class VectorStore:
     """
     本地向量存储引擎
@@ -32,17 +109,43 @@ class VectorStore:
     - 增量更新支持
     """
 
+    # 墓碑占向量文件行数的比例超过该值、且墓碑数不少于 compaction_min_vectors 时后台压缩
+    compaction_threshold = 0.2
+    compaction_min_vectors = 1000
+    # 新增向量累计超过该数量时才写回索引文件，未写回的部分在加载时从向量文件补齐
+    index_save_interval = 10000
+    # 检查索引文件是否被其他进程更新的最小间隔（秒）
+    index_reload_check_interval = 1.0
+    # 过滤后候选文本块不超过该数量时直接在向量文件上精确计算，比带过滤器的ANN搜索更快且召回完整
+    filter_exact_search_limit = 4096
+
     def __init__(self, db_path: str = "knowledge_base/vectors/vector_store.db"):
         self.db_path = db_path
-        self.vectors_path = os.path.join(os.path.dirname(db_path), "embeddings.npy")
-        self.index_path = os.path.join(os.path.dirname(db_path), "faiss_index.pkl")
+        self.vectors_path = os.path.join(os.path.dirname(db_path), "embeddings.vec")
+        self.index_path = os.path.join(os.path.dirname(db_path), "faiss.index")
+        self.index_meta_path = os.path.join(os.path.dirname(db_path), "index_meta.json")
+        self.legacy_index_path = os.path.join(os.path.dirname(db_path), "faiss_index.pkl")
+        self.dim_path = os.path.join(os.path.dirname(db_path), "embedding_dim.txt")
+        self.index_config_path = os.path.join(os.path.dirname(db_path), "index_config.json")
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # 数据库连接在进程内按数据库共享，每个线程复用自己的连接
+        self._db = get_connection_manager(db_path)
         self._init_database()
-        self.index = None  # 不在这里初始化索引
+        self.vector_file = VectorFile(self.vectors_path)
+        self.metric = self._init_metric()
+        # 索引在进程内按知识库共享，不在这里加载
+        self._index_handle = index_cache.get_index_handle(self.index_path)
+
+    @property
+    def index(self):
+        """当前发布的一代索引（index_cache.Snapshot，未加载时为None）"""
+        return self._index_handle.snapshot
 
     def _init_database(self):
         """初始化SQLite数据库表结构"""
-        with sqlite3.connect(self.db_path) as conn:
+        # WAL模式写入数据库文件，对之后的所有连接生效；读写互不阻塞
+        self._db.write().execute("PRAGMA journal_mode = WAL")
+        with self._db.transaction() as conn:
             cursor = conn.cursor()
 
             # 文档表：存储文档元数据
@@ -56,7 +159,8 @@ class VectorStore:
                     file_size INTEGER,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT DEFAULT 'active'
+                    status TEXT DEFAULT 'active',
+                    content_hash TEXT
                 )
             """
             )
@@ -71,6 +175,8 @@ class VectorStore:
                     content TEXT NOT NULL,
                     chunk_size INTEGER NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    content_hash TEXT,
+                    canonical_chunk_id INTEGER,
                     FOREIGN KEY (document_id) REFERENCES documents (id)
                 )
             """
@@ -90,245 +196,1365 @@ class VectorStore:
             """
             )
 
-            conn.commit()
+            # 墓碑表：已删除但尚未压缩的文本块，搜索时从索引结果中排除
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tombstones (
+                    chunk_id INTEGER PRIMARY KEY,
+                    document_id INTEGER NOT NULL,
+                    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """
+            )
+
+            # 元数据表：corpus_version 在每次修改有效文本块或向量行号的事务中递增，
+            # 进程内的语料视图按它判断是否过期（其他进程的写入同样可见）
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """
+            )
+            cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('corpus_version', 0)")
+
+            # 按文档删除文本块、按文本块删除向量时使用
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chunks_document_id ON chunks (document_id)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_vectors_chunk_id ON vectors (chunk_id)"
+            )
+
+            self._migrate_content_hashes(cursor)
+            # 按内容哈希查找重复文档和文本块，按 canonical_chunk_id 找到共用向量的文本块
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chunks_content_hash ON chunks (content_hash)"
+            )
+            cursor.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_chunks_canonical_chunk_id ON chunks (canonical_chunk_id)
+                WHERE canonical_chunk_id IS NOT NULL
+            """
+            )
+
+    @staticmethod
+    def _migrate_content_hashes(cursor: sqlite3.Cursor):
+        """
+        旧版本数据库增加内容哈希列：已有文本块补算哈希，已有文档的哈希保持为空
+        （原文件可能已不在），之后上传的相同文件不会与它们去重
+        """
+        cursor.execute("PRAGMA table_info(documents)")
+        if "content_hash" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+        cursor.execute("PRAGMA table_info(chunks)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "canonical_chunk_id" not in columns:
+            cursor.execute("ALTER TABLE chunks ADD COLUMN canonical_chunk_id INTEGER")
+        if "content_hash" not in columns:
+            cursor.execute("ALTER TABLE chunks ADD COLUMN content_hash TEXT")
+            rows = cursor.execute("SELECT id, content FROM chunks").fetchall()
+            cursor.executemany(
+                "UPDATE chunks SET content_hash = ? WHERE id = ?",
+                [(chunk_hash(content), chunk_id) for chunk_id, content in rows],
+            )
+            if rows:
+                print(f"[vector_store] 已为 {len(rows)} 个文本块补算内容哈希")
+
+    @staticmethod
+    def _bump_corpus_version(cursor: sqlite3.Cursor):
+        """递增语料版本（在写事务中调用，与修改一起提交）"""
+        cursor.execute("UPDATE meta SET value = value + 1 WHERE key = 'corpus_version'")
+
+    def get_corpus_version(self) -> int:
+        """当前语料版本，文档、文本块或向量行号每次变化后递增"""
+        with self._db.read() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'corpus_version'").fetchone()
+        return row[0] if row else 0
+
+    def has_recorded_dim(self) -> bool:
+        """是否已入库并记录了embedding维度"""
+        return os.path.exists(self.dim_path)
+
+    def _get_recorded_dim(self, default: int = 384) -> int:
+        """读取知识库记录的embedding维度"""
+        if os.path.exists(self.dim_path):
+            with open(self.dim_path, "r") as f:
+                return int(f.read().strip())
+        return default
 
     def _load_or_create_index(self):
-        """加载或创建FAISS索引"""
-        if FAISS_AVAILABLE and os.path.exists(self.index_path):
+        """
+        加载或创建FAISS索引
+
+        优先以只读mmap方式加载原生索引文件，冷启动无需把整个索引读入内存；
+        旧版本pickle索引会迁移为原生格式。加载后从向量文件补齐尚未写回的向量。
+        """
+        if not FAISS_AVAILABLE:
+            self._index_handle.publish(None)
+            return
+
+        handle = self._index_handle
+        handle.unsaved_vectors = 0
+        handle.file_version = index_cache.file_version(self.index_path)
+        index = None
+        if handle.file_version is not None:
             try:
-                with open(self.index_path, "rb") as f:
-                    self.index = pickle.load(f)
+                index, handle.mmapped = self._read_index_file(mmap=True)
                 print(f"[vector_store] 加载FAISS索引: {self.index_path}")
             except Exception as e:
-                print(f"[vector_store] 加载索引失败，创建新索引: {e}")
-                self._create_new_index(dimension=384) # 默认维度
+                print(f"[vector_store] 加载索引失败，从向量文件重建: {e}")
+        elif os.path.exists(self.legacy_index_path):
+            self._load_legacy_index()
+            return
+
+        if index is None:
+            if self._has_indexable_vectors():
+                self.rebuild_index()
+            else:
+                self._create_new_index(self._get_recorded_dim())
+            return
+
+        if index_factory.uses_inner_product(index) != (self.metric != "l2"):
+            # 索引文件与知识库记录的度量不一致（如修改度量后未重建）
+            print(f"[vector_store] 索引度量与配置（{self.metric}）不一致，重建索引")
+            self.rebuild_index()
+            return
+
+        index_factory.apply_search_params(index, self.get_index_config())
+        handle.publish(index, tombstones=self._load_tombstones())
+        handle.indexed_rows = self._read_index_meta().get("vector_rows", 0)
+        self._catch_up_index()
+
+    def _read_index_file(self, mmap: bool):
+        """
+        读取原生索引文件，mmap不可用时退回普通读取
+
+        :return: (索引, 是否为mmap加载)
+        """
+        if mmap:
+            try:
+                index = faiss.read_index(
+                    self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+                )
+                return index, True
+            except RuntimeError:
+                pass
+        return faiss.read_index(self.index_path), False
+
+    def _load_tombstones(self) -> np.ndarray:
+        """读取全部墓碑chunk_id"""
+        with self._db.read() as conn:
+            rows = conn.execute("SELECT chunk_id FROM tombstones ORDER BY chunk_id").fetchall()
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def _sync_tombstones(self):
+        """其他进程删除了文档时，把新的墓碑并入当前一代（调用方持有索引锁）"""
+        with self._db.read() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM tombstones").fetchone()[0]
+        snapshot = self._index_handle.snapshot
+        if count != len(snapshot.tombstones):
+            self._index_handle.publish(
+                snapshot.base, snapshot.delta, tombstones=self._load_tombstones()
+            )
+
+    def _read_index_meta(self) -> Dict:
+        if os.path.exists(self.index_meta_path):
+            with open(self.index_meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _add_to_index(self, vectors: np.ndarray, ids: np.ndarray):
+        """
+        把向量加入 delta 并发布新一代（调用方持有索引锁）
+
+        只复制较小的 delta，主索引不被复制也不被修改，正在检索的查询不受影响
+        """
+        handle = self._index_handle
+        snapshot = handle.snapshot
+        if snapshot.delta is not None:
+            delta = faiss.clone_index(snapshot.delta)
+        else:
+            delta = index_factory.create_index(
+                "flat", snapshot.d, 0, {**self.get_index_config(), "vector_dtype": "float32"}
+            )
+        delta.add_with_ids(vectors, ids)
+        handle.publish(snapshot.base, delta)
+        handle.unsaved_vectors += len(ids)
+
+    def _merged_base(self):
+        """复制主索引并并入 delta，得到可修改的新主索引（调用方持有索引锁）"""
+        snapshot = self._index_handle.snapshot
+        # mmap只读加载的索引复制后位于内存中，可以修改
+        base = faiss.clone_index(snapshot.base)
+        delta = snapshot.delta
+        if delta is not None and delta.ntotal:
+            base.add_with_ids(
+                faiss.downcast_index(delta.index).reconstruct_n(0, delta.ntotal),
+                faiss.vector_to_array(delta.id_map),
+            )
+        index_factory.apply_search_params(base, self.get_index_config())
+        return base
+
+    def _has_indexable_vectors(self) -> bool:
+        with self._db.read() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM vectors WHERE vector_index >= 0 LIMIT 1"
+            ).fetchone()
+        return row is not None and self.vector_file.count > 0
+
+    def _catch_up_index(self):
+        """
+        把索引文件写回之后新增到向量文件的向量补入索引（调用方持有索引锁）
+
+        只补到已提交的最大行号（水位线）：已追加到向量文件、但数据库事务尚未提交的向量
+        暂不可见，提交后下次补齐时再加入；回滚留下的行会被之后的提交越过
+        """
+        handle = self._index_handle
+        count = self.vector_file.count
+        if count <= handle.indexed_rows:
+            return
+        with self._db.read() as conn:
+            rows = conn.execute(
+                "SELECT chunk_id, vector_index FROM vectors WHERE vector_index >= ? AND vector_index < ? ORDER BY vector_index",
+                (handle.indexed_rows, count),
+            ).fetchall()
+        if not rows:
+            return
+        batch = np.array(rows, dtype=np.int64)
+        watermark = int(batch[-1, 1]) + 1
+        # 写回索引与写回元数据之间崩溃时，部分向量可能已在索引中
+        existing = faiss.vector_to_array(handle.snapshot.base.id_map)
+        batch = batch[~np.isin(batch[:, 0], existing)]
+        if len(batch):
+            matrix = self.vector_file.memmap()
+            self._add_to_index(self._prepare_vectors(matrix[batch[:, 1]]), batch[:, 0])
+            print(f"[vector_store] 从向量文件补齐 {len(batch)} 个索引向量")
+        handle.indexed_rows = watermark
+        if handle.unsaved_vectors >= self.index_save_interval:
+            self._save_index()
+
+    def _load_legacy_index(self):
+        """加载旧版本pickle索引并迁移为原生格式"""
+        try:
+            with open(self.legacy_index_path, "rb") as f:
+                legacy_index = pickle.load(f)
+        except Exception as e:
+            print(f"[vector_store] 加载旧索引失败，从向量文件重建: {e}")
+            legacy_index = None
+
+        if legacy_index is None:
+            self.rebuild_index()
+        elif isinstance(legacy_index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            # 已按chunk_id编号，只需改为原生格式保存
+            self._index_handle.publish(legacy_index)
+            self._index_handle.indexed_rows = self.vector_file.count
+            self._save_index()
         else:
-            self._create_new_index(dimension=384) # 默认维度
+            # 旧版本索引按插入顺序编号，迁移为按chunk_id编号
+            self._migrate_legacy_index(legacy_index)
+        os.remove(self.legacy_index_path)
+        print(f"[vector_store] 旧pickle索引已迁移为原生格式: {self.index_path}")
+
+    def _ensure_index(self):
+        """
+        按需加载FAISS索引（实例创建时不加载），返回当前发布的一代
+
+        索引在进程内共享，首次访问时加载；之后检查索引文件是否被其他进程更新。
+        写入方正持有索引锁时跳过本次检查，检索不等待写入
+        """
+        if not FAISS_AVAILABLE:
+            return None
+        handle = self._index_handle
+        if not handle.loaded:
+            with handle.lock:
+                if not handle.loaded:
+                    self._load_or_create_index()
+                    handle.loaded = True
+                    handle.last_check = time.monotonic()
+        elif time.monotonic() - handle.last_check >= self.index_reload_check_interval:
+            if handle.lock.acquire(blocking=False):
+                try:
+                    self._refresh_index()
+                finally:
+                    handle.lock.release()
+        return handle.snapshot
+
+    def _refresh_index(self):
+        """
+        检查其他进程的写入：索引文件有新版本时在后台加载，期间继续使用旧索引；
+        向量文件有新增行时增量补入索引
+        """
+        handle = self._index_handle
+        now = time.monotonic()
+        if now - handle.last_check < self.index_reload_check_interval:
+            return
+        handle.last_check = now
+        if handle.reloading:
+            return
+
+        version = index_cache.file_version(self.index_path)
+        if version != handle.file_version:
+            if version is not None and handle.index is not None:
+                handle.reloading = True
+                threading.Thread(target=self._reload_index_in_background, daemon=True).start()
+            else:
+                # 索引文件被删除或此前没有可用索引，只能同步加载
+                self._load_or_create_index()
+            return
+        if self.vector_file.count < handle.indexed_rows:
+            # 向量文件被重建，当前索引已失效
+            self._load_or_create_index()
+        elif handle.index is not None:
+            self._catch_up_index()
+            self._sync_tombstones()
+
+    def _reload_index_in_background(self):
+        """后台读取新版本索引文件，读取完成后替换共享索引"""
+        handle = self._index_handle
+        try:
+            version = index_cache.file_version(self.index_path)
+            index, mmapped = self._read_index_file(mmap=True)
+            index_factory.apply_search_params(index, self.get_index_config())
+            with handle.lock:
+                handle.publish(index, tombstones=self._load_tombstones())
+                handle.mmapped = mmapped
+                handle.file_version = version
+                handle.indexed_rows = self._read_index_meta().get("vector_rows", 0)
+                handle.unsaved_vectors = 0
+                # 本进程尚未写回的向量仍在向量文件中，一并补齐
+                self._catch_up_index()
+            print(f"[vector_store] 已热加载新版本索引: {self.index_path}")
+        except Exception as e:
+            print(f"[vector_store] 热加载索引失败，继续使用旧索引: {e}")
+        finally:
+            handle.reloading = False
+            self._db.close_thread()
+
+    def get_index_config(self) -> Dict:
+        """获取知识库的索引配置（index_config.json 覆盖默认值）"""
+        config = dict(index_factory.DEFAULT_INDEX_CONFIG)
+        if os.path.exists(self.index_config_path):
+            with open(self.index_config_path, "r", encoding="utf-8") as f:
+                config.update(json.load(f))
+        return config
+
+    def set_index_config(self, rebuild: bool = True, **updates) -> Dict:
+        """
+        修改并持久化知识库的索引配置
+
+        :param rebuild: 是否立即按新配置重建索引
+        :param updates: index_type / metric / memory_budget_mb / nlist / nprobe / hnsw_m / ef_construction / ef_search / pq_m / pq_nbits / vector_dtype / rescore_factor
+        :return: 修改后的配置
+        """
+        unknown = set(updates) - set(index_factory.DEFAULT_INDEX_CONFIG)
+        if unknown:
+            raise ValueError(f"未知的索引配置项: {sorted(unknown)}")
+        index_type = updates.get("index_type")
+        if index_type and index_type != "auto" and index_type not in index_factory.INDEX_TYPES:
+            raise ValueError(f"不支持的索引类型: {index_type}")
+        metric = updates.get("metric")
+        if metric is not None and metric not in index_factory.METRICS:
+            raise ValueError(f"不支持的相似度度量: {metric}")
+        vector_dtype = updates.get("vector_dtype")
+        if vector_dtype is not None:
+            if vector_dtype not in index_factory.VECTOR_DTYPES:
+                raise ValueError(f"不支持的向量存储类型: {vector_dtype}")
+            file_dtype = self.vector_file.dtype
+            wanted_file_dtype = index_factory.vector_file_dtype(vector_dtype)
+            if file_dtype is not None and file_dtype != wanted_file_dtype:
+                if self.vector_file.count > 0:
+                    # 已写入的向量不会被改写，float32 与压缩存储只能在新建知识库时选择
+                    raise ValueError(
+                        f"向量文件已按 {file_dtype} 存储，不能改为 {vector_dtype}"
+                    )
+                self.vector_file.create(
+                    self.vector_file.dim, self.vector_file.model_id, wanted_file_dtype
+                )
+        if updates.get("rescore_factor") is not None and int(updates["rescore_factor"]) < 1:
+            raise ValueError("rescore_factor 必须大于等于1")
+
+        config = self.get_index_config()
+        # 度量变化后索引中的向量必须按新度量重建
+        metric_changed = metric is not None and metric != config["metric"]
+        config.update(updates)
+        self._write_index_config(config)
+        self.metric = config["metric"]
+        if (rebuild or metric_changed) and FAISS_AVAILABLE:
+            self.rebuild_index()
+        elif self.index is not None:
+            index_factory.apply_search_params(self.index.base, config)
+        return config
+
+    def _init_metric(self) -> str:
+        """
+        读取知识库记录的相似度度量；未记录时新知识库使用默认度量，
+        已有向量的旧知识库沿用旧版本的L2距离
+        """
+        config = self.get_index_config()
+        if os.path.exists(self.index_config_path):
+            with open(self.index_config_path, "r", encoding="utf-8") as f:
+                if "metric" in json.load(f):
+                    return config["metric"]
+        has_data = (
+            self.vector_file.count > 0
+            or os.path.exists(self.index_path)
+            or os.path.exists(self.legacy_index_path)
+        )
+        if has_data:
+            config["metric"] = "l2"
+        self._write_index_config(config)
+        return config["metric"]
+
+    def _prepare_vectors(self, vectors) -> np.ndarray:
+        """转换为写入索引或查询用的float32矩阵，cosine度量下做L2归一化"""
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.metric == "cosine":
+            matrix = np.ascontiguousarray(vector_search.normalize_rows(matrix))
+        return matrix
+
+    def _write_index_config(self, config: Dict):
+        """保存索引配置（先写临时文件再替换，其他进程不会读到写了一半的文件）"""
+        tmp_path = f"{self.index_config_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_config_path)
+
+    def _new_index(self, dimension, n_vectors: int = 0):
+        """按知识库索引配置构造空的FAISS索引（使用chunk_id作为向量ID，删除后位置不会错乱）"""
+        config = self.get_index_config()
+        index_type = index_factory.resolve_index_type(n_vectors, dimension, config)
+        vector_dtype = index_factory.resolve_vector_dtype(index_type, n_vectors, config)
+        return index_factory.create_index(
+            index_type, dimension, n_vectors, {**config, "vector_dtype": vector_dtype}
+        )
 
     def _create_new_index(self, dimension):
         """创建新的FAISS索引，必须指定维度"""
         if FAISS_AVAILABLE:
-            self.index = faiss.IndexFlatL2(dimension)
+            handle = self._index_handle
+            with handle.lock:
+                handle.publish(self._new_index(dimension), tombstones=self._load_tombstones())
+                handle.mmapped = False
+                handle.indexed_rows = 0
+                handle.unsaved_vectors = 0
+                handle.loaded = True
+                handle.file_version = index_cache.file_version(self.index_path)
+                handle.last_check = time.monotonic()
             print(f"[vector_store] 创建新FAISS索引，维度: {dimension}")
         else:
-            self.index = None
+            self._index_handle.publish(None)
             print("[vector_store] FAISS不可用，使用基础向量存储")
 
     def add_document(
         self,
         file_path: str,
         chunks: List[str],
-        embeddings: List[List[float]],
+        embeddings: List[Optional[List[float]]],
         filename: Optional[str] = None,
+        model_id: str = "",
+        content_hash: Optional[str] = None,
+        aliases: Optional[List[Dict]] = None,
     ) -> int:
-        self._init_database()  # 再次确保表结构存在
-        if len(chunks) != len(embeddings):
-            raise ValueError("文档块数量与向量数量不匹配")
-
-        embedding_dim = len(embeddings[0]) if embeddings else 0
-        dim_file = os.path.join(os.path.dirname(self.db_path), 'embedding_dim.txt')
-
-        # 1. 维度校验，未通过则立即 raise 并 return
-        if not os.path.exists(dim_file):
-            with open(dim_file, 'w') as f:
-                f.write(str(embedding_dim))
-            self._create_new_index(embedding_dim)  # 用当前 embedding_dim 初始化索引
-        else:
-            with open(dim_file, 'r') as f:
-                recorded_dim = int(f.read().strip())
-            if embedding_dim != recorded_dim:
-                print(f"[vector_store] 检测到 embedding 维度变更（原: {recorded_dim}, 新: {embedding_dim}），自动清空知识库！")
-                db_dir = os.path.dirname(self.db_path)
-                for fname in [self.db_path, dim_file, self.index_path, self.vectors_path]:
-                    if os.path.exists(fname):
-                        os.remove(fname)
-                with open(dim_file, 'w') as f:
-                    f.write(str(embedding_dim))
-                self._create_new_index(embedding_dim)
-                raise RuntimeError(f"检测到 embedding 维度变更（原: {recorded_dim}, 新: {embedding_dim}），已自动清空知识库，请重新上传文档！")
-
-        # 2. 只有维度一致时才执行数据库和索引操作
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            # 1. 添加文档记录
-            db_filename = filename if filename else os.path.basename(file_path)
-            file_type = os.path.splitext(db_filename)[1].lower()
-            file_size = os.path.getsize(file_path)
+        """
+        添加文档及其向量
 
-            cursor.execute(
+        :param embeddings: 与 chunks 一一对应；已有相同内容文本块的位置可为None（复用其向量）
+        :param model_id: 生成向量的模型标识，记录在向量文件头部
+        :param content_hash: 文件内容哈希，默认按 file_path 计算
+        :param aliases: 入库前合并的近似重复文本块，见 add_documents
+        :return: 文档ID
+        """
+        return self.add_documents(
+            [
+                {
+                    "file_path": file_path,
+                    "chunks": chunks,
+                    "embeddings": embeddings,
+                    "filename": filename,
+                    "content_hash": content_hash,
+                    "aliases": aliases or [],
+                }
+            ],
+            model_id=model_id,
+        )[0]
+
+    def find_document_by_hash(self, content_hash: str) -> Optional[int]:
+        """按文件内容哈希查找已入库的文档，返回文档ID"""
+        with self._db.read() as conn:
+            row = conn.execute(
                 """
-                INSERT INTO documents (filename, file_path, file_type, file_size)
-                VALUES (?, ?, ?, ?)
-                """,
-                (db_filename, file_path, file_type, file_size),
-            )
+                SELECT id FROM documents WHERE content_hash = ? AND status = 'active'
+                ORDER BY id LIMIT 1
+            """,
+                (content_hash,),
+            ).fetchone()
+        return row[0] if row else None
 
-            document_id = cursor.lastrowid
-            if document_id is None:
-                raise ValueError("无法获取文档ID")
+    def find_chunks_by_hash(
+        self, chunk_hashes: List[str], content_hash: Optional[str] = None
+    ) -> Dict[str, int]:
+        """
+        按文本块内容哈希查找已有向量的文本块
 
-            # 2. 添加文本块
-            for i, chunk in enumerate(chunks):
-                cursor.execute(
-                    """
-                    INSERT INTO chunks (document_id, chunk_index, content, chunk_size)
-                    VALUES (?, ?, ?, ?)
-                    """,
-                    (document_id, i, chunk, len(chunk)),
+        :param content_hash: 待入库文档的文件哈希（分片存储据此确定所属分片，这里不使用）
+        :return: {内容哈希: 持有向量的chunk_id}，已删除（墓碑）的向量不会被复用
+        """
+        if not chunk_hashes:
+            return {}
+        with self._db.read() as conn:
+            rows = conn.execute(
+                """
+                SELECT c.content_hash, c.id
+                FROM chunks c
+                JOIN vectors v ON v.chunk_id = c.id
+                WHERE c.content_hash IN (SELECT value FROM json_each(?))
+                AND v.vector_index >= 0
+                AND c.id NOT IN (SELECT chunk_id FROM tombstones)
+                ORDER BY c.id
+            """,
+                (json.dumps(list(set(chunk_hashes))),),
+            ).fetchall()
+        found: Dict[str, int] = {}
+        for content_hash, chunk_id in rows:
+            found.setdefault(content_hash, chunk_id)
+        return found
+
+    def add_documents(self, documents: List[Dict], model_id: str = "") -> List[int]:
+        """
+        批量添加文档及其向量
+
+        整批向量一次追加到向量文件；文档、文本块和向量记录在同一个事务中用
+        executemany 写入，大批量入库时耗时取决于向量化而不是SQLite往返。
+
+        内容相同的文本块（按内容哈希，包括知识库中已有的和同一批中的）只保存一个向量，
+        之后的文本块以 canonical_chunk_id 指向持有向量的文本块，不再写入向量文件和索引。
+        入库前合并的近似重复文本块（aliases）同样以 canonical_chunk_id 指向保留文本块的向量，
+        chunk_index 为合并前在文档中的位置，保留的文本块依次占用其余位置。
+
+        :param documents: 文档列表，每项包含 file_path、chunks、embeddings，
+                          可选 filename、content_hash（文件内容哈希）、
+                          aliases（[{"content", "canonical": 保留文本块在 chunks 中的位置,
+                          "position": 合并前的位置}]）
+        :param model_id: 生成向量的模型标识，记录在向量文件头部
+        :return: 文档ID列表，与 documents 顺序一致
+        """
+        if not documents:
+            return []
+        embedding_dim = 0
+        for doc in documents:
+            if len(doc["chunks"]) != len(doc["embeddings"]):
+                raise ValueError("文档块数量与向量数量不匹配")
+            for embedding in doc["embeddings"]:
+                if embedding is None:
+                    continue
+                if embedding_dim and len(embedding) != embedding_dim:
+                    raise ValueError("同一批文档的向量维度不一致")
+                embedding_dim = len(embedding)
+        hashes = [[chunk_hash(chunk) for chunk in doc["chunks"]] for doc in documents]
+
+        # 同一进程的入库持有索引锁串行执行，向量文件行号按提交顺序递增；
+        # 检索固定已发布的一代索引，不需要该锁，不受入库影响
+        with self._index_handle.lock:
+            # 1. 维度校验，未通过则立即 raise 并 return
+            if embedding_dim:
+                self._check_embedding_dim(embedding_dim)
+            else:
+                # 全部文本块复用已有向量
+                self._ensure_index()
+
+            self._ensure_vector_file()
+            document_ids = []
+            chunk_ids = []
+            # 追加向量和写入记录在同一个写事务中：BEGIN IMMEDIATE 的写锁跨进程串行化入库，
+            # 多个进程（如多个Web worker和命令行）不会分配到相同的向量文件行号
+            with self._db.transaction() as conn:
+                cursor = conn.cursor()
+                # 2. 只把需要新向量的文本块追加到向量文件，得到全局行号
+                existing = self.find_chunks_by_hash(
+                    [h for doc_hashes in hashes for h in doc_hashes]
+                )
+                new_embeddings = []
+                seen = set(existing)
+                for doc, doc_hashes in zip(documents, hashes):
+                    for embedding, content_hash in zip(doc["embeddings"], doc_hashes):
+                        if content_hash in seen:
+                            continue
+                        if embedding is None:
+                            raise ValueError("文本块缺少向量，且知识库中没有相同内容的文本块可以复用")
+                        seen.add(content_hash)
+                        new_embeddings.append(embedding)
+                start_row = (
+                    self.vector_file.append(
+                        new_embeddings,
+                        model_id=model_id,
+                        dtype=index_factory.vector_file_dtype(self.get_index_config()["vector_dtype"]),
+                    )
+                    if new_embeddings
+                    else self.vector_file.count
                 )
 
-                chunk_id = cursor.lastrowid
-
-                # 3. 添加向量记录
-                embedding = embeddings[i]
-                cursor.execute(
+                # 3. 文档、文本块和向量记录整批写入
+                # 持有写锁后预分配文本块ID，executemany 无法逐行返回 lastrowid
+                next_chunk_id = self._next_id(cursor, "chunks")
+                chunk_rows = []
+                vector_rows = []
+                row = start_row
+                canonical = dict(existing)  # 内容哈希 -> 持有向量的chunk_id
+                for doc, doc_hashes in zip(documents, hashes):
+                    db_filename = doc.get("filename") or os.path.basename(doc["file_path"])
+                    cursor.execute(
+                        """
+                        INSERT INTO documents (filename, file_path, file_type, file_size, content_hash)
+                        VALUES (?, ?, ?, ?, ?)
+                        """,
+                        (
+                            db_filename,
+                            doc["file_path"],
+                            os.path.splitext(db_filename)[1].lower(),
+                            os.path.getsize(doc["file_path"]),
+                            doc.get("content_hash") or document_hash(doc["file_path"]),
+                        ),
+                    )
+                    document_id = cursor.lastrowid
+                    if document_id is None:
+                        raise ValueError("无法获取文档ID")
+                    document_ids.append(document_id)
+
+                    aliases = doc.get("aliases") or []
+                    alias_positions = {alias["position"] for alias in aliases}
+                    positions = [
+                        p for p in range(len(doc["chunks"]) + len(aliases)) if p not in alias_positions
+                    ]
+                    for i, chunk, content_hash in zip(positions, doc["chunks"], doc_hashes):
+                        canonical_chunk_id = canonical.get(content_hash)
+                        chunk_rows.append(
+                            (next_chunk_id, document_id, i, chunk, len(chunk), content_hash, canonical_chunk_id)
+                        )
+                        if canonical_chunk_id is None:
+                            canonical[content_hash] = next_chunk_id
+                            vector_rows.append((next_chunk_id, row, embedding_dim))
+                            chunk_ids.append(next_chunk_id)
+                            row += 1
+                        next_chunk_id += 1
+                    for alias in aliases:
+                        # 指向保留文本块所用的向量（保留文本块本身也可能复用已有向量）
+                        canonical_chunk_id = canonical[doc_hashes[alias["canonical"]]]
+                        content = alias["content"]
+                        chunk_rows.append(
+                            (
+                                next_chunk_id,
+                                document_id,
+                                alias["position"],
+                                content,
+                                len(content),
+                                chunk_hash(content),
+                                canonical_chunk_id,
+                            )
+                        )
+                        next_chunk_id += 1
+
+                cursor.executemany(
                     """
-                    INSERT INTO vectors (chunk_id, vector_index, vector_dim)
-                    VALUES (?, ?, ?)
+                    INSERT INTO chunks
+                        (id, document_id, chunk_index, content, chunk_size, content_hash, canonical_chunk_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
                     """,
-                    (chunk_id, i, len(embedding)),
+                    chunk_rows,
                 )
+                cursor.executemany(
+                    "INSERT INTO vectors (chunk_id, vector_index, vector_dim) VALUES (?, ?, ?)",
+                    vector_rows,
+                )
+                self._bump_corpus_version(cursor)
 
-            conn.commit()
-
-        # 3. 更新向量索引
-        self._update_index(embeddings)
+            # 4. 更新向量索引
+            if chunk_ids:
+                self._update_index(new_embeddings, chunk_ids, start_row)
         print(
-            f"[vector_store] 成功添加文档: {db_filename}，包含 {len(chunks)} 个文本块"
+            f"[vector_store] 成功添加 {len(documents)} 个文档，包含 {len(chunk_rows)} 个文本块"
+            f"（{len(chunk_rows) - len(chunk_ids)} 个复用已有向量）"
         )
-        return document_id
+        return document_ids
+
+    @staticmethod
+    def _next_id(cursor: sqlite3.Cursor, table: str) -> int:
+        """AUTOINCREMENT 表的下一个ID（调用方需持有写锁）"""
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+        row = cursor.fetchone()
+        seq = row[0] if row else 0
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        return max(seq, cursor.fetchone()[0]) + 1
+
+    def _check_embedding_dim(self, embedding_dim: int):
+        """
+        校验向量维度与知识库记录的维度一致；维度变更时清空知识库并抛出 RuntimeError
+        """
+        dim_file = self.dim_path
+        if not os.path.exists(dim_file):
+            with open(dim_file, 'w') as f:
+                f.write(str(embedding_dim))
+            self._create_new_index(embedding_dim)  # 用当前 embedding_dim 初始化索引
+            return
+
+        with open(dim_file, 'r') as f:
+            recorded_dim = int(f.read().strip())
+        if embedding_dim != recorded_dim:
+            print(f"[vector_store] 检测到 embedding 维度变更（原: {recorded_dim}, 新: {embedding_dim}），自动清空知识库！")
+            self._db.close_all()
+            for fname in [
+                self.db_path,
+                f"{self.db_path}-wal",
+                f"{self.db_path}-shm",
+                dim_file,
+                self.index_path,
+                self.index_meta_path,
+                self.legacy_index_path,
+                self.vectors_path,
+            ]:
+                if os.path.exists(fname):
+                    os.remove(fname)
+            # 数据库文件已删除，重新建表；新库的语料版本从0开始，丢弃旧的语料视图
+            self._init_database()
+            corpus_cache.invalidate_corpus_view(self.db_path)
+            with open(dim_file, 'w') as f:
+                f.write(str(embedding_dim))
+            self._create_new_index(embedding_dim)
+            raise RuntimeError(f"检测到 embedding 维度变更（原: {recorded_dim}, 新: {embedding_dim}），已自动清空知识库，请重新上传文档！")
+        # 新实例尚未加载索引时先加载，保证增量写入已有索引
+        self._ensure_index()
+
+    def _update_index(
+        self, embeddings: List[List[float]], chunk_ids: List[int], start_row: int
+    ):
+        """
+        更新FAISS索引，向量以chunk_id为ID加入索引，作为新一代发布
 
-    def _update_index(self, embeddings: List[List[float]]):
-        """更新FAISS索引"""
+        :param start_row: 本批向量在向量文件中的起始行号
+        """
         if not FAISS_AVAILABLE or self.index is None:
             return
 
         # 转换为numpy数组
-        vectors = np.array(embeddings, dtype=np.float32)
+        vectors = self._prepare_vectors(embeddings)
+
+        handle = self._index_handle
+        with handle.lock:
+            # 添加到索引
+            if vectors.shape[1] != self.index.d:
+                raise RuntimeError(f"FAISS 索引维度为 {self.index.d}，但本次入库向量为 {vectors.shape[1]} 维，维度不一致！")
+            if handle.indexed_rows == start_row:
+                self._add_to_index(vectors, np.array(chunk_ids, dtype=np.int64))
+                handle.indexed_rows = start_row + len(chunk_ids)
+            else:
+                # 之前还有已提交但未补入索引的行，从向量文件统一补齐（包含本批）
+                self._catch_up_index()
+
+            # 向量规模变化后，配置要求的索引类型可能不同（如 flat -> hnsw、
+            # int8 训练样本已足够），此时重建
+            config = self.get_index_config()
+            desired_type = index_factory.resolve_index_type(
+                self.index.ntotal, self.index.d, config
+            )
+            desired_dtype = index_factory.resolve_vector_dtype(
+                desired_type, self.index.ntotal, config
+            )
+            if (desired_type, desired_dtype) != (
+                index_factory.index_type_of(self.index.base),
+                index_factory.vector_dtype_of(self.index.base),
+            ):
+                print(
+                    f"[vector_store] 向量数达到 {self.index.ntotal}，索引切换为 {desired_type}/{desired_dtype}"
+                )
+                self.rebuild_index()
+            elif handle.unsaved_vectors >= self.index_save_interval:
+                # 索引文件不必每次上传都重写，未写回的向量在加载时从向量文件补齐
+                self._save_index()
 
-        # 添加到索引
-        if vectors.shape[1] != self.index.d:
-            raise RuntimeError(f"FAISS 索引维度为 {self.index.d}，但本次入库向量为 {vectors.shape[1]} 维，维度不一致！")
-        self.index.add(vectors)
+        print(f"[vector_store] 更新FAISS索引，新增 {len(embeddings)} 个向量")
 
-        # 保存索引
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index, f)
+    def _save_index(self, index=None, vector_rows: Optional[int] = None):
+        """
+        用FAISS原生格式保存索引：先写临时文件再原子替换，写入中途崩溃不会损坏已有索引
 
-        print(f"[vector_store] 更新FAISS索引，新增 {len(embeddings)} 个向量")
+        :param index: 要保存的索引，默认为当前一代（delta 先并入主索引并发布）
+        :param vector_rows: 索引覆盖的向量文件行数，默认为当前已索引行数
+        """
+        handle = self._index_handle
+        if index is None:
+            snapshot = handle.snapshot
+            index = snapshot.base
+            if snapshot.delta is not None and snapshot.delta.ntotal:
+                index = self._merged_base()
+                handle.publish(index)
+                handle.mmapped = False
+        if vector_rows is not None:
+            handle.indexed_rows = vector_rows
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        faiss.write_index(index, tmp_path)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        # 记录本进程写入的版本，避免把自己的写入当作外部更新重新加载
+        handle.file_version = index_cache.file_version(self.index_path)
+
+        tmp_meta = f"{self.index_meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"vector_rows": handle.indexed_rows}, f)
+        os.replace(tmp_meta, self.index_meta_path)
+        handle.unsaved_vectors = 0
+
+    def flush(self):
+        """把尚未写回的索引改动保存到文件"""
+        with self._index_handle.lock:
+            if self.index is not None and self._index_handle.unsaved_vectors:
+                self._save_index()
+
+    def close(self):
+        """保存未写回的索引并关闭当前线程的数据库连接"""
+        self.flush()
+        self._db.close_thread()
+
+    def unload(self):
+        """
+        释放进程内缓存的索引和语料视图（先保存未写回的索引），下次检索时重新加载
+
+        索引由同一知识库的所有实例共享；进行中的查询固定的快照不受影响。
+        """
+        self.flush()
+        self._index_handle.reset()
+        corpus_cache.invalidate_corpus_view(self.db_path)
+
+    def _get_chunks_by_ids(
+        self, chunk_ids: List[int], filters: Optional[Dict] = None
+    ) -> Dict[int, Dict]:
+        """
+        根据索引命中的chunk_id批量获取文本块信息（一次查询，ID以JSON数组传入，不受SQL参数个数限制）
+
+        命中的向量可能被多个内容相同的文本块共用：优先返回持有向量的文本块，
+        它所属文档已删除或不满足过滤条件时返回共用该向量的其他文本块
 
-    def search(self, query_vector: List[float], top_k: int = 5) -> List[Dict]:
+        :return: {命中的chunk_id: 文本块信息}
+        """
+        if not chunk_ids:
+            return {}
+        filter_sql, filter_params = build_filter_sql(filters)
+        select = f"""
+            SELECT h.value, c.id, c.content, c.document_id, d.filename
+            FROM json_each(?) h
+            JOIN chunks c ON {{join}}
+            JOIN documents d ON c.document_id = d.id
+            WHERE d.status = 'active'{filter_sql}
+        """
+        ids_json = json.dumps([int(cid) for cid in chunk_ids])
+        conn = self._db.read()
+        rows = conn.execute(
+            select.format(join="c.id = h.value")
+            + " UNION ALL "
+            + select.format(join="c.canonical_chunk_id = h.value")
+            + " ORDER BY 2",
+            [ids_json, *filter_params, ids_json, *filter_params],
+        ).fetchall()
+        chunks: Dict[int, Dict] = {}
+        for hit_id, chunk_id, content, document_id, filename in rows:
+            chunks.setdefault(
+                hit_id,
+                {
+                    "chunk_id": chunk_id,
+                    "content": content,
+                    "document_id": document_id,
+                    "filename": filename,
+                },
+            )
+        return chunks
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        score_threshold: Optional[float] = None,
+        filters: Optional[Dict] = None,
+    ) -> List[Dict]:
         """
         向量相似度搜索
 
         :param query_vector: 查询向量
         :param top_k: 返回最相似的结果数量
-        :return: 搜索结果列表，包含文档信息和相似度分数
+        :param score_threshold: 相似度下限，低于该值的命中在查询数据库前即被丢弃
+        :param filters: 元数据过滤条件（document_ids / file_types / filenames /
+                        created_after / created_before），在索引搜索内部生效
+        :return: 搜索结果列表，包含文档信息和相似度分数（越大越相似）
         """
-        if not FAISS_AVAILABLE or self.index is None:
-            # 回退到基础搜索
-            return self._basic_search(query_vector, top_k)
+        return self.search_many([query_vector], top_k, score_threshold, filters)[0]
 
-        # 使用FAISS搜索
-        query_array = np.array([query_vector], dtype=np.float32)
-        scores, indices = self.index.search(query_array, top_k)
+    def search_many(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        score_threshold: Optional[float] = None,
+        filters: Optional[Dict] = None,
+    ) -> List[List[Dict]]:
+        """
+        批量向量搜索：所有查询一次矩阵搜索，所有命中一次查询数据库
 
-        # 获取详细信息
-        results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx == -1:  # FAISS返回-1表示无效索引
-                continue
+        :param query_vectors: 查询向量列表
+        :return: 每个查询的搜索结果列表，与 query_vectors 顺序一致
+        """
+        if len(query_vectors) == 0:
+            return []
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(len(query_vectors), -1)
+        if not self.has_recorded_dim():
+            # 尚未入库：维度未确定，索引只是按默认维度创建的占位，不能用任意维度的查询搜索
+            return [[] for _ in range(len(queries))]
 
-            chunk_info = self._get_chunk_by_index(idx)
-            if chunk_info:
-                results.append(
-                    {
-                        "chunk_id": chunk_info["chunk_id"],
-                        "content": chunk_info["content"],
-                        "document_id": chunk_info["document_id"],
-                        "filename": chunk_info["filename"],
-                        "score": float(score),
-                        "rank": i + 1,
-                    }
+        if FAISS_AVAILABLE:
+            self._ensure_index()
+        # 整个查询（搜索、重排、组装结果）固定使用同一代索引：
+        # 期间的入库和删除发布新一代，本次查询既不等待也看不到写了一半的状态
+        with self._index_handle.pin() as snapshot:
+            candidates = None
+            if filters:
+                # 先在数据库中得到允许的文本块，再限制搜索范围，而不是搜索后再过滤
+                candidates = self._get_live_vectors(filters)
+                if len(candidates) == 0:
+                    return [[] for _ in range(len(queries))]
+
+            if (
+                not FAISS_AVAILABLE
+                or snapshot is None
+                or (candidates is not None and len(candidates) <= self.filter_exact_search_limit)
+            ):
+                # 回退到基础搜索；过滤后候选很少时直接精确计算
+                scores, chunk_ids = self._exact_search(queries, top_k, candidates)
+            else:
+                selector = None
+                if candidates is not None:
+                    selector = faiss.IDSelectorBatch(np.ascontiguousarray(candidates[:, 0]))
+                rescore = index_factory.needs_rescore(snapshot.base)
+                config = self.get_index_config() if rescore or selector is not None else None
+                k = top_k
+                if rescore:
+                    # 有损索引多取候选，再用向量文件中的向量精确重排
+                    k = top_k * max(1, int(config["rescore_factor"]))
+                scores, chunk_ids = snapshot.search(
+                    self._prepare_vectors(queries), k, config, selector
                 )
+                if rescore:
+                    scores, chunk_ids = self._rescore(queries, chunk_ids, top_k)
 
-        return results
+            scores = vector_search.to_similarity(scores, self.metric)
+            return self._hydrate_hits(scores, chunk_ids, score_threshold, filters)
 
-    def _basic_search(self, query_vector: List[float], top_k: int = 5) -> List[Dict]:
-        """基础向量搜索（不使用FAISS）"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+    def _rescore(
+        self, queries: np.ndarray, candidates: np.ndarray, top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        对索引返回的候选按向量文件中的向量精确重排（float32计算）
 
-            # 获取所有向量
-            cursor.execute(
+        :param candidates: (nq, k) 候选chunk_id，-1表示无效
+        :return: (scores, chunk_ids)，形状均为 (nq, top_k)，不足时chunk_id为-1
+        """
+        worst = np.inf if self.metric == "l2" else -np.inf
+        scores = np.full((len(queries), top_k), worst, dtype=np.float32)
+        chunk_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        unique_ids = np.unique(candidates[candidates >= 0])
+        if len(unique_ids) == 0:
+            return scores, chunk_ids
+        with self._db.read() as conn:
+            rows = conn.execute(
                 """
-                SELECT v.id, v.chunk_id, v.vector_index, c.content, c.document_id, d.filename
-                FROM vectors v
-                JOIN chunks c ON v.chunk_id = c.id
-                JOIN documents d ON c.document_id = d.id
-                ORDER BY v.id
-            """
+                SELECT chunk_id, vector_index FROM vectors
+                WHERE chunk_id IN (SELECT value FROM json_each(?)) AND vector_index >= 0
+                ORDER BY chunk_id
+                """,
+                (json.dumps(unique_ids.tolist()),),
+            ).fetchall()
+        if not rows:
+            return scores, chunk_ids
+        located = np.array(rows, dtype=np.int64)
+        # 所有查询的候选向量一次读取
+        vectors = self.vector_file.memmap()[located[:, 1]]
+
+        for i, (query, row_ids) in enumerate(zip(queries, candidates)):
+            # 丢弃无效候选和已没有向量的文本块
+            row_ids = row_ids[np.isin(row_ids, located[:, 0])]
+            if len(row_ids) == 0:
+                continue
+            positions = np.searchsorted(located[:, 0], row_ids)
+            row_scores, hit = vector_search.search_matrix(
+                vectors[positions], query, min(top_k, len(positions)), metric=self.metric
             )
+            n = row_scores.shape[1]
+            scores[i, :n] = row_scores[0]
+            chunk_ids[i, :n] = np.where(hit[0] >= 0, located[positions[hit[0]], 0], -1)
+        return scores, chunk_ids
 
-            rows = cursor.fetchall()
+    def _hydrate_hits(
+        self,
+        scores: np.ndarray,
+        chunk_ids: np.ndarray,
+        score_threshold: Optional[float] = None,
+        filters: Optional[Dict] = None,
+    ) -> List[List[Dict]]:
+        """
+        按分数阈值过滤命中后，一次查询获取所有查询命中文本块的详细信息
 
-            if not rows:
-                return []
+        :param scores: (nq, k) 相似度分数
+        :param chunk_ids: (nq, k) 命中的chunk_id，-1表示无效
+        :param filters: 检索的过滤条件，共用向量的文本块中只返回满足条件的
+        :return: 每个查询的结果列表
+        """
+        valid = chunk_ids != -1  # FAISS返回-1表示无效索引
+        if score_threshold is not None:
+            valid &= scores >= score_threshold
+        chunk_infos = self._get_chunks_by_ids(np.unique(chunk_ids[valid]).tolist(), filters)
 
-            # 计算相似度（这里简化处理，实际应该从文件加载向量）
+        all_results = []
+        for row_scores, row_ids, row_valid in zip(scores, chunk_ids, valid):
             results = []
-            for row in rows:
-                # 简化的相似度计算，实际应该加载真实向量
-                score = 0.5  # 占位符
-                results.append(
-                    {
-                        "chunk_id": row[1],
-                        "content": row[3],
-                        "document_id": row[4],
-                        "filename": row[5],
-                        "score": score,
-                        "rank": len(results) + 1,
-                    }
-                )
+            for score, chunk_id in zip(row_scores[row_valid], row_ids[row_valid]):
+                chunk_info = chunk_infos.get(int(chunk_id))
+                if chunk_info:
+                    results.append(
+                        {
+                            "chunk_id": chunk_info["chunk_id"],
+                            "content": chunk_info["content"],
+                            "document_id": chunk_info["document_id"],
+                            "filename": chunk_info["filename"],
+                            "score": float(score),
+                            "rank": len(results) + 1,
+                        }
+                    )
+            all_results.append(results)
+        return all_results
+
+    def _get_live_vectors(self, filters: Optional[Dict] = None) -> np.ndarray:
+        """
+        获取向量文件中有效的向量行
 
-            # 按分数排序并返回top_k
-            results.sort(key=lambda x: x["score"], reverse=True)
-            return results[:top_k]
+        :param filters: 元数据过滤条件，只返回满足条件的文档的文本块
+        :return: (n, 2) 数组，每行为 (chunk_id, vector_index)
+        """
+        count = self.vector_file.count
+        if filters:
+            filter_sql, filter_params = build_filter_sql(filters)
+            # 满足条件的文本块可能与其他文档的文本块共用向量
+            sql = f"""
+                SELECT DISTINCT v.chunk_id, v.vector_index
+                FROM chunks c
+                JOIN documents d ON c.document_id = d.id
+                JOIN vectors v ON v.chunk_id = COALESCE(c.canonical_chunk_id, c.id)
+                WHERE v.vector_index >= 0 AND v.vector_index < ? AND d.status = 'active'{filter_sql}
+            """
+        else:
+            sql = """
+                SELECT chunk_id, vector_index FROM vectors
+                WHERE vector_index >= 0 AND vector_index < ?
+                AND chunk_id NOT IN (SELECT chunk_id FROM tombstones)
+            """
+            filter_params = []
+        with self._db.read() as conn:
+            rows = conn.execute(sql, [count, *filter_params]).fetchall()
+        return np.array(rows, dtype=np.int64).reshape(-1, 2)
 
-    def _get_chunk_by_index(self, index: int) -> Optional[Dict]:
-        """根据索引获取文本块信息"""
-        with sqlite3.connect(self.db_path) as conn:
+    def _ensure_vector_file(self):
+        """
+        确保向量文件可用。旧版本知识库只有pickle索引时，加载索引会触发迁移；
+        无法迁移的旧向量标记为缺失（vector_index = -1）。
+        """
+        if self.vector_file.exists():
+            return
+        self._ensure_index()
+        if self.vector_file.exists():
+            return
+        with self._db.transaction() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT c.id, c.content, c.document_id, d.filename
+            cursor.execute("UPDATE vectors SET vector_index = -1")
+            if cursor.rowcount:
+                self._bump_corpus_version(cursor)
+                print("[vector_store] 旧索引与数据库不一致，已有向量无法迁移")
+
+    def _migrate_legacy_index(self, legacy_index):
+        """
+        迁移旧版本索引：从按插入顺序编号的索引中还原向量写入向量文件，
+        把vector_index改为全局行号，再按chunk_id重建索引
+        """
+        if not self.vector_file.exists():
+            with self._db.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT v.id FROM vectors v JOIN chunks c ON v.chunk_id = c.id ORDER BY c.id"
+                )
+                vector_row_ids = [row[0] for row in cursor.fetchall()]
+                if vector_row_ids and legacy_index.ntotal == len(vector_row_ids):
+                    # 旧索引中第i个向量对应按id排序的第i个文本块
+                    self.vector_file.append(legacy_index.reconstruct_n(0, legacy_index.ntotal))
+                    cursor.executemany(
+                        "UPDATE vectors SET vector_index = ? WHERE id = ?",
+                        [(row, vid) for row, vid in enumerate(vector_row_ids)],
+                    )
+                    print(f"[vector_store] 已从旧索引迁移 {len(vector_row_ids)} 个向量到向量文件")
+                else:
+                    cursor.execute("UPDATE vectors SET vector_index = -1")
+                    print("[vector_store] 旧索引与数据库不一致，已有向量无法迁移")
+                self._bump_corpus_version(cursor)
+        self.rebuild_index()
+
+    def get_chunk_vectors(
+        self, filters: Optional[Dict] = None
+    ) -> Optional[Tuple[List[int], List[str], np.ndarray]]:
+        """
+        获取所有有效文本块及其已持久化的向量，供混合检索直接使用（无需重新向量化）
+
+        :param filters: 元数据过滤条件，见 build_filter_sql
+        :return: (chunk_ids, contents, vectors)；存在缺失向量时返回None
+        """
+        self._ensure_vector_file()
+        filter_sql, filter_params = build_filter_sql(filters)
+        # 行号在压缩时会被改写，读取期间固定
+        with self._index_handle.pin():
+            with self._db.read() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"""
+                    SELECT c.id, c.content, v.vector_index
+                    FROM chunks c
+                    JOIN documents d ON c.document_id = d.id
+                    JOIN vectors v ON v.chunk_id = COALESCE(c.canonical_chunk_id, c.id)
+                    WHERE d.status = 'active' AND {NOT_SAME_DOCUMENT_ALIAS_SQL}{filter_sql}
+                    ORDER BY c.id
+                """,
+                    filter_params,
+                )
+                rows = cursor.fetchall()
+
+            matrix = self.vector_file.memmap()
+            if not rows:
+                return [], [], np.zeros((0, matrix.shape[1]), dtype=np.float32)
+
+            rows_index = np.array([row[2] for row in rows], dtype=np.int64)
+            if rows_index.min() < 0 or rows_index.max() >= matrix.shape[0]:
+                return None
+            return [row[0] for row in rows], [row[1] for row in rows], matrix[rows_index]
+
+    def get_chunk_texts(self, filters: Optional[Dict] = None) -> List[str]:
+        """获取所有有效文本块的内容（按chunk_id排序），用于向量缺失时重新向量化"""
+        filter_sql, filter_params = build_filter_sql(filters)
+        with self._db.read() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT c.content
                 FROM chunks c
                 JOIN documents d ON c.document_id = d.id
+                WHERE d.status = 'active' AND {NOT_SAME_DOCUMENT_ALIAS_SQL}{filter_sql}
                 ORDER BY c.id
-                LIMIT 1 OFFSET ?
             """,
-                (index,),
-            )
+                filter_params,
+            ).fetchall()
+        return [row[0] for row in rows]
 
-            row = cursor.fetchone()
-            if row:
-                return {
-                    "chunk_id": row[0],
-                    "content": row[1],
-                    "document_id": row[2],
-                    "filename": row[3],
-                }
-            return None
+    def get_corpus_view(self, filters: Optional[Dict] = None) -> corpus_cache.CorpusView:
+        """
+        获取有效文本块的语料视图（chunk_id、文档ID、内容和向量，按chunk_id排序），供混合检索使用
+
+        视图按语料版本在进程内缓存，版本不变时直接复用，不再查询全部文本块；
+        过滤条件只查询满足条件的文档ID，再从完整视图中取出对应文本块。
+        存在缺失向量时视图的 vectors 为 None，由调用方重新向量化。
+        """
+        view = corpus_cache.get_corpus_view(
+            self.db_path, self.get_corpus_version(), self._build_corpus_view
+        )
+        if not filters:
+            return view
+        filter_sql, filter_params = build_filter_sql(filters)
+        with self._db.read() as conn:
+            rows = conn.execute(
+                f"SELECT d.id FROM documents d WHERE d.status = 'active'{filter_sql}",
+                filter_params,
+            ).fetchall()
+        document_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        return view.subset(np.flatnonzero(np.isin(view.document_ids, document_ids)))
+
+    def _build_corpus_view(self, budget_bytes: int) -> corpus_cache.CorpusView:
+        """
+        在一个读事务中读取语料版本和全部有效文本块，按内存上限决定内容和向量是否常驻
+
+        - 全部放得下：内容和向量都载入内存
+        - 否则只载入向量，内容按需读取
+        - 向量也放不下：向量按行号从向量文件按需读取
+        """
+        self._ensure_vector_file()
+        # 行号在压缩时会被改写，读取期间固定
+        with self._index_handle.pin():
+            conn = self._db.read()
+            conn.execute("BEGIN")
+            try:
+                version = conn.execute(
+                    "SELECT value FROM meta WHERE key = 'corpus_version'"
+                ).fetchone()[0]
+                rows = conn.execute(
+                    f"""
+                    SELECT c.id, c.document_id, COALESCE(v.vector_index, -1), c.chunk_size
+                    FROM chunks c
+                    JOIN documents d ON c.document_id = d.id
+                    LEFT JOIN vectors v ON v.chunk_id = COALESCE(c.canonical_chunk_id, c.id)
+                    WHERE d.status = 'active' AND {NOT_SAME_DOCUMENT_ALIAS_SQL}
+                    ORDER BY c.id
+                """
+                ).fetchall()
+                table = np.array(rows, dtype=np.int64).reshape(-1, 4)
+                chunk_ids = np.ascontiguousarray(table[:, 0])
+                document_ids = np.ascontiguousarray(table[:, 1])
+                rows_index = np.ascontiguousarray(table[:, 2])
+
+                matrix = self.vector_file.memmap()
+                count = len(chunk_ids)
+                has_vectors = count == 0 or (
+                    rows_index.min() >= 0 and rows_index.max() < matrix.shape[0]
+                )
+                ids_bytes = chunk_ids.nbytes + document_ids.nbytes
+                vector_bytes = count * matrix.shape[1] * 4 if has_vectors else 0
+                contents_bytes = corpus_cache.estimate_contents_bytes(int(table[:, 3].sum()), count)
+
+                if ids_bytes + vector_bytes + contents_bytes <= budget_bytes:
+                    contents = [
+                        row[0]
+                        for row in conn.execute(
+                            f"""
+                            SELECT c.content FROM chunks c
+                            JOIN documents d ON c.document_id = d.id
+                            WHERE d.status = 'active' AND {NOT_SAME_DOCUMENT_ALIAS_SQL}
+                            ORDER BY c.id
+                        """
+                        )
+                    ]
+                else:
+                    contents = corpus_cache.LazyContents(self._load_chunk_contents, chunk_ids)
+            finally:
+                conn.rollback()
+
+            vectors = None
+            if has_vectors:
+                if ids_bytes + vector_bytes + chunk_ids.nbytes <= budget_bytes:
+                    vectors = corpus_cache.LazyVectors(matrix, rows_index)()
+                else:
+                    vectors = corpus_cache.LazyVectors(matrix, rows_index)
+        return corpus_cache.CorpusView(version, chunk_ids, document_ids, contents, vectors)
+
+    def _load_chunk_contents(self, chunk_ids: List[int]) -> List[str]:
+        """按chunk_id批量读取文本块内容（顺序与 chunk_ids 一致，已被压缩移除的为空字符串）"""
+        with self._db.read() as conn:
+            rows = conn.execute(
+                "SELECT id, content FROM chunks WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(chunk_ids),),
+            ).fetchall()
+        contents = dict(rows)
+        return [contents.get(chunk_id, "") for chunk_id in chunk_ids]
+
+    def get_chunk_metadata(self, chunk_ids: List[int]) -> Dict[int, Dict]:
+        """
+        按chunk_id批量获取文本块所属文档（一次查询，按主键查找）
+
+        :return: {chunk_id: {"chunk_id", "document_id", "chunk_index", "filename"}}
+        """
+        if not chunk_ids:
+            return {}
+        with self._db.read() as conn:
+            rows = conn.execute(
+                """
+                SELECT c.id, c.document_id, c.chunk_index, d.filename
+                FROM chunks c
+                JOIN documents d ON c.document_id = d.id
+                WHERE c.id IN (SELECT value FROM json_each(?))
+            """,
+                (json.dumps([int(chunk_id) for chunk_id in chunk_ids]),),
+            ).fetchall()
+        return {
+            row[0]: {
+                "chunk_id": row[0],
+                "document_id": row[1],
+                "chunk_index": row[2],
+                "filename": row[3],
+            }
+            for row in rows
+        }
+
+    def export_vectors(self, export_path: str) -> int:
+        """
+        导出所有有效文本块的向量（npz格式，包含 chunk_ids 和 vectors）
+
+        :return: 导出的向量数量
+        """
+        corpus = self.get_chunk_vectors()
+        if corpus is None:
+            raise RuntimeError("存在缺失的向量，无法导出")
+        chunk_ids, _, vectors = corpus
+        np.savez(
+            export_path,
+            chunk_ids=np.array(chunk_ids, dtype=np.int64),
+            vectors=vectors,
+            model_id=self.vector_file.model_id,
+        )
+        print(f"[vector_store] 已导出 {len(chunk_ids)} 个向量到: {export_path}")
+        return len(chunk_ids)
+
+    def _exact_search(
+        self,
+        queries: np.ndarray,
+        top_k: int,
+        candidates: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        精确向量搜索（不使用FAISS）：按知识库的相似度度量在向量文件上做分块计算
+
+        :param queries: (nq, dim) 查询矩阵
+        :param candidates: 参与搜索的 (chunk_id, vector_index) 行，默认全部有效向量
+        :return: (scores, chunk_ids)，形状均为 (nq, k)，不足时chunk_id为-1
+        """
+        empty = (
+            np.zeros((len(queries), 0), dtype=np.float32),
+            np.zeros((len(queries), 0), dtype=np.int64),
+        )
+        matrix = self.vector_file.memmap()
+        count = matrix.shape[0]
+        if count == 0:
+            return empty
+        if candidates is None:
+            candidates = self._get_live_vectors()
+        if len(candidates) == 0:
+            return empty
+
+        k = min(top_k, len(candidates))
+        if len(candidates) <= self.filter_exact_search_limit:
+            # 候选较少：只取出候选向量计算
+            scores, hit_rows = vector_search.search_matrix(
+                matrix[candidates[:, 1]], queries, k, metric=self.metric
+            )
+            chunk_ids = np.where(hit_rows >= 0, candidates[hit_rows, 0], -1)
+        else:
+            # 候选较多：扫描整个向量文件，用掩码排除其他行（已删除或不满足过滤条件）
+            chunk_of_row = np.full(count, -1, dtype=np.int64)
+            chunk_of_row[candidates[:, 1]] = candidates[:, 0]
+            scores, hit_rows = vector_search.search_matrix(
+                matrix, queries, k, metric=self.metric, valid_mask=chunk_of_row >= 0
+            )
+            chunk_ids = np.where(hit_rows >= 0, chunk_of_row[hit_rows], -1)
+        return scores, chunk_ids
 
     def get_document_info(self, document_id: int) -> Optional[Dict]:
         """获取文档信息"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.read() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
-                SELECT id, filename, file_path, file_type, file_size, created_at, updated_at, status
+                SELECT id, filename, file_path, file_type, file_size, created_at, updated_at, status,
+                    (SELECT COUNT(*) FROM chunks WHERE document_id = documents.id)
                 FROM documents
-                WHERE id = ?
+                WHERE id = ? AND status = 'active'
             """,
                 (document_id,),
             )
@@ -344,17 +1570,19 @@ class VectorStore:
                     "created_at": row[5],
                     "updated_at": row[6],
                     "status": row[7],
+                    "chunk_count": row[8],
                 }
             return None
 
     def list_documents(self) -> List[Dict]:
         """列出所有文档"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.read() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
                 SELECT id, filename, file_type, file_size, created_at, status
                 FROM documents
+                WHERE status = 'active'
                 ORDER BY created_at DESC
             """
             )
@@ -373,66 +1601,359 @@ class VectorStore:
             ]
 
     def delete_document(self, document_id: int) -> bool:
-        """删除文档"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        """
+        删除文档：标记文档为已删除并为其向量写入墓碑，不修改索引和向量文件
 
-            # 获取文档的所有chunk_id
+        新发布的一代索引立即屏蔽这些向量；仍被其他文档中相同内容的文本块使用的向量不写墓碑。
+        空间在墓碑比例达到阈值后由后台压缩回收
+        """
+        with self._db.transaction() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                "SELECT id FROM chunks WHERE document_id = ?", (document_id,)
+                """
+                UPDATE documents SET status = 'deleted', updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'active'
+            """,
+                (document_id,),
             )
-            chunk_ids = [row[0] for row in cursor.fetchall()]
-
-            if not chunk_ids:
+            if cursor.rowcount == 0:
                 return False
-
-            # 删除向量记录
             cursor.execute(
-                "DELETE FROM vectors WHERE chunk_id IN ({})".format(
-                    ",".join("?" * len(chunk_ids))
-                ),
-                chunk_ids,
+                """
+                SELECT vector_chunk_id FROM (
+                    SELECT DISTINCT COALESCE(canonical_chunk_id, id) AS vector_chunk_id
+                    FROM chunks WHERE document_id = ?
+                )
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM chunks o JOIN documents d ON o.document_id = d.id
+                    WHERE d.status = 'active'
+                    AND (o.id = vector_chunk_id OR o.canonical_chunk_id = vector_chunk_id)
+                )
+            """,
+                (document_id,),
+            )
+            chunk_ids = [row[0] for row in cursor.fetchall()]
+            cursor.executemany(
+                "INSERT OR IGNORE INTO tombstones (chunk_id, document_id) VALUES (?, ?)",
+                [(chunk_id, document_id) for chunk_id in chunk_ids],
             )
+            self._bump_corpus_version(cursor)
+
+        handle = self._index_handle
+        with handle.lock:
+            snapshot = handle.snapshot
+            if snapshot is not None and chunk_ids:
+                handle.publish(
+                    snapshot.base,
+                    snapshot.delta,
+                    tombstones=np.union1d(
+                        snapshot.tombstones, np.array(chunk_ids, dtype=np.int64)
+                    ),
+                )
+        print(f"[vector_store] 成功删除文档 ID: {document_id}（{len(chunk_ids)} 个文本块标记为墓碑）")
+        self._maybe_compact_in_background()
+        return True
+
+    def get_tombstone_stats(self) -> Dict:
+        """墓碑数量及其占向量文件行数的比例"""
+        with self._db.read() as conn:
+            tombstones = conn.execute("SELECT COUNT(*) FROM tombstones").fetchone()[0]
+        rows = self.vector_file.count
+        return {
+            "tombstone_count": tombstones,
+            "tombstone_ratio": tombstones / rows if rows else 0.0,
+        }
+
+    def _maybe_compact_in_background(self):
+        """墓碑比例超过阈值时启动后台压缩（同一知识库同时只有一个压缩任务）"""
+        stats = self.get_tombstone_stats()
+        if (
+            stats["tombstone_count"] < self.compaction_min_vectors
+            or stats["tombstone_ratio"] < self.compaction_threshold
+        ):
+            return
+        handle = self._index_handle
+        with handle.lock:
+            if handle.compacting:
+                return
+            handle.compacting = True
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact(force=True)
+        except Exception as e:
+            print(f"[vector_store] 后台压缩失败: {e}")
+        finally:
+            self._index_handle.compacting = False
+            self._db.close_thread()
+
+    def _storage_bytes(self) -> int:
+        """向量文件、索引文件和数据库文件（含WAL）占用的字节数"""
+        return sum(
+            os.path.getsize(path)
+            for path in (self.vectors_path, self.index_path, self.db_path, f"{self.db_path}-wal")
+            if os.path.exists(path)
+        )
 
-            # 删除文本块
-            cursor.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+    def compact(self, force: bool = False, batch_size: int = 65536) -> Dict:
+        """
+        压缩：从向量文件、数据库和索引中真正移除墓碑对应的向量
 
-            # 删除文档
-            cursor.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+        1. 只把有效向量按原顺序写入新的向量文件
+        2. 等待进行中的查询结束后，在一个事务中删除墓碑对应的记录、把 vector_index
+           改为新文件中的行号，并替换向量文件
+        3. 重建索引，VACUUM 数据库并截断WAL
 
-            conn.commit()
+        文本块ID（即索引中的向量ID）保持不变，只重新编号向量文件行号。
+        压缩期间持有索引锁，入库等待压缩完成；检索只在第2步短暂等待。
 
-            # 重建索引（简化处理，实际应该增量更新）
-            self._rebuild_index()
+        :param force: 为False时墓碑比例未达到 compaction_threshold 则不压缩
+        :return: {"compacted", "removed_vectors", "removed_documents", "reclaimed_bytes"}
+        """
+        result = {"compacted": False, "removed_vectors": 0, "removed_documents": 0, "reclaimed_bytes": 0}
+        handle = self._index_handle
+        with handle.lock:
+            dead = self._load_tombstones()
+            if len(dead) == 0:
+                return result
+            if not force and self.get_tombstone_stats()["tombstone_ratio"] < self.compaction_threshold:
+                return result
+
+            before = self._storage_bytes()
+            dead_json = json.dumps(dead.tolist())
+            count = self.vector_file.count
+            with self._db.read() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT chunk_id, vector_index FROM vectors
+                    WHERE vector_index >= 0 AND vector_index < ?
+                    AND chunk_id NOT IN (SELECT value FROM json_each(?))
+                    ORDER BY vector_index
+                """,
+                    (count, dead_json),
+                ).fetchall()
+            live = np.array(rows, dtype=np.int64).reshape(-1, 2)
+
+            # 1. 写入只含有效向量的新向量文件（未被引用的行，如回滚留下的行，也一并丢弃）
+            tmp_path = f"{self.vectors_path}.compact"
+            if self.vector_file.exists():
+                compacted = VectorFile(tmp_path)
+                compacted.create(self.vector_file.dim, self.vector_file.model_id, self.vector_file.dtype)
+                matrix = self.vector_file.memmap()
+                for start in range(0, len(live), batch_size):
+                    compacted.append(np.asarray(matrix[live[start : start + batch_size, 1]]))
+
+            # 2. 替换期间不允许查询读取行号
+            with handle.exclusive():
+                with self._db.transaction() as conn:
+                    cursor = conn.cursor()
+                    # 持有写锁后其他进程不能再追加；第1步之后其他进程追加的向量也复制到新文件
+                    new_count = self.vector_file.count
+                    if new_count > count:
+                        tail = conn.execute(
+                            """
+                            SELECT chunk_id, vector_index FROM vectors
+                            WHERE vector_index >= ? AND vector_index < ?
+                            ORDER BY vector_index
+                        """,
+                            (count, new_count),
+                        ).fetchall()
+                        if tail:
+                            tail = np.array(tail, dtype=np.int64).reshape(-1, 2)
+                            compacted.append(np.asarray(self.vector_file.memmap()[tail[:, 1]]))
+                            live = np.concatenate([live, tail])
+                    cursor.execute(
+                        "DELETE FROM vectors WHERE chunk_id IN (SELECT value FROM json_each(?))",
+                        (dead_json,),
+                    )
+                    removed_vectors = cursor.rowcount
+                    # 已删除文档的文本块中，仍为其他文档持有共用向量的保留
+                    cursor.execute(
+                        """
+                        DELETE FROM chunks
+                        WHERE document_id IN (SELECT id FROM documents WHERE status = 'deleted')
+                        AND id NOT IN (SELECT chunk_id FROM vectors)
+                    """
+                    )
+                    cursor.execute(
+                        """
+                        DELETE FROM documents WHERE status = 'deleted'
+                        AND NOT EXISTS (SELECT 1 FROM chunks WHERE document_id = documents.id)
+                    """
+                    )
+                    removed_documents = cursor.rowcount
+                    cursor.execute(
+                        "DELETE FROM tombstones WHERE chunk_id IN (SELECT value FROM json_each(?))",
+                        (dead_json,),
+                    )
+                    cursor.executemany(
+                        "UPDATE vectors SET vector_index = ? WHERE chunk_id = ?",
+                        [(row, int(chunk_id)) for row, chunk_id in enumerate(live[:, 0])],
+                    )
+                    self._bump_corpus_version(cursor)
+                    # 旧的索引元数据按旧行号记录，删除后加载时从头补齐
+                    if os.path.exists(self.index_meta_path):
+                        os.remove(self.index_meta_path)
+                    if self.vector_file.exists():
+                        os.replace(tmp_path, self.vectors_path)
+                handle.indexed_rows = len(live)
+
+            # 3. 按新的向量文件重建索引
+            if FAISS_AVAILABLE:
+                self.rebuild_index(batch_size=batch_size)
+
+        self._db.write().execute("VACUUM")
+        self._db.write().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        result.update(
+            compacted=True,
+            removed_vectors=removed_vectors,
+            removed_documents=removed_documents,
+            reclaimed_bytes=max(0, before - self._storage_bytes()),
+        )
+        print(
+            f"[vector_store] 压缩完成：移除 {removed_vectors} 个向量、{removed_documents} 个文档，"
+            f"回收 {result['reclaimed_bytes']} 字节"
+        )
+        return result
+
+    def clear(self):
+        """清空全部文档、向量和索引（一个事务删除所有记录，不逐个删除文档）"""
+        handle = self._index_handle
+        with handle.lock:
+            with handle.exclusive():
+                with self._db.transaction() as conn:
+                    cursor = conn.cursor()
+                    for table in ("vectors", "chunks", "documents", "tombstones"):
+                        cursor.execute(f"DELETE FROM {table}")
+                    self._bump_corpus_version(cursor)
+                for path in (self.vectors_path, self.index_path, self.index_meta_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                handle.indexed_rows = 0
+                handle.unsaved_vectors = 0
+            if handle.loaded:
+                self._create_new_index(self._get_recorded_dim())
+        self._db.write().execute("VACUUM")
+        self._db.write().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"[vector_store] 已清空: {self.db_path}")
+
+    def rebuild_index(
+        self,
+        batch_size: int = 65536,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
+        """
+        从向量文件重建FAISS索引（以chunk_id为ID）
 
-            print(f"[vector_store] 成功删除文档 ID: {document_id}")
-            return True
+        按vector_index顺序分批读取向量，不会把全部向量载入Python列表；
+        新索引写入临时文件后原子替换，重建期间旧索引仍可使用。
 
-    def _rebuild_index(self):
-        """重建FAISS索引"""
+        :param batch_size: 每批读取的向量数量
+        :param progress_callback: 进度回调 (已完成数量, 总数量)
+        :return: 重建后的向量数量
+        """
         if not FAISS_AVAILABLE:
-            return
+            return 0
+        if not os.path.exists(self.dim_path) and self.vector_file.count == 0:
+            # 尚未入库，维度未确定，首次入库时按实际维度创建索引
+            return 0
+
+        count = self.vector_file.count
+        dim = self.vector_file.dim or self._get_recorded_dim()
+        matrix = self.vector_file.memmap()
+        # 墓碑对应的向量不进入新索引
+        live_rows = (
+            "FROM vectors WHERE vector_index >= 0 AND vector_index < ? "
+            "AND chunk_id NOT IN (SELECT chunk_id FROM tombstones)"
+        )
 
-        # 这里应该重新加载所有向量并重建索引
-        # 简化处理，实际实现需要从数据库加载所有向量
-        print("[vector_store] 索引重建功能待实现")
+        with self._db.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*) {live_rows}", (count,))
+            total = cursor.fetchone()[0]
+
+            config = self.get_index_config()
+            new_index = self._new_index(dim, total)
+            if not new_index.is_trained:
+                # IVF类索引需先用样本训练
+                cursor.execute(f"SELECT vector_index {live_rows}", (count,))
+                rows_index = np.fromiter((row[0] for row in cursor), dtype=np.int64)
+                max_samples = max(
+                    index_factory.min_train_vectors(
+                        index_factory.index_type_of(new_index), total, config
+                    ),
+                    100000,
+                )
+                sample = index_factory.sample_for_training(matrix, rows_index, max_samples)
+                print(f"[vector_store] 训练索引，样本数: {len(sample)}")
+                new_index.train(self._prepare_vectors(sample))
+
+            cursor.execute(
+                f"SELECT chunk_id, vector_index {live_rows} ORDER BY vector_index",
+                (count,),
+            )
+            done = 0
+            # 水位线：已提交的最大行号之后的行（如尚未提交的写入）由替换后的补齐加入
+            watermark = 0
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = np.array(rows, dtype=np.int64)
+                watermark = int(batch[-1, 1]) + 1
+                new_index.add_with_ids(
+                    self._prepare_vectors(matrix[batch[:, 1]]), batch[:, 0]
+                )
+                done += len(rows)
+                if progress_callback:
+                    progress_callback(done, total)
+                print(f"[vector_store] 索引重建进度: {done}/{total}")
+
+        # 新索引在锁外构建，替换时才持有锁，重建期间旧索引仍可搜索
+        handle = self._index_handle
+        with handle.lock:
+            self._save_index(new_index, vector_rows=watermark)
+            handle.publish(new_index, tombstones=self._load_tombstones())
+            handle.mmapped = False
+            # 重建期间追加的向量
+            self._catch_up_index()
+        config["resolved_index_type"] = index_factory.index_type_of(new_index)
+        config["resolved_vector_dtype"] = index_factory.vector_dtype_of(new_index)
+        self._write_index_config(config)
+        print(
+            f"[vector_store] 索引重建完成（{config['resolved_index_type']}/{config['resolved_vector_dtype']}），共 {done} 个向量"
+        )
+        return done
 
     def get_stats(self) -> Dict:
         """获取知识库统计信息"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.read() as conn:
             cursor = conn.cursor()
 
             # 文档数量
             cursor.execute("SELECT COUNT(*) FROM documents WHERE status = 'active'")
             doc_count = cursor.fetchone()[0]
 
-            # 文本块数量
-            cursor.execute("SELECT COUNT(*) FROM chunks")
-            chunk_count = cursor.fetchone()[0]
+            # 文本块数量（不含已删除文档）及其中复用已有向量的数量
+            cursor.execute(
+                """
+                SELECT COUNT(*), COUNT(c.canonical_chunk_id)
+                FROM chunks c JOIN documents d ON c.document_id = d.id
+                WHERE d.status = 'active'
+            """
+            )
+            chunk_count, deduplicated_count = cursor.fetchone()
+            cursor.execute("SELECT COUNT(*) FROM tombstones")
+            tombstone_count = cursor.fetchone()[0]
 
-            # 向量数量
+            # 向量数量（不含墓碑）
             cursor.execute("SELECT COUNT(*) FROM vectors")
             vector_count = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT COUNT(*) FROM vectors WHERE chunk_id IN (SELECT chunk_id FROM tombstones)"
+            )
+            dead_vectors = cursor.fetchone()[0]
 
             # 总文件大小
             cursor.execute(
@@ -441,11 +1962,35 @@ class VectorStore:
             result = cursor.fetchone()[0]
             total_size = result if result is not None else 0
 
+            rows = self.vector_file.count
             return {
                 "document_count": doc_count,
                 "chunk_count": chunk_count,
-                "vector_count": vector_count,
+                "deduplicated_chunk_count": deduplicated_count,
+                "vector_count": vector_count - dead_vectors,
                 "total_size_bytes": total_size,
-                "index_type": "FAISS" if FAISS_AVAILABLE else "Basic",
+                "tombstone_count": tombstone_count,
+                "tombstone_ratio": tombstone_count / rows if rows else 0.0,
+                **self._get_index_stats(),
+                "vector_file_size_bytes": self.vector_file.size_bytes(),
+                "vector_file_dtype": self.vector_file.dtype,
                 "database_path": self.db_path,
             }
+
+    def _get_index_stats(self) -> Dict:
+        """索引类型与内存占用"""
+        config = self.get_index_config()
+        if not FAISS_AVAILABLE or self._ensure_index() is None:
+            return {"index_type": "Basic", "index_config": config}
+        index_type = index_factory.index_type_of(self.index.base)
+        vector_dtype = index_factory.vector_dtype_of(self.index.base)
+        return {
+            "index_type": f"FAISS/{index_type}",
+            "index_config": config,
+            "index_vector_dtype": vector_dtype,
+            "index_vector_count": self.index.ntotal,
+            "index_generation": self.index.generation,
+            "index_memory_bytes": index_factory.estimate_memory_bytes(
+                index_type, self.index.ntotal, self.index.d, {**config, "vector_dtype": vector_dtype}
+            ),
+        }
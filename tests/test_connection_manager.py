@@ -0,0 +1,92 @@
+"""
+测试connection_manager模块的功能
+测试每线程连接复用、只读连接和事务
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+from rag_core.connection_manager import get_connection_manager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """创建带一张表的临时数据库"""
+    manager = get_connection_manager(str(tmp_path / "test.db"))
+    with manager.transaction() as conn:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    yield manager
+    manager.close_all()
+
+
+def test_connections_reused_per_thread(manager):
+    """
+    测试连接复用
+
+    验证内容：
+    1. 同一线程多次获取得到同一连接
+    2. 不同线程得到各自的连接
+    3. 同一路径共享同一个管理器
+    """
+    assert manager.read() is manager.read()
+    assert manager.write() is manager.write()
+    assert get_connection_manager(manager.db_path) is manager
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(manager.read()))
+    thread.start()
+    thread.join()
+    assert other[0] is not manager.read()
+
+
+def test_read_only_and_transaction(manager):
+    """
+    测试只读连接与事务
+
+    验证内容：
+    1. 只读连接不能写入
+    2. 事务内异常时回滚，正常退出时提交且只读连接立即可见
+    3. close_all 后各线程重新打开连接
+    """
+    with pytest.raises(sqlite3.OperationalError):
+        manager.read().execute("INSERT INTO items (name) VALUES ('x')")
+
+    with pytest.raises(ValueError):
+        with manager.transaction() as conn:
+            conn.execute("INSERT INTO items (name) VALUES ('rolled back')")
+            raise ValueError("abort")
+    with manager.transaction() as conn:
+        conn.execute("INSERT INTO items (name) VALUES ('kept')")
+    assert manager.read().execute("SELECT name FROM items").fetchall() == [("kept",)]
+
+    old = manager.read()
+    manager.close_all()
+    assert manager.read() is not old
+    assert manager.read().execute("SELECT COUNT(*) FROM items").fetchone()[0] == 1
+
+
+def test_connections_released_when_thread_ends(manager):
+    """
+    测试线程结束后连接自动关闭
+
+    每个请求一个新线程的服务器中，打开的连接数不随请求数增长
+    """
+    manager.read()
+    before = manager.open_connections()
+    opened = []
+
+    def worker():
+        conn = manager.read()
+        conn.execute("SELECT COUNT(*) FROM items").fetchone()
+        opened.append(conn)
+
+    for _ in range(50):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+
+    assert manager.open_connections() == before
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0].execute("SELECT 1")
@@ -0,0 +1,127 @@
+"""
+测试corpus_cache模块的功能
+测试语料视图按语料版本复用、写入后失效，以及内存上限下的按需读取
+"""
+
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+from rag_core import corpus_cache
+from rag_core.vector_store import VectorStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    """创建临时向量存储，并清空进程内的语料视图缓存"""
+    corpus_cache.reset_corpus_cache()
+    return VectorStore(str(tmp_path / "vectors" / "vector_store.db"))
+
+
+@pytest.fixture
+def doc_file(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("测试文档", encoding="utf-8")
+    return str(path)
+
+
+def test_view_reused_until_corpus_version_changes(store, doc_file):
+    """
+    测试语料视图按版本复用
+
+    验证内容：
+    1. 入库、删除、清空都会递增语料版本
+    2. 版本不变时返回同一个视图对象，不重新构建
+    3. 过滤条件从完整视图中取出对应文本块
+    """
+    version = store.get_corpus_version()
+    first = store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    second = store.add_document(doc_file, ["c"], [[0.5, 0.5]])
+    assert store.get_corpus_version() == version + 2
+
+    view = store.get_corpus_view()
+    assert view.contents == ["a", "b", "c"]
+    assert view.document_ids.tolist() == [first, first, second]
+    np.testing.assert_array_equal(
+        view.vectors, np.array([[1.0, 0.0], [0.0, 1.0], [0.5, 0.5]], dtype=np.float32)
+    )
+    with patch.object(store, "_build_corpus_view", side_effect=AssertionError("不应重建")):
+        assert store.get_corpus_view() is view
+        # 另一个实例（如另一个请求）共享同一视图
+        assert VectorStore(store.db_path).get_corpus_view() is view
+        filtered = store.get_corpus_view({"document_ids": [second]})
+    assert filtered.contents == ["c"]
+    assert filtered.vectors.tolist() == [[0.5, 0.5]]
+
+    store.delete_document(first)
+    view = store.get_corpus_view()
+    assert view.contents == ["c"]
+    assert view.chunk_ids.tolist() == filtered.chunk_ids.tolist()
+
+    store.clear()
+    assert len(store.get_corpus_view()) == 0
+    assert store.get_corpus_version() == version + 4
+
+
+def test_view_version_survives_compaction(store, doc_file):
+    """测试压缩改写向量行号后视图重建，向量与文本块仍然对应"""
+    first = store.add_document(doc_file, ["a"], [[1.0, 0.0]])
+    store.add_document(doc_file, ["b"], [[0.0, 1.0]])
+    store.delete_document(first)
+    before = store.get_corpus_view()
+    store.compact(force=True)
+    after = store.get_corpus_view()
+    assert after is not before
+    assert after.contents == ["b"]
+    assert after.vectors.tolist() == [[0.0, 1.0]]
+
+
+@pytest.mark.parametrize(
+    "budget_bytes, contents_cached, vectors_cached",
+    [(1 << 20, True, True), (400, False, True), (100, False, False)],
+)
+def test_view_tiers_under_memory_budget(
+    store, doc_file, budget_bytes, contents_cached, vectors_cached
+):
+    """
+    测试内存上限不足时按需读取
+
+    验证内容：
+    1. 放得下时内容和向量常驻内存
+    2. 内容放不下时按chunk_id分批读取，向量仍常驻
+    3. 向量也放不下时从向量文件读取
+    4. 三种方式得到的内容和向量一致
+    """
+    chunks = [f"文本块{i}" * 5 for i in range(6)]
+    vectors = np.eye(6, 4, dtype=np.float32).tolist()
+    document_id = store.add_document(doc_file, chunks, vectors)
+
+    with patch.object(corpus_cache, "memory_budget_bytes", return_value=budget_bytes):
+        view = store.get_corpus_view()
+    assert view.contents_cached == contents_cached
+    assert view.vectors_cached == vectors_cached
+    assert list(view.contents) == chunks
+    assert view.contents[2] == chunks[2]
+    np.testing.assert_array_equal(view.vectors, np.array(vectors, dtype=np.float32))
+
+    filtered = view.subset([1, 4])
+    assert list(filtered.contents) == [chunks[1], chunks[4]]
+    assert filtered.vectors.tolist() == [vectors[1], vectors[4]]
+    assert filtered.document_ids.tolist() == [document_id, document_id]
+
+
+def test_config_read_once_until_reset(store, doc_file):
+    """测试缓存配置只读取一次，检索时不再读取 config.json；reset_corpus_cache 后重新读取"""
+    store.add_document(doc_file, ["a"], [[1.0, 0.0]])
+    config = {"enabled": True, "max_memory_mb": 1}
+    with patch.object(corpus_cache, "get_corpus_cache_config", return_value=config) as get_config:
+        store.get_corpus_view()
+        store.get_corpus_view({"document_ids": [1]})
+        assert corpus_cache.memory_budget_bytes() == 1024 * 1024
+        assert get_config.call_count == 1
+
+        config["max_memory_mb"] = 2
+        corpus_cache.reset_corpus_cache()
+        assert corpus_cache.memory_budget_bytes() == 2 * 1024 * 1024
+        assert get_config.call_count == 2
+    corpus_cache.reset_corpus_cache()
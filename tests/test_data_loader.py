@@ -131,3 +131,31 @@ def test_load_pdf(tmp_path):
         pytest.skip("PDF内容无法被正确解析，跳过该测试")
     assert isinstance(docs, list)
     assert len(docs) > 0
+
+
+def test_load_with_near_duplicate_collapsing(tmp_path):
+    """测试启用近似重复合并后，重复的页眉只保留一个并返回合并报告"""
+    from rag_core.data_loader import load_documents_with_metadata
+
+    paragraphs = [
+        f"内部资料请勿外传，本文件版权归{owner}所有，如有疑问请联系行政部门或者信息安全办公室。"
+        for owner in ("集团公司", "集团总公司", "集团母公司")
+    ] + ["正文内容，介绍了公司今年的主要业务进展。"]
+    test_file = tmp_path / "report.txt"
+    test_file.write_text("\n\n".join(paragraphs), encoding="utf-8")
+    config = {"min_paragraph_length": 10, "min_chunk_length": 5}
+
+    plain = load_documents_with_metadata(str(test_file), config)
+    assert len(plain["chunks"]) == 4
+    assert plain["near_duplicates"] is None
+
+    collapsed = load_documents_with_metadata(
+        str(test_file), {**config, "collapse_near_duplicates": True, "near_duplicate_threshold": 0.75}
+    )
+    assert len(collapsed["chunks"]) == 2
+    assert collapsed["near_duplicates"]["collapsed_count"] == 2
+    assert collapsed["near_duplicates"]["duplicate_of"] == [0, 0, 0, 1]
+    assert collapsed["aliases"] == [
+        {"content": plain["chunks"][1], "canonical": 0, "position": 1},
+        {"content": plain["chunks"][2], "canonical": 0, "position": 2},
+    ]
@@ -6,7 +6,9 @@
 from rag_core.embedding import embed_documents
 import numpy as np
 import sys
-from unittest.mock import patch
+import pytest
+import requests
+from unittest.mock import MagicMock, patch
 
 
 def test_embed_documents():
@@ -35,29 +37,123 @@ def test_embed_documents():
         # mock 情况下可能全为0，不再强制要求非零
 
 
+def _mock_embedding_response(texts):
+    """构造 SiliconFlow 批量接口的 mock 返回（故意打乱 index 顺序）"""
+    resp = MagicMock()
+    resp.status_code = 200
+    resp.json.return_value = {
+        "data": [
+            {"embedding": [float(len(text))] * 8, "index": i}
+            for i, text in reversed(list(enumerate(texts)))
+        ]
+    }
+    return resp
+
+
 def test_embed_documents_online():
     """
-    测试 SiliconFlow 在线 embedding 方式（mock requests.post）
+    测试 SiliconFlow 在线 embedding 方式（mock Session.post）
+    验证批量发送、结果顺序与输入一致
     """
-    docs = ["测试在线1", "测试在线2"]
-    # patch config 使 provider 为 online
-    with patch("utils.config.get_embedding_config") as mock_get_config, \
-         patch("rag_core.embedding.requests.post") as mock_post:
+    from rag_core import embedding
+
+    docs = ["测试在线1", "测试在线长文本2", "三", "第四条"]
+    calls = []
+
+    def fake_post(self, url, json=None, timeout=None):
+        calls.append(json["input"])
+        return _mock_embedding_response(json["input"])
+
+    with patch("rag_core.embedding.get_embedding_config") as mock_get_config, \
+         patch("rag_core.embedding.get_embedding_cache", return_value=None), \
+         patch("rag_core.embedding.requests.Session.post", fake_post):
         mock_get_config.return_value = ("online", {
             "api_key": "fake-key",
             "model_name": "BAAI/bge-large-zh-v1.5",
-            "api_url": "https://api.siliconflow.cn/v1/embeddings"
+            "api_url": "https://api.siliconflow.cn/v1/embeddings",
+            "batch_size": 3,
         })
-        # mock 返回
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.side_effect = [
-            {"data": [{"embedding": [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8], "index": 0}]},
-            {"data": [{"embedding": [0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.3, 0.2], "index": 0}]}
-        ]
-        from rag_core.embedding import embed_documents
-        embeddings = embed_documents(docs)
-        assert isinstance(embeddings, list)
-        assert len(embeddings) == 2
-        for vec in embeddings:
-            assert isinstance(vec, (list, np.ndarray))
-            assert len(vec) in (384, 1024, 8)
+        embeddings = embedding.embed_documents(docs)
+        embedding.close_siliconflow_clients()
+
+    assert isinstance(embeddings, list)
+    assert len(embeddings) == len(docs)
+    # 4 条文本，batch_size=3，应只发送 2 个请求
+    assert sorted(len(batch) for batch in calls) == [1, 3]
+    for doc, vec in zip(docs, embeddings):
+        assert isinstance(vec, (list, np.ndarray))
+        assert len(vec) in (384, 1024, 8)
+        assert vec[0] == float(len(doc))
+
+
+def test_siliconflow_client_retry_and_partial_failure():
+    """
+    测试在线 embedding 的重试队列：
+    1. 暂时失败的批次重试后成功，结果顺序不变
+    2. 持续失败的批次抛出 EmbeddingAPIError，并给出失败下标
+    """
+    from rag_core.embedding import SiliconFlowEmbeddingClient, EmbeddingAPIError
+
+    docs = ["a", "bb", "ccc", "dddd"]
+    attempts = {}
+
+    def flaky_post(self, url, json=None, timeout=None):
+        key = tuple(json["input"])
+        attempts[key] = attempts.get(key, 0) + 1
+        if key == ("ccc", "dddd") and attempts[key] == 1:
+            raise requests.ConnectionError("boom")
+        return _mock_embedding_response(json["input"])
+
+    client = SiliconFlowEmbeddingClient(
+        "fake-key", "m", "http://example.invalid", batch_size=2, backoff_factor=0
+    )
+    with patch("rag_core.embedding.requests.Session.post", flaky_post):
+        embeddings = client.embed(docs)
+    assert [vec[0] for vec in embeddings] == [1.0, 2.0, 3.0, 4.0]
+
+    def broken_post(self, url, json=None, timeout=None):
+        if "a" in json["input"]:
+            raise requests.ConnectionError("down")
+        return _mock_embedding_response(json["input"])
+
+    with patch("rag_core.embedding.requests.Session.post", broken_post):
+        with pytest.raises(EmbeddingAPIError) as excinfo:
+            client.embed(docs)
+    client.close()
+    assert excinfo.value.failed_indices == [0, 1]
+    assert excinfo.value.embeddings[0] is None
+    assert excinfo.value.embeddings[2][0] == 3.0
+
+
+def test_embedding_model_registry_loads_once():
+    """
+    测试 embedding 模型注册表：同一 (模型路径, 设备) 只加载一次，支持预热和释放
+    """
+    import types
+    from rag_core import embedding
+
+    load_count = {"n": 0}
+
+    class FakeSentenceTransformer:
+        def __init__(self, model_name, device=None):
+            load_count["n"] += 1
+
+        def encode(self, docs, show_progress_bar=False):
+            return np.ones((len(docs), 4), dtype=np.float32)
+
+    fake_module = types.SimpleNamespace(SentenceTransformer=FakeSentenceTransformer)
+    model_name = "sentence-transformers/fake-model"
+    with patch.dict(sys.modules, {"sentence_transformers": fake_module}), \
+         patch.object(embedding, "get_embedding_cache", return_value=None), \
+         patch.object(embedding, "_get_default_device", return_value="cpu"):
+        embedding.evict_embedding_model()
+        assert embedding.warmup_embedding_model(model_name)
+        embedding.embed_documents(["a"], model_name=model_name)
+        embedding.embed_documents(["b", "c"], model_name=model_name)
+        assert load_count["n"] == 1
+        assert (model_name, "cpu") in embedding.list_loaded_embedding_models()
+
+        assert embedding.evict_embedding_model(model_name) == 1
+        embedding.embed_documents(["d"], model_name=model_name)
+        assert load_count["n"] == 2
+        embedding.evict_embedding_model()
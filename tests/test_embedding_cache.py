@@ -0,0 +1,132 @@
+"""
+测试embedding_cache模块的功能
+测试持久化缓存的命中、LRU淘汰以及与embed_documents的集成
+"""
+
+import numpy as np
+from unittest.mock import patch
+
+from rag_core.embedding_cache import EmbeddingCache
+
+
+def test_cache_hit_miss_and_persistence(tmp_path):
+    """
+    测试缓存读写
+
+    验证内容：
+    1. 未写入时全部未命中
+    2. 写入后按 (provider, model, 文本) 命中，向量为 float32
+    3. 不同模型互不影响
+    4. 重新打开数据库后缓存仍然存在
+    """
+    db_path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(db_path)
+
+    assert cache.get_many("local", "m1", ["a", "b"]) == [None, None]
+    cache.put_many("local", "m1", ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+
+    results = cache.get_many("local", "m1", ["b", "c", "a"])
+    assert results[1] is None
+    assert results[0].dtype == np.float32
+    assert results[0].tolist() == [3.0, 4.0]
+    assert results[2].tolist() == [1.0, 2.0]
+    assert cache.get_many("local", "m2", ["a"]) == [None]
+
+    stats = cache.get_stats()
+    assert stats["entries"] == 2
+    assert stats["hits"] == 2
+    assert stats["misses"] == 4
+    cache.close()
+
+    reopened = EmbeddingCache(db_path)
+    assert reopened.get_many("local", "m1", ["a"])[0].tolist() == [1.0, 2.0]
+    reopened.close()
+
+
+def test_cache_lru_eviction(tmp_path):
+    """测试超出条数上限后淘汰最近最少使用的条目"""
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=2)
+    # 间隔超过 access_update_interval，命中时才记录访问时间
+    with patch("rag_core.embedding_cache.time.time", side_effect=[100.0, 200.0, 300.0, 400.0]):
+        cache.put_many("local", "m", ["a"], [[1.0]])
+        cache.put_many("local", "m", ["b"], [[2.0]])
+        # 访问 a，使 b 成为最久未使用
+        cache.get_many("local", "m", ["a"])
+        cache.put_many("local", "m", ["c"], [[3.0]])
+
+    results = cache.get_many("local", "m", ["a", "b", "c"])
+    assert results[0] is not None
+    assert results[1] is None
+    assert results[2] is not None
+    cache.close()
+
+
+def test_cache_hits_do_not_write(tmp_path):
+    """
+    测试命中不在检索路径上写数据库
+
+    验证内容：
+    1. 刚写入的条目命中时不更新访问时间
+    2. 过期的访问时间在内存中累积，达到批量大小时一次写回
+    """
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    cache.access_flush_size = 2
+    with patch("rag_core.embedding_cache.time.time", return_value=100.0):
+        cache.put_many("local", "m", ["a", "b"], [[1.0], [2.0]])
+    changes = cache._conn.total_changes
+
+    with patch("rag_core.embedding_cache.time.time", return_value=120.0):
+        cache.get_many("local", "m", ["a", "b"])
+    assert cache._conn.total_changes == changes
+
+    with patch("rag_core.embedding_cache.time.time", return_value=500.0):
+        cache.get_many("local", "m", ["a"])
+        assert cache._conn.total_changes == changes
+        cache.get_many("local", "m", ["b"])
+    assert cache._conn.total_changes == changes + 2
+    rows = cache._conn.execute("SELECT DISTINCT last_access FROM embedding_cache").fetchall()
+    assert rows == [(500.0,)]
+    cache.close()
+
+
+def test_embed_documents_uses_cache(tmp_path):
+    """测试 embed_documents 只对未命中的文本调用模型"""
+    from rag_core import embedding
+
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    computed = []
+
+    def fake_embed_local(texts, model_name):
+        computed.extend(texts)
+        return [[float(len(t))] * 4 for t in texts]
+
+    with patch.object(embedding, "get_embedding_cache", return_value=cache), \
+         patch.object(embedding, "get_embedding_config", return_value=("local", {})), \
+         patch.object(embedding, "_embed_local", side_effect=fake_embed_local):
+        first = embedding.embed_documents(["一", "二二", "一"])
+        second = embedding.embed_documents(["二二", "三三三"])
+
+    assert computed == ["一", "二二", "三三三"]
+    assert first == [[1.0] * 4, [2.0] * 4, [1.0] * 4]
+    assert second == [[2.0] * 4, [3.0] * 4]
+    cache.close()
+
+
+def test_shared_cache_reads_config_once(tmp_path):
+    """测试共享缓存只在首次获取时读取配置，reset_embedding_cache 后重新读取"""
+    from rag_core import embedding_cache
+
+    embedding_cache.reset_embedding_cache()
+    config = {"enabled": True, "path": str(tmp_path / "cache.db"), "max_entries": 10}
+    with patch.object(embedding_cache, "get_embedding_cache_config", return_value=config) as get_config:
+        cache = embedding_cache.get_embedding_cache()
+        assert embedding_cache.get_embedding_cache() is cache
+        assert get_config.call_count == 1
+        assert cache.max_entries == 10
+
+        config["enabled"] = False
+        embedding_cache.reset_embedding_cache()
+        assert embedding_cache.get_embedding_cache() is None
+        assert embedding_cache.get_embedding_cache() is None
+        assert get_config.call_count == 2
+    embedding_cache.reset_embedding_cache()
@@ -0,0 +1,105 @@
+"""
+测试index_factory模块的功能
+测试索引类型自动选择、索引创建和查询参数设置
+"""
+
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from rag_core import index_factory
+
+
+def test_select_index_type_by_size_and_budget():
+    """
+    测试 auto 模式的索引类型选择
+
+    验证内容：
+    1. 小规模使用 flat
+    2. 中等规模且内存充足使用 hnsw
+    3. 内存不足时退到 ivf_flat / ivf_pq
+    """
+    assert index_factory.select_index_type(1000, 384) == "flat"
+    assert index_factory.select_index_type(500000, 384, {"memory_budget_mb": 4096}) == "hnsw"
+    assert index_factory.select_index_type(500000, 384, {"memory_budget_mb": 800}) == "ivf_flat"
+    assert index_factory.select_index_type(5000000, 1024, {"memory_budget_mb": 1024}) == "ivf_pq"
+
+
+def test_resolve_falls_back_to_flat_without_training_data():
+    """测试需要训练的索引在向量不足时暂用 flat"""
+    assert index_factory.resolve_index_type(10, 8, {"index_type": "ivf_flat"}) == "flat"
+    assert index_factory.resolve_index_type(1000, 8, {"index_type": "ivf_flat"}) == "ivf_flat"
+    with pytest.raises(ValueError):
+        index_factory.resolve_index_type(1000, 8, {"index_type": "unknown"})
+
+
+@pytest.mark.parametrize("index_type", index_factory.INDEX_TYPES)
+def test_create_index_types(index_type):
+    """测试各类索引的创建、训练、按 chunk_id 添加和查询"""
+    rng = np.random.default_rng(0)
+    vectors = rng.random((500, 16), dtype=np.float32)
+    ids = np.arange(1000, 1500, dtype=np.int64)
+    config = {"metric": "l2", "nlist": 4, "nprobe": 4, "pq_m": 4, "pq_nbits": 4}
+
+    index = index_factory.create_index(index_type, 16, len(vectors), config)
+    assert index_factory.index_type_of(index) == index_type
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, ids)
+
+    _, found = index.search(vectors[:1], 1)
+    assert found[0][0] in ids
+    if index_type != "ivf_pq":
+        assert found[0][0] == 1000
+    assert index_factory.estimate_memory_bytes(index_type, 500, 16, config) > 0
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_create_index_inner_product(index_type):
+    """测试 cosine 度量使用内积索引，归一化向量的内积即余弦相似度"""
+    rng = np.random.default_rng(0)
+    vectors = rng.random((200, 16), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    index = index_factory.create_index(index_type, 16, len(vectors), {"metric": "cosine"})
+    assert index_factory.uses_inner_product(index)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+
+    scores, found = index.search(vectors[:1], 2)
+    assert found[0][0] == 0
+    assert scores[0][0] == pytest.approx(1.0, abs=1e-5)
+    assert scores[0][0] >= scores[0][1]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat"])
+@pytest.mark.parametrize("vector_dtype", ["float16", "int8"])
+def test_create_compressed_index(index_type, vector_dtype):
+    """
+    测试压缩存储的索引
+
+    验证内容：
+    1. 创建的索引可识别出类型和存储类型，并标记为需要重排
+    2. 内存估算低于 float32
+    3. int8 在训练样本不足时暂用 float32，IVF-PQ 不受影响
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.random((500, 16), dtype=np.float32)
+    config = {"metric": "l2", "nlist": 4, "nprobe": 4, "vector_dtype": vector_dtype}
+
+    index = index_factory.create_index(index_type, 16, len(vectors), config)
+    assert index_factory.index_type_of(index) == index_type
+    assert index_factory.vector_dtype_of(index) == vector_dtype
+    assert index_factory.needs_rescore(index)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    _, found = index.search(vectors[:1], 5)
+    assert 0 in found[0]
+
+    full = index_factory.estimate_memory_bytes(index_type, 10000, 1024, {"metric": "l2"})
+    assert index_factory.estimate_memory_bytes(index_type, 10000, 1024, config) < full
+
+    assert index_factory.resolve_vector_dtype("ivf_pq", 100000, config) == "float32"
+    expected_small = "float32" if vector_dtype == "int8" else vector_dtype
+    assert index_factory.resolve_vector_dtype(index_type, 10, config) == expected_small
@@ -0,0 +1,324 @@
+"""
+测试knowledge_base模块的功能
+测试知识库的文档入库与检索流程
+"""
+
+import pytest
+from unittest.mock import patch
+
+from rag_core.knowledge_base import KnowledgeBase
+
+
+def fake_embed_documents(texts, model_name=None):
+    """按关键词生成确定性的4维向量"""
+    vectors = []
+    for text in texts:
+        vectors.append(
+            [
+                1.0 if "苹果" in text else 0.0,
+                1.0 if "香蕉" in text else 0.0,
+                1.0 if "橙子" in text else 0.0,
+                0.1,
+            ]
+        )
+    return vectors
+
+
+@pytest.fixture
+def kb(tmp_path):
+    """创建临时知识库，embedding 使用确定性 mock"""
+    embed_calls = []
+
+    def recording_embed(texts, model_name=None):
+        embed_calls.append(list(texts))
+        return fake_embed_documents(texts, model_name)
+
+    with patch("rag_core.knowledge_base.embed_documents", side_effect=recording_embed), \
+         patch("rag_core.embedding.embed_documents", side_effect=recording_embed):
+        knowledge_base = KnowledgeBase("test_kb", str(tmp_path / "kb"))
+        knowledge_base.embed_calls = embed_calls
+        yield knowledge_base
+
+
+def add_text_document(kb, tmp_path, name, paragraphs):
+    """写入文本文件并添加到知识库"""
+    file_path = tmp_path / name
+    file_path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+    result = kb.add_document(str(file_path))
+    assert result["success"], result
+    return result
+
+
+def test_enhanced_search_embeds_only_query(kb, tmp_path):
+    """
+    测试增强检索直接使用已持久化向量
+
+    验证内容：
+    1. 入库后检索只对查询文本向量化一次
+    2. 检索结果包含相关内容和文件名
+    """
+    add_text_document(
+        kb,
+        tmp_path,
+        "fruits.txt",
+        [
+            "苹果是一种常见的水果，味道香甜，富含维生素和膳食纤维，适合每天食用。",
+            "香蕉富含钾元素，适合运动后食用，可以快速补充能量，缓解肌肉疲劳。",
+        ],
+    )
+    kb.embed_calls.clear()
+
+    results = kb.search("苹果", top_k=1, use_enhanced=True)
+
+    assert kb.embed_calls == [["苹果"]]
+    assert results
+    assert "苹果" in results[0]["content"]
+    assert results[0]["filename"] == "fruits.txt"
+
+
+def test_add_documents_batches_embedding_and_ingest(kb, tmp_path):
+    """
+    测试批量添加文档
+
+    验证内容：
+    1. 同一批文档的文本块只调用一次向量化
+    2. 不存在或没有有效内容的文档单独返回失败，不影响其他文档，也不留下复制的文件
+    3. 入库后可检索到各文档的内容
+    """
+    paths = []
+    for name, fruit in [("apple.txt", "苹果"), ("banana.txt", "香蕉")]:
+        path = tmp_path / name
+        path.write_text(
+            f"{fruit}是一种常见的水果，味道香甜，富含维生素和膳食纤维，适合每天食用。", encoding="utf-8"
+        )
+        paths.append(str(path))
+    paths.append(str(tmp_path / "missing.txt"))
+    empty = tmp_path / "empty.txt"
+    empty.write_text("短", encoding="utf-8")
+    paths.append(str(empty))
+
+    results = kb.add_documents(paths)
+
+    assert [r["success"] for r in results] == [True, True, False, False]
+    assert len(kb.embed_calls) == 1
+    assert sorted(d["filename"] for d in kb.list_documents()) == ["apple.txt", "banana.txt"]
+    # 没有切出文本块的文档不在知识库目录中留下副本
+    assert sorted(p.name for p in kb.documents_path.iterdir()) == ["apple.txt", "banana.txt"]
+    assert not kb.add_document(str(empty))["success"]
+    assert sorted(p.name for p in kb.documents_path.iterdir()) == ["apple.txt", "banana.txt"]
+    hits = kb.search("香蕉", top_k=1, use_enhanced=True)
+    assert hits[0]["filename"] == "banana.txt"
+
+
+@pytest.mark.parametrize("use_enhanced", [True, False])
+def test_search_filters_by_document(kb, tmp_path, use_enhanced):
+    """测试知识库检索按文档过滤，增强检索与基础检索一致"""
+    apple = add_text_document(
+        kb, tmp_path, "apple.txt", ["苹果是一种常见的水果，味道香甜，富含维生素和膳食纤维，适合每天食用。"]
+    )
+    add_text_document(
+        kb, tmp_path, "banana.txt", ["香蕉富含钾元素，适合运动后食用，可以快速补充能量，缓解肌肉疲劳。"]
+    )
+
+    results = kb.search(
+        "香蕉", top_k=5, use_enhanced=use_enhanced, filters={"document_ids": [apple["document_id"]]}
+    )
+
+    assert results
+    assert {r["filename"] for r in results} == {"apple.txt"}
+
+
+def test_enhanced_search_returns_ids_of_repeated_content(kb, tmp_path):
+    """
+    测试增强检索按chunk_id返回结果所属文档
+
+    不同文档中内容相同的文本块，结果的文件名和文档ID来自实际命中的文本块，而不是最先入库的同内容文本块
+    """
+    apple = "苹果是一种常见的水果，味道香甜，富含维生素和膳食纤维，适合每天食用。"
+    banana = "香蕉富含钾元素，适合运动后食用，可以快速补充能量，缓解肌肉疲劳。"
+    add_text_document(kb, tmp_path, "fruits.txt", [apple])
+    more = add_text_document(kb, tmp_path, "more.txt", [apple, banana])
+
+    results = kb.search(
+        "苹果", top_k=5, use_enhanced=True, filters={"document_ids": [more["document_id"]]}
+    )
+
+    assert results
+    assert {r["filename"] for r in results} == {"more.txt"}
+    assert {r["document_id"] for r in results} == {more["document_id"]}
+    metadata = kb.vector_store.get_chunk_metadata([r["chunk_id"] for r in results])
+    assert {info["document_id"] for info in metadata.values()} == {more["document_id"]}
+
+
+def test_search_many_embeds_queries_once(kb, tmp_path):
+    """
+    测试批量检索
+
+    验证内容：
+    1. 所有查询在一次向量化调用中完成
+    2. 每个查询的结果与单次检索一致
+    """
+    add_text_document(
+        kb,
+        tmp_path,
+        "fruits.txt",
+        [
+            "苹果是一种常见的水果，味道香甜，富含维生素和膳食纤维，适合每天食用。",
+            "香蕉富含钾元素，适合运动后食用，可以快速补充能量，缓解肌肉疲劳。",
+        ],
+    )
+    kb.embed_calls.clear()
+
+    batch = kb.search_many(["苹果", "香蕉"], top_k=1)
+
+    assert kb.embed_calls == [["苹果", "香蕉"]]
+    assert "苹果" in batch[0][0]["content"]
+    assert "香蕉" in batch[1][0]["content"]
+    assert batch[1] == kb.search("香蕉", top_k=1, use_enhanced=False)
+
+
+def test_duplicate_file_and_chunks_not_reembedded(kb, tmp_path):
+    """
+    测试内容去重
+
+    验证内容：
+    1. 重复上传相同内容的文件（即使文件名不同）直接返回已有文档，不复制也不向量化
+    2. 与已有文档共有的段落复用已有向量，只向量化新的段落
+    """
+    apple = "苹果是一种常见的水果，味道香甜，富含维生素和膳食纤维，适合每天食用。"
+    banana = "香蕉富含钾元素，适合运动后食用，可以快速补充能量，缓解肌肉疲劳。"
+    first = add_text_document(kb, tmp_path, "fruits.txt", [apple])
+    kb.embed_calls.clear()
+
+    copy = tmp_path / "copy"
+    copy.mkdir()
+    again = add_text_document(kb, copy, "fruits_copy.txt", [apple])
+    assert again["duplicate"]
+    assert again["document_id"] == first["document_id"]
+    assert kb.embed_calls == []
+    assert len(kb.list_documents()) == 1
+    assert len(list(kb.documents_path.iterdir())) == 1
+
+    kb.add_documents([str(tmp_path / "fruits.txt"), str(copy / "fruits_copy.txt")])
+    assert kb.embed_calls == []
+
+    add_text_document(kb, tmp_path, "more.txt", [apple, banana])
+    assert len(kb.embed_calls) == 1
+    assert [("香蕉" in text) for text in kb.embed_calls[0]] == [True]
+    stats = kb.get_stats()
+    assert stats["vector_count"] == 2
+    assert stats["deduplicated_chunk_count"] >= 1
+
+
+NEAR_DUPLICATE_HEADERS = [
+    f"内部资料请勿外传，本文件版权归{owner}所有，如有疑问请联系行政部门或者信息安全办公室。"
+    for owner in ("集团公司", "集团总公司", "集团母公司")
+]
+COLLAPSE_CONFIG = {
+    "min_paragraph_length": 10,
+    "min_chunk_length": 5,
+    "collapse_near_duplicates": True,
+    "near_duplicate_threshold": 0.75,
+}
+
+
+def add_report_with_repeated_header(kb, tmp_path):
+    """添加页眉重复三次的文档（页眉、页眉、正文、页眉），启用近似重复合并"""
+    headers = NEAR_DUPLICATE_HEADERS
+    body = "苹果是一种常见的水果，味道香甜，富含维生素和膳食纤维，适合每天食用。"
+    file_path = tmp_path / "report.txt"
+    file_path.write_text("\n\n".join([headers[0], headers[1], body, headers[2]]), encoding="utf-8")
+    result = kb.add_document(str(file_path), chunk_config=COLLAPSE_CONFIG)
+    assert result["success"], result
+    return result
+
+
+def test_near_duplicate_chunks_stored_as_aliases(kb, tmp_path):
+    """
+    测试合并的近似重复文本块以别名保存
+
+    验证内容：
+    1. 被合并的文本块不向量化，但作为文档的文本块写入数据库，位置与合并前一致
+    2. 别名的 canonical_chunk_id 指向保留文本块，共用其向量
+    3. 添加结果与文档信息的文本块数一致，都包括别名
+    """
+    result = add_report_with_repeated_header(kb, tmp_path)
+    assert len(kb.embed_calls) == 1 and len(kb.embed_calls[0]) == 2
+    assert result["chunks_count"] == 4
+    assert kb.get_document_info(result["document_id"])["chunk_count"] == 4
+
+    with kb.vector_store._db.read() as conn:
+        rows = conn.execute(
+            """
+            SELECT c.id, c.chunk_index, c.content, c.canonical_chunk_id, v.chunk_id
+            FROM chunks c LEFT JOIN vectors v ON v.chunk_id = c.id
+            WHERE c.document_id = ? ORDER BY c.chunk_index
+        """,
+            (result["document_id"],),
+        ).fetchall()
+    header_id = rows[0][0]
+    # 预处理会规范化标点，按各段落独有的文字核对内容
+    assert [(index, canonical) for _, index, _, canonical, _ in rows] == [
+        (0, None),
+        (1, header_id),
+        (2, None),
+        (3, header_id),
+    ]
+    for (_, _, content, _, _), keyword in zip(rows, ["归集团公司", "集团总公司", "苹果", "集团母公司"]):
+        assert keyword in content
+    # 只有保留的文本块持有向量
+    assert [vector_chunk_id is not None for *_, vector_chunk_id in rows] == [True, False, True, False]
+    assert kb.get_stats()["vector_count"] == 2
+
+
+def test_enhanced_search_skips_near_duplicate_aliases(kb, tmp_path):
+    """测试混合检索的语料不包括近似重复文本块的别名，结果中没有重复内容"""
+    result = add_report_with_repeated_header(kb, tmp_path)
+
+    results = kb._enhanced_search("内部资料请勿外传", top_k=3)
+    contents = [r["content"] for r in results]
+    assert contents
+    assert len(set(contents)) == len(contents)
+    assert sum("内部资料" in content for content in contents) == 1
+    assert len(kb.vector_store.get_corpus_view({"document_ids": [result["document_id"]]})) == 2
+
+
+def test_registry_reuses_and_evicts(tmp_path):
+    """
+    测试已打开知识库的注册表
+
+    验证内容：
+    1. 同名知识库返回同一实例
+    2. 超出数量上限时关闭最近最少使用的知识库
+    3. 空闲超时的知识库在下次打开其他知识库时被关闭
+    4. close_knowledge_base 关闭并移除知识库
+    """
+    from rag_core import knowledge_base as kb_module
+
+    base = str(tmp_path / "kb")
+    config = {"max_open": 2, "idle_timeout": 100}
+    clock = [1000.0]
+    kb_module.close_all_knowledge_bases()
+    with patch.object(kb_module, "get_kb_registry_config", return_value=config), \
+         patch.object(kb_module.time, "monotonic", side_effect=lambda: clock[0]):
+        first = kb_module.get_knowledge_base("a", base)
+        assert kb_module.get_knowledge_base("a", base) is first
+
+        kb_module.get_knowledge_base("b", base)
+        kb_module.get_knowledge_base("a", base)
+        with patch.object(KnowledgeBase, "close", autospec=True) as close:
+            kb_module.get_knowledge_base("c", base)
+        assert [call.args[0].kb_name for call in close.call_args_list] == ["b"]
+        assert [kb["kb_name"] for kb in kb_module.list_open_knowledge_bases()] == ["a", "c"]
+
+        clock[0] += 50
+        kb_module.get_knowledge_base("c", base)
+        clock[0] += 60
+        kb_module.get_knowledge_base("d", base)
+        assert [kb["kb_name"] for kb in kb_module.list_open_knowledge_bases()] == ["c", "d"]
+        assert kb_module.get_knowledge_base("a", base) is not first
+
+        assert kb_module.close_knowledge_base("d", base)
+        assert not kb_module.close_knowledge_base("d", base)
+    kb_module.close_all_knowledge_bases()
+    assert kb_module.list_open_knowledge_bases() == []
@@ -0,0 +1,68 @@
+"""
+测试near_duplicate模块的功能
+测试MinHash/LSH近似重复文本块合并
+"""
+
+import pytest
+
+from rag_core.near_duplicate import (
+    MinHasher,
+    choose_bands,
+    collapse_near_duplicates,
+    jaccard,
+    shingles,
+)
+
+HEADER = "某某市统计局内部资料，未经许可不得转载。本报告数据截至2024年12月31日，仅供内部参考使用。"
+
+
+def test_collapse_keeps_first_and_records_back_references():
+    """
+    测试近似重复合并
+
+    验证内容：
+    1. 只有页码不同的页眉合并到最先出现的文本块，正文保留
+    2. duplicate_of 和 groups 记录每个原文本块对应的保留文本块
+    3. 报告合并数量和节省的字符数
+    """
+    chunks = [
+        HEADER + "第1页",
+        "第一季度全市生产总值同比增长5.2%，其中第三产业增长6.1%。",
+        HEADER + "第2页",
+        "第二季度社会消费品零售总额同比增长4.8%，网上零售增长明显。",
+        HEADER + "第3页",
+    ]
+    result = collapse_near_duplicates(chunks, threshold=0.8)
+
+    assert result["chunks"] == [chunks[0], chunks[1], chunks[3]]
+    assert result["duplicate_of"] == [0, 1, 0, 2, 0]
+    assert result["groups"] == [{"canonical": 0, "positions": [2, 4]}]
+    assert result["collapsed_count"] == 2
+    assert result["saved_chars"] == len(chunks[2]) + len(chunks[4])
+
+
+def test_threshold_controls_collapsing():
+    """测试阈值：相似度低于阈值的文本块不合并，阈值为1时只合并规范化后相同的文本块"""
+    a = "苹果是一种常见的水果，味道香甜，富含维生素和膳食纤维，适合每天食用。"
+    b = "苹果是一种常见的水果，味道酸甜，富含维生素和膳食纤维，适合每天食用。"
+    similarity = jaccard(shingles(a), shingles(b))
+    assert 0.5 < similarity < 0.9
+
+    assert collapse_near_duplicates([a, b], threshold=0.9)["collapsed_count"] == 0
+    assert collapse_near_duplicates([a, b], threshold=similarity - 0.01)["collapsed_count"] == 1
+    assert collapse_near_duplicates([a, " " + a.upper()], threshold=1.0)["collapsed_count"] == 1
+    with pytest.raises(ValueError):
+        collapse_near_duplicates([a], threshold=0)
+
+
+def test_minhash_estimates_jaccard():
+    """测试MinHash签名相等比例近似Jaccard相似度，LSH拐点不高于阈值"""
+    a = shingles(HEADER * 2 + "甲")
+    b = shingles(HEADER * 2 + "乙乙乙乙乙乙")
+    hasher = MinHasher(num_perm=256)
+    estimate = (hasher.signature(a) == hasher.signature(b)).mean()
+    assert estimate == pytest.approx(jaccard(a, b), abs=0.1)
+
+    bands, rows = choose_bands(0.9, 128)
+    assert bands * rows == 128
+    assert (1 / bands) ** (1 / rows) <= 0.9
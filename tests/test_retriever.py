@@ -41,6 +41,12 @@ def test_retrieve():
         result = retrieve(query, doc_vectors, docs, model_path=None, top_k=1)
         assert len(result) == 1
         assert "RAG" in result[0]
+
+        # 返回位置时映射回原列表（相似度阈值过滤后位置不变）
+        indices = retrieve(
+            query, doc_vectors, docs, top_k=1, similarity_threshold=0.5, return_indices=True
+        )
+        assert indices == [2]
     finally:
         # 恢复原始函数
         embedding.embed_documents = original_embed_documents
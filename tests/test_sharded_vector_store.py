@@ -0,0 +1,145 @@
+"""
+测试sharded_vector_store模块的功能
+测试分片路由、并行搜索合并和分片统计
+"""
+
+import numpy as np
+import pytest
+
+from rag_core.sharded_vector_store import ShardedVectorStore, read_num_shards
+from rag_core.vector_store import VectorStore
+
+
+@pytest.fixture
+def doc_files(tmp_path):
+    """创建内容各不相同的文档文件"""
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"doc{i}.txt"
+        path.write_text(f"文档{i}", encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def make_documents(doc_files):
+    """每个文档两个文本块，向量各不相同"""
+    rng = np.random.default_rng(0)
+    documents = []
+    for i, path in enumerate(doc_files):
+        documents.append(
+            {
+                "file_path": path,
+                "chunks": [f"doc{i}-a", f"doc{i}-b"],
+                "embeddings": rng.normal(size=(2, 8)).astype(np.float32).tolist(),
+            }
+        )
+    return documents
+
+
+def test_sharded_search_matches_single_store(tmp_path, doc_files):
+    """
+    测试分片搜索与单库搜索结果一致
+
+    验证内容：
+    1. 文档按哈希路由到多个分片，同一文件始终路由到同一分片
+    2. 全局ID可以查询和删除文档
+    3. 合并后的top-k与不分片时相同
+    4. get_stats 汇总总数并列出每个分片的规模
+    """
+    documents = make_documents(doc_files)
+    sharded = ShardedVectorStore(str(tmp_path / "shards"), 3)
+    single = VectorStore(str(tmp_path / "single" / "vector_store.db"))
+    document_ids = sharded.add_documents(documents)
+    single.add_documents(documents)
+
+    assert len({sharded.from_global_id(i)[0] for i in document_ids}) > 1
+    assert sharded.shard_for(doc_files[0]) == sharded.shard_for(doc_files[0])
+    assert sharded.get_document_info(document_ids[2])["file_path"] == doc_files[2]
+
+    queries = [doc["embeddings"][0] for doc in documents[:3]]
+    merged = sharded.search_many(queries, top_k=5)
+    expected = single.search_many(queries, top_k=5)
+    for got, want in zip(merged, expected):
+        assert [hit["content"] for hit in got] == [hit["content"] for hit in want]
+        assert [hit["score"] for hit in got] == pytest.approx([hit["score"] for hit in want])
+        assert [hit["rank"] for hit in got] == list(range(1, 6))
+    assert merged[0][0]["document_id"] == document_ids[0]
+
+    stats = sharded.get_stats()
+    assert stats["num_shards"] == 3
+    assert stats["document_count"] == 8
+    assert stats["vector_count"] == 16
+    assert sum(shard["chunk_count"] for shard in stats["shards"]) == 16
+
+    assert sharded.delete_document(document_ids[0])
+    hits = sharded.search(queries[0], top_k=5)
+    assert all(hit["document_id"] != document_ids[0] for hit in hits)
+    sharded.close()
+
+
+def test_sharded_document_filter(tmp_path, doc_files):
+    """
+    测试按全局文档ID过滤时只查询相关分片
+    """
+    documents = make_documents(doc_files)
+    sharded = ShardedVectorStore(str(tmp_path / "shards"), 4)
+    document_ids = sharded.add_documents(documents)
+
+    hits = sharded.search(
+        documents[0]["embeddings"][0], top_k=10, filters={"document_ids": document_ids[3:5]}
+    )
+    assert {hit["document_id"] for hit in hits} == set(document_ids[3:5])
+    assert sharded.search([0.0] * 8, filters={"document_ids": []}) == []
+
+    chunk_ids, contents, vectors = sharded.get_chunk_vectors({"document_ids": [document_ids[1]]})
+    assert contents == ["doc1-a", "doc1-b"]
+    assert vectors.shape == (2, 8)
+
+    view = sharded.get_corpus_view({"document_ids": [document_ids[1]]})
+    assert view.contents == ["doc1-a", "doc1-b"]
+    assert view.chunk_ids.tolist() == chunk_ids
+    assert view.document_ids.tolist() == [document_ids[1]] * 2
+    full = sharded.get_corpus_view()
+    assert len(full) == 16 and sharded.get_corpus_view() is full
+    sharded.delete_document(document_ids[1])
+    assert len(sharded.get_corpus_view()) == 14
+    sharded.close()
+
+
+def test_search_with_empty_shards(tmp_path, doc_files):
+    """
+    测试部分分片为空时的搜索
+
+    文档数少于分片数时总有分片从未入库；向量维度不是默认的384时，搜索仍返回其他分片的结果
+    """
+    sharded = ShardedVectorStore(str(tmp_path / "shards"), 3)
+    query = [1.0] + [0.0] * 15
+    assert sharded.search(query, top_k=3) == []
+
+    document_id = sharded.add_document(doc_files[0], ["only"], [query])
+    empty = [i for i, store in enumerate(sharded.shards) if not store.has_recorded_dim()]
+    assert len(empty) == 2
+    # 空分片已按默认维度创建了占位索引
+    sharded.shards[empty[0]]._ensure_index()
+
+    hits = sharded.search(query, top_k=3)
+    assert [hit["content"] for hit in hits] == ["only"]
+    assert hits[0]["document_id"] == document_id
+    assert sharded.search_many([query, query], top_k=1)[1][0]["content"] == "only"
+    sharded.close()
+
+
+def test_knowledge_base_records_shards(tmp_path):
+    """
+    测试知识库记录分片数，重新打开时沿用
+    """
+    from rag_core.knowledge_base import KnowledgeBase
+
+    kb = KnowledgeBase("sharded", str(tmp_path / "kb"), num_shards=2)
+    assert isinstance(kb.vector_store, ShardedVectorStore)
+    assert read_num_shards(str(kb.vectors_path)) == 2
+
+    reopened = KnowledgeBase("sharded", str(tmp_path / "kb"))
+    assert reopened.vector_store.num_shards == 2
+    kb.vector_store.close()
+    reopened.vector_store.close()
@@ -0,0 +1,104 @@
+"""
+测试vector_file模块的功能
+测试向量文件的追加写入、头部信息和memmap读取
+"""
+
+import os
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from rag_core.vector_file import VectorFile, HEADER_SIZE
+
+
+def test_append_and_memmap(tmp_path):
+    """
+    测试向量追加与读取
+
+    验证内容：
+    1. 首次追加创建文件并记录维度、行数和模型标识
+    2. 再次追加返回正确的起始行号，已有数据不被改写
+    3. memmap 读取结果与写入一致，文件大小为头部+数据
+    """
+    vf = VectorFile(str(tmp_path / "embeddings.vec"))
+    assert vf.count == 0
+
+    first = np.arange(6, dtype=np.float32).reshape(2, 3)
+    second = np.arange(6, 15, dtype=np.float32).reshape(3, 3)
+    assert vf.append(first, model_id="local:test-model") == 0
+    assert vf.append(second.tolist()) == 2
+
+    assert vf.dim == 3
+    assert vf.count == 5
+    assert vf.model_id == "local:test-model"
+    matrix = vf.memmap()
+    assert matrix.shape == (5, 3)
+    np.testing.assert_array_equal(matrix[:2], first)
+    np.testing.assert_array_equal(matrix[2:], second)
+    assert vf.size_bytes() == HEADER_SIZE + 5 * 3 * 4
+
+    batches = list(vf.iter_batches(batch_size=2))
+    assert [start for start, _ in batches] == [0, 2, 4]
+
+
+def test_append_dimension_mismatch(tmp_path):
+    """测试追加不同维度的向量时报错"""
+    vf = VectorFile(str(tmp_path / "embeddings.vec"))
+    vf.append([[1.0, 2.0]])
+    with pytest.raises(ValueError):
+        vf.append([[1.0, 2.0, 3.0]])
+    assert vf.count == 1
+
+
+def test_float16_storage(tmp_path):
+    """
+    测试float16存储
+
+    验证内容：
+    1. 存储类型记录在头部，追加时沿用文件的存储类型
+    2. 读取时转换为float32，误差在半精度范围内
+    3. 文件大小为float32的一半
+    """
+    vf = VectorFile(str(tmp_path / "embeddings.vec"))
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(4, 3)).astype(np.float32)
+    assert vf.append(vectors[:2], dtype="float16") == 0
+    assert vf.append(vectors[2:]) == 2
+
+    assert vf.dtype == "float16"
+    matrix = vf.memmap()
+    assert matrix.shape == (4, 3)
+    assert matrix[np.array([3, 1])].dtype == np.float32
+    np.testing.assert_allclose(matrix[:], vectors, rtol=1e-3)
+    assert vf.size_bytes() == HEADER_SIZE + 4 * 3 * 2
+    with pytest.raises(ValueError):
+        VectorFile(str(tmp_path / "other.vec")).append(vectors, dtype="int8")
+
+
+def test_header_cached_until_file_changes(tmp_path):
+    """
+    测试头部缓存
+
+    验证内容：
+    1. 本实例写入后直接更新缓存，读取 dim / count / dtype 不再打开文件
+    2. 另一个实例（如另一个进程）追加后文件状态变化，重新读取头部
+    3. 文件被替换或删除后不再使用旧缓存
+    """
+    path = str(tmp_path / "embeddings.vec")
+    vf = VectorFile(path)
+    vf.append([[1.0, 2.0]])
+    with patch.object(VectorFile, "_read_header", side_effect=AssertionError("不应读取头部")):
+        assert (vf.dim, vf.count, vf.dtype) == (2, 1, "float32")
+        assert vf.memmap().shape == (1, 2)
+
+    VectorFile(path).append([[3.0, 4.0], [5.0, 6.0]])
+    assert vf.count == 3
+    np.testing.assert_array_equal(vf.memmap()[2], [5.0, 6.0])
+
+    replacement = VectorFile(str(tmp_path / "replacement.vec"))
+    replacement.append([[7.0, 8.0, 9.0]])
+    os.replace(replacement.path, path)
+    assert (vf.dim, vf.count) == (3, 1)
+    os.remove(path)
+    assert (vf.dim, vf.count, vf.dtype) == (0, 0, None)
@@ -0,0 +1,57 @@
+"""
+测试vector_search模块的功能
+测试numpy精确搜索与暴力计算结果一致
+"""
+
+import numpy as np
+import pytest
+
+from rag_core.vector_search import search_matrix
+
+
+@pytest.mark.parametrize("metric", ["l2", "cosine", "ip"])
+def test_search_matrix_matches_brute_force(metric):
+    """
+    测试分块搜索结果与整体计算一致
+
+    验证内容：
+    1. 块大小小于向量数时，top-k与一次性计算的结果相同
+    2. 分数按相似度从高到低排列
+    """
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(1000, 16)).astype(np.float32)
+    queries = rng.normal(size=(3, 16)).astype(np.float32)
+
+    scores, rows = search_matrix(matrix, queries, 10, metric=metric, block_size=128)
+
+    if metric == "l2":
+        expected = -((queries[:, None, :] - matrix[None, :, :]) ** 2).sum(axis=2)
+    elif metric == "cosine":
+        expected = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ (
+            matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        ).T
+    else:
+        expected = queries @ matrix.T
+    expected_rows = np.argsort(-expected, axis=1)[:, :10]
+    np.testing.assert_array_equal(rows, expected_rows)
+    if metric == "l2":
+        assert np.all(np.diff(scores, axis=1) >= 0)
+    else:
+        assert np.all(np.diff(scores, axis=1) <= 0)
+
+
+def test_search_matrix_mask_and_padding():
+    """
+    测试屏蔽行与结果不足
+
+    验证内容：
+    1. valid_mask 为False的行不会出现在结果中
+    2. 可用行数少于top_k时以-1填充
+    """
+    matrix = np.array([[1.0, 0.0], [0.0, 1.0], [0.9, 0.1]], dtype=np.float32)
+    mask = np.array([False, True, True])
+
+    scores, rows = search_matrix(matrix, [1.0, 0.0], 3, metric="cosine", valid_mask=mask, block_size=2)
+
+    assert rows[0].tolist() == [2, 1, -1]
+    assert scores[0, 0] == pytest.approx(0.9 / np.sqrt(0.82))
@@ -0,0 +1,645 @@
+"""
+测试vector_store模块的功能
+测试向量存储的持久化、检索和统计
+"""
+
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+from rag_core.index_cache import IndexHandle, clear_index_cache
+from rag_core.vector_store import VectorStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    """创建临时向量存储"""
+    return VectorStore(str(tmp_path / "vectors" / "vector_store.db"))
+
+
+@pytest.fixture
+def doc_file(tmp_path):
+    """创建一个临时文档文件"""
+    path = tmp_path / "doc.txt"
+    path.write_text("测试文档", encoding="utf-8")
+    return str(path)
+
+
+def test_vectors_persisted_to_vector_file(store, doc_file):
+    """
+    测试原始向量写入向量文件
+
+    验证内容：
+    1. 多个文档的向量按全局行号追加
+    2. get_chunk_vectors 从向量文件读取到与写入一致的向量
+    3. 新实例（模拟重启）同样可以读取
+    4. 导出包含全部向量
+    """
+    store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]], model_id="local:m")
+    store.add_document(doc_file, ["c"], [[0.5, 0.5]], model_id="local:m")
+
+    assert store.vector_file.count == 3
+    assert store.vector_file.model_id == "local:m"
+
+    reopened = VectorStore(store.db_path)
+    chunk_ids, contents, vectors = reopened.get_chunk_vectors()
+    assert contents == ["a", "b", "c"]
+    np.testing.assert_array_equal(
+        vectors, np.array([[1.0, 0.0], [0.0, 1.0], [0.5, 0.5]], dtype=np.float32)
+    )
+
+    export_path = str(store.vector_file.path) + ".export.npz"
+    assert reopened.export_vectors(export_path) == 3
+    exported = np.load(export_path)
+    assert exported["chunk_ids"].tolist() == chunk_ids
+    assert exported["vectors"].shape == (3, 2)
+
+
+def test_search_maps_hits_by_chunk_id_after_delete(store, doc_file):
+    """
+    测试FAISS命中按chunk_id映射
+
+    验证内容：
+    1. 删除前面的文档后，后续文档的命中仍返回正确的文本块
+    2. 已删除文档的文本块不会出现在结果中
+    """
+    first = store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    store.add_document(doc_file, ["c", "d"], [[0.9, 0.1], [0.1, 0.9]])
+    assert store.delete_document(first)
+
+    results = VectorStore(store.db_path).search([0.0, 1.0], top_k=4)
+    assert [r["content"] for r in results] == ["d", "c"]
+    assert [r["rank"] for r in results] == [1, 2]
+
+
+def test_legacy_pickled_index_migrated(store, doc_file):
+    """测试旧版本（按插入顺序编号、pickle保存）的索引迁移到向量文件和chunk_id索引"""
+    import os
+    import pickle
+    import sqlite3
+    import faiss
+
+    store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    # 模拟旧版本：无向量文件，vector_index为文档内序号，索引为IndexFlatL2
+    os.remove(store.vectors_path)
+    legacy = faiss.IndexFlatL2(2)
+    legacy.add(np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32))
+    with open(store.legacy_index_path, "wb") as f:
+        pickle.dump(legacy, f)
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute("UPDATE vectors SET vector_index = 0")
+
+    # 模拟新进程启动：清空进程内索引缓存
+    clear_index_cache()
+    reopened = VectorStore(store.db_path)
+    results = reopened.search([0.0, 1.0], top_k=1)
+    assert results[0]["content"] == "b"
+    assert reopened.vector_file.count == 2
+    _, contents, vectors = reopened.get_chunk_vectors()
+    assert contents == ["a", "b"]
+    np.testing.assert_array_equal(vectors[1], [0.0, 1.0])
+
+
+def test_delete_removes_ids_and_rebuild_streams(store, doc_file):
+    """
+    测试删除与重建索引
+
+    验证内容：
+    1. 删除文档后索引中对应的向量被屏蔽，压缩后被移除
+    2. 重建按批次进行并回调进度，重建结果与删除后一致
+    3. 重建后的索引文件可被新实例加载
+    """
+    first = store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    store.add_document(doc_file, ["c", "d", "e"], [[0.9, 0.1], [0.1, 0.9], [0.5, 0.5]])
+    store.delete_document(first)
+    assert store.index.tombstones.tolist() == [1, 2]
+    store.compact(force=True)
+    assert store.index.ntotal == 3
+
+    progress = []
+    assert store.rebuild_index(batch_size=2, progress_callback=lambda done, total: progress.append((done, total))) == 3
+    assert progress == [(2, 3), (3, 3)]
+
+    reopened = VectorStore(store.db_path)
+    results = reopened.search([1.0, 0.0], top_k=5)
+    assert [r["content"] for r in results] == ["c", "e", "d"]
+
+
+def test_index_config_persisted_and_reported(store, doc_file):
+    """
+    测试索引类型配置
+
+    验证内容：
+    1. 配置按知识库持久化，重建后使用指定索引类型
+    2. get_stats 报告索引类型和内存占用
+    3. 不支持按ID删除的 HNSW 索引在压缩时重建
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.random((120, 8), dtype=np.float32)
+    doc_id = store.add_document(doc_file, [f"c{i}" for i in range(100)], vectors[:100].tolist())
+    store.add_document(doc_file, [f"d{i}" for i in range(20)], vectors[100:].tolist())
+
+    store.set_index_config(index_type="ivf_flat", nlist=2)
+    reopened = VectorStore(store.db_path)
+    stats = reopened.get_stats()
+    assert stats["index_type"] == "FAISS/ivf_flat"
+    assert stats["index_config"]["nlist"] == 2
+    assert stats["index_memory_bytes"] > 0
+    assert reopened.search(vectors[105].tolist(), top_k=1)[0]["content"] == "d5"
+
+    reopened.set_index_config(index_type="hnsw")
+    reopened.delete_document(doc_id)
+    reopened.compact(force=True)
+    assert reopened.index.ntotal == 20
+    assert reopened.get_stats()["index_type"] == "FAISS/hnsw"
+    assert reopened.search(vectors[110].tolist(), top_k=1)[0]["content"] == "d10"
+
+
+def test_native_index_deferred_save_and_catch_up(store, doc_file):
+    """
+    测试原生索引文件的延迟写回
+
+    验证内容：
+    1. 未达到写回阈值时不重写索引文件，新实例从向量文件补齐新增向量
+    2. flush 后索引文件以原生格式写入，旧pickle文件不再生成
+    3. 新实例以mmap方式加载后仍可继续写入
+    """
+    import os
+
+    store.index_save_interval = 100
+    store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    store.flush()
+    assert os.path.exists(store.index_path)
+    assert not os.path.exists(store.legacy_index_path)
+
+    store.add_document(doc_file, ["c"], [[0.6, 0.4]])
+    reopened = VectorStore(store.db_path)
+    results = reopened.search([0.6, 0.4], top_k=1)
+    assert results[0]["content"] == "c"
+    assert reopened.index.ntotal == 3
+
+    reopened.add_document(doc_file, ["d"], [[0.2, 0.8]])
+    reopened.close()
+    again = VectorStore(store.db_path)
+    assert again.search([0.2, 0.8], top_k=1)[0]["content"] == "d"
+    assert again.index.ntotal == 4
+
+
+def test_basic_search_without_faiss(store, doc_file, monkeypatch):
+    """
+    测试FAISS不可用时的numpy精确搜索
+
+    验证内容：
+    1. 返回真实距离排序的结果，而不是固定占位分数
+    2. 已删除文档的向量不会命中
+    """
+    import rag_core.vector_store as vector_store_module
+
+    monkeypatch.setattr(vector_store_module, "FAISS_AVAILABLE", False)
+    first = store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    store.add_document(doc_file, ["c", "d"], [[0.9, 0.1], [0.3, 0.7]])
+    store.delete_document(first)
+
+    results = store.search([0.0, 1.0], top_k=3)
+    assert [r["content"] for r in results] == ["d", "c"]
+    assert results[0]["score"] == pytest.approx(0.7 / np.sqrt(0.58))
+
+
+def test_index_shared_and_hot_reloaded(store, doc_file):
+    """
+    测试进程内索引共享与热加载
+
+    验证内容：
+    1. 同一知识库的多个实例共享同一个已加载索引
+    2. 其他进程写入新索引文件后，后台加载完成前继续使用旧索引，完成后切换
+    """
+    import threading
+    import faiss
+
+    store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    store.flush()
+    other = VectorStore(store.db_path)
+    assert other._ensure_index() is store.index
+
+    # 模拟其他进程：重建一个只包含 chunk "b" 的索引并写入文件
+    other_process_index = faiss.clone_index(store.index.base)
+    other_process_index.remove_ids(faiss.IDSelectorBatch(np.array([1], dtype=np.int64)))
+    faiss.write_index(other_process_index, store.index_path)
+    with open(store.index_meta_path, "w", encoding="utf-8") as f:
+        f.write('{"vector_rows": 2}')
+    old_index = store.index
+
+    store.index_reload_check_interval = 0
+    # 检查到新版本时立即返回旧索引，新索引在后台线程加载
+    assert store._ensure_index() is old_index
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and thread.daemon:
+            thread.join(5)
+
+    assert store.index is not old_index
+    assert other.index.ntotal == 1
+    assert other.search([1.0, 0.0], top_k=1)[0]["content"] == "b"
+
+
+def test_add_documents_single_transaction(store, doc_file):
+    """
+    测试批量入库
+
+    验证内容：
+    1. 多个文档一次写入，文本块ID连续且与向量行号对应
+    2. 数据库使用WAL模式
+    """
+    import sqlite3
+
+    doc_ids = store.add_documents(
+        [
+            {"file_path": doc_file, "chunks": ["a", "b"], "embeddings": [[1.0, 0.0], [0.0, 1.0]]},
+            {"file_path": doc_file, "chunks": ["c"], "embeddings": [[0.5, 0.5]], "filename": "c.txt"},
+        ]
+    )
+
+    assert len(doc_ids) == 2
+    with sqlite3.connect(store.db_path) as conn:
+        rows = conn.execute(
+            "SELECT c.document_id, c.content, v.vector_index FROM chunks c JOIN vectors v ON v.chunk_id = c.id ORDER BY c.id"
+        ).fetchall()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert rows == [(doc_ids[0], "a", 0), (doc_ids[0], "b", 1), (doc_ids[1], "c", 2)]
+    assert store.get_document_info(doc_ids[1])["filename"] == "c.txt"
+    assert store.search([0.5, 0.5], top_k=1)[0]["content"] == "c"
+
+
+@pytest.mark.parametrize("use_faiss", [True, False])
+def test_metric_recorded_and_threshold_pruned(store, doc_file, monkeypatch, use_faiss):
+    """
+    测试相似度度量与阈值过滤
+
+    验证内容：
+    1. 新知识库默认使用cosine度量，分数为余弦相似度（越大越相似）
+    2. score_threshold 过滤掉低于阈值的命中，FAISS与numpy路径一致
+    3. 切换为l2度量后重建索引，分数仍然越大越相似
+    """
+    import rag_core.vector_store as vector_store_module
+
+    if not use_faiss:
+        monkeypatch.setattr(vector_store_module, "FAISS_AVAILABLE", False)
+    store.add_document(doc_file, ["a", "b", "c"], [[2.0, 0.0], [0.0, 3.0], [1.0, 1.0]])
+
+    assert store.get_index_config()["metric"] == "cosine"
+    results = store.search([1.0, 0.0], top_k=3)
+    assert [r["content"] for r in results] == ["a", "c", "b"]
+    assert [r["score"] for r in results] == pytest.approx([1.0, np.sqrt(0.5), 0.0], abs=1e-6)
+
+    pruned = store.search([1.0, 0.0], top_k=3, score_threshold=0.5)
+    assert [r["content"] for r in pruned] == ["a", "c"]
+
+    store.set_index_config(rebuild=False, metric="l2")
+    results = VectorStore(store.db_path).search([1.0, 0.2], top_k=3)
+    assert [r["content"] for r in results] == ["c", "a", "b"]
+    assert results[0]["score"] > results[1]["score"] > results[2]["score"]
+
+
+@pytest.mark.parametrize("exact_limit", [0, 4096])
+def test_search_with_metadata_filters(store, tmp_path, exact_limit):
+    """
+    测试元数据过滤搜索
+
+    验证内容：
+    1. 按文档ID、文件类型、文件名过滤时只返回满足条件的文本块，且结果数量不因过滤而减少
+    2. 通过FAISS IDSelector（exact_limit=0）与精确计算两条路径结果一致
+    3. 上传时间范围与无匹配条件
+    """
+    store.filter_exact_search_limit = exact_limit
+    txt = tmp_path / "a.txt"
+    txt.write_text("a", encoding="utf-8")
+    pdf = tmp_path / "b.pdf"
+    pdf.write_text("b", encoding="utf-8")
+    first = store.add_document(str(txt), ["a1", "a2"], [[1.0, 0.0], [0.9, 0.1]])
+    second = store.add_document(str(pdf), ["b1", "b2"], [[0.0, 1.0], [0.2, 0.8]])
+
+    by_doc = store.search([1.0, 0.0], top_k=2, filters={"document_ids": [second]})
+    assert [r["content"] for r in by_doc] == ["b2", "b1"]
+    assert {r["document_id"] for r in by_doc} == {second}
+
+    by_type = store.search([0.0, 1.0], top_k=2, filters={"file_types": ["txt"]})
+    assert [r["content"] for r in by_type] == ["a2", "a1"]
+    by_name = store.search([0.0, 1.0], top_k=5, filters={"filenames": ["a.txt"]})
+    assert {r["document_id"] for r in by_name} == {first}
+
+    assert len(store.search([1.0, 0.0], top_k=5, filters={"created_after": "2000-01-01"})) == 4
+    assert store.search([1.0, 0.0], top_k=5, filters={"created_before": "2000-01-01"}) == []
+    assert store.search([1.0, 0.0], top_k=5, filters={"document_ids": []}) == []
+    with pytest.raises(ValueError):
+        store.search([1.0, 0.0], filters={"unknown": 1})
+
+
+@pytest.mark.parametrize("use_faiss", [True, False])
+def test_search_many_matches_single_search(store, doc_file, monkeypatch, use_faiss):
+    """测试批量搜索与逐个搜索结果一致，FAISS与numpy路径均适用"""
+    import rag_core.vector_store as vector_store_module
+
+    if not use_faiss:
+        monkeypatch.setattr(vector_store_module, "FAISS_AVAILABLE", False)
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    store.add_document(doc_file, [f"c{i}" for i in range(50)], vectors.tolist())
+    queries = rng.normal(size=(6, 8)).astype(np.float32)
+
+    batch = store.search_many(queries.tolist(), top_k=3)
+
+    assert len(batch) == 6
+    for query, results in zip(queries, batch):
+        single = store.search(query.tolist(), top_k=3)
+        assert [r["chunk_id"] for r in results] == [r["chunk_id"] for r in single]
+        assert [r["score"] for r in results] == pytest.approx([r["score"] for r in single], abs=1e-5)
+        assert len(results) == 3
+    assert store.search_many([], top_k=3) == []
+
+
+@pytest.mark.parametrize("vector_dtype", ["float16", "int8"])
+def test_compressed_vectors_rescored(store, doc_file, vector_dtype):
+    """
+    测试压缩存储的知识库
+
+    验证内容：
+    1. 索引按配置的存储类型压缩（int8 在向量足够后切换为量化索引），向量文件按 float16 存储
+    2. 检索结果经精确重排后与 float32 精确搜索一致
+    3. 已有向量后不能再修改存储类型
+    """
+    pytest.importorskip("faiss")
+    store.set_index_config(rebuild=False, vector_dtype=vector_dtype, metric="l2")
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(1200, 16)).astype(np.float32)
+    store.add_document(doc_file, [f"c{i}" for i in range(1200)], vectors.tolist())
+
+    stats = store.get_stats()
+    assert stats["vector_file_dtype"] == "float16"
+    assert stats["index_vector_dtype"] == vector_dtype
+    assert stats["vector_file_size_bytes"] < 1200 * 16 * 4
+
+    stored = store.vector_file.memmap()[:]
+    queries = rng.normal(size=(5, 16)).astype(np.float32)
+    for query, results in zip(queries, store.search_many(queries.tolist(), top_k=5)):
+        expected = np.argsort(((stored - query) ** 2).sum(axis=1))[:5]
+        assert [r["content"] for r in results] == [f"c{i}" for i in expected]
+
+    with pytest.raises(ValueError):
+        store.set_index_config(rebuild=False, vector_dtype="float32")
+
+
+def test_snapshot_pinned_during_writes(store, doc_file):
+    """
+    测试索引快照隔离
+
+    验证内容：
+    1. 查询固定的一代在写入发布新一代后保持不变，查询结束后旧一代被释放
+    2. 写入方持有索引锁时检索不被阻塞
+    3. 已追加到向量文件但未提交的行不会被补入索引，之后的提交越过它继续补齐
+    """
+    import threading
+
+    pytest.importorskip("faiss")
+    store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    handle = store._index_handle
+
+    with handle.pin() as pinned:
+        store.add_document(doc_file, ["c"], [[0.6, 0.4]])
+        assert pinned.ntotal == 2
+        assert store.index is not pinned
+        assert pinned.generation in handle.retired
+    assert pinned.generation not in handle.retired
+    assert store.index.ntotal == 3
+
+    holding = threading.Event()
+    release = threading.Event()
+
+    def writer():
+        with handle.lock:
+            holding.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    holding.wait(5)
+    store.index_reload_check_interval = 0
+    try:
+        assert store.search([0.6, 0.4], top_k=1)[0]["content"] == "c"
+    finally:
+        release.set()
+        thread.join()
+
+    # 模拟尚未提交的写入：向量已追加，数据库中还没有对应记录
+    store.vector_file.append([[0.0, 0.0]])
+    store._ensure_index()
+    assert handle.indexed_rows == 3
+    store.add_document(doc_file, ["d"], [[0.2, 0.8]])
+    assert handle.indexed_rows == 5
+    assert store.index.ntotal == 4
+    assert store.search([0.2, 0.8], top_k=1)[0]["content"] == "d"
+
+
+def test_delete_tombstones_then_compact(store, doc_file):
+    """
+    测试墓碑删除与压缩
+
+    验证内容：
+    1. 删除只写墓碑，索引不变但检索、统计和文档列表立即排除被删除的文本块
+    2. 墓碑比例未达到阈值时不压缩
+    3. 压缩回收空间，向量文件行号重新编号，chunk_id 不变，检索结果一致
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.random((30, 4), dtype=np.float32)
+    first = store.add_document(doc_file, [f"a{i}" for i in range(20)], vectors[:20].tolist())
+    second = store.add_document(doc_file, [f"b{i}" for i in range(10)], vectors[20:].tolist())
+
+    assert store.delete_document(first)
+    assert not store.delete_document(first)
+    assert store.index.ntotal == 30
+    assert all(r["content"].startswith("b") for r in store.search(vectors[5].tolist(), top_k=10))
+    assert [d["id"] for d in store.list_documents()] == [second]
+    assert store.get_document_info(first) is None
+    stats = store.get_stats()
+    assert stats["chunk_count"] == 10
+    assert stats["tombstone_count"] == 20
+    before = store.search(vectors[25].tolist(), top_k=3)
+
+    store.compaction_threshold = 0.9
+    assert not store.compact()["compacted"]
+
+    result = store.compact(force=True)
+    assert result["compacted"]
+    assert result["removed_vectors"] == 20
+    assert result["removed_documents"] == 1
+    assert result["reclaimed_bytes"] > 0
+    assert store.vector_file.count == 10
+    assert store.index.ntotal == 10
+    assert store.get_stats()["tombstone_count"] == 0
+
+    reopened = VectorStore(store.db_path)
+    assert reopened.search(vectors[25].tolist(), top_k=3) == before
+    chunk_ids, _, stored = reopened.get_chunk_vectors()
+    assert chunk_ids == list(range(21, 31))
+    np.testing.assert_allclose(stored, vectors[20:])
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 另一个进程入库：每个文本块的向量第一维为 value，便于核对行号与向量是否对应
+INGEST_SCRIPT = """
+import sys
+from rag_core.vector_store import VectorStore
+db_path, doc_file, prefix, docs = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+store = VectorStore(db_path)
+for d in range(docs):
+    value = float(sys.argv[5]) + d
+    store.add_document(doc_file, [f"{prefix}{d}-{i}" for i in range(3)], [[value, float(i)] for i in range(3)])
+"""
+
+
+def _ingest_process(db_path, doc_file, prefix, docs, base):
+    return subprocess.Popen(
+        [sys.executable, "-c", INGEST_SCRIPT, db_path, doc_file, prefix, str(docs), str(base)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def _assert_rows_match_chunks(store):
+    """每个文本块的向量文件行号唯一，且行中的向量就是该文本块入库时的向量"""
+    with store._db.read() as conn:
+        rows = conn.execute(
+            "SELECT c.content, v.vector_index FROM chunks c JOIN vectors v ON v.chunk_id = c.id"
+        ).fetchall()
+    indexes = [row for _, row in rows]
+    assert len(set(indexes)) == len(indexes)
+    matrix = store.vector_file.memmap()
+    bases = {"p": 0.0, "q": 100.0, "r": 200.0}
+    for content, row in rows:
+        doc, i = content[1:].split("-")
+        np.testing.assert_allclose(matrix[row], [bases[content[0]] + int(doc), int(i)])
+    return len(rows)
+
+
+def test_concurrent_processes_get_distinct_vector_rows(store, doc_file):
+    """测试多个进程同时入库：向量文件行号在写事务中分配，不会相互覆盖"""
+    store.add_document(doc_file, ["p0-0", "p0-1", "p0-2"], [[0.0, 0.0], [0.0, 1.0], [0.0, 2.0]])
+    processes = [
+        _ingest_process(store.db_path, doc_file, prefix, 10, base)
+        for prefix, base in (("q", 100), ("r", 200))
+    ]
+    for process in processes:
+        assert process.wait(timeout=120) == 0
+
+    assert store.vector_file.count == 63
+    assert _assert_rows_match_chunks(store) == 63
+
+
+def test_compact_keeps_rows_appended_by_other_process(store, doc_file, monkeypatch):
+    """测试压缩写入新向量文件期间其他进程追加的向量，在替换文件时一并保留"""
+    first = store.add_document(doc_file, ["p0-0", "p0-1", "p0-2"], [[0.0, 0.0], [0.0, 1.0], [0.0, 2.0]])
+    store.add_document(doc_file, ["p1-0", "p1-1", "p1-2"], [[1.0, 0.0], [1.0, 1.0], [1.0, 2.0]])
+    store.delete_document(first)
+
+    exclusive = IndexHandle.exclusive
+
+    @contextmanager
+    def exclusive_after_ingest(handle):
+        # 第1步已写完新向量文件，此时另一个进程入库
+        assert _ingest_process(store.db_path, doc_file, "q", 2, 100).wait(timeout=120) == 0
+        with exclusive(handle):
+            yield
+
+    monkeypatch.setattr(IndexHandle, "exclusive", exclusive_after_ingest)
+    assert store.compact(force=True)["removed_vectors"] == 3
+    monkeypatch.setattr(IndexHandle, "exclusive", exclusive)
+
+    assert store.vector_file.count == 9
+    assert _assert_rows_match_chunks(store) == 9
+    reopened = VectorStore(store.db_path)
+    assert reopened.search([100.0, 1.0], top_k=1)[0]["content"] == "q0-1"
+
+
+def test_clear_removes_everything(store, doc_file):
+    """测试清空：一次删除所有记录和文件，之后可以重新入库"""
+    store.add_document(doc_file, ["a", "b"], [[1.0, 0.0], [0.0, 1.0]])
+    store.search([1.0, 0.0], top_k=1)
+    store.clear()
+    assert store.list_documents() == []
+    assert store.search([1.0, 0.0], top_k=1) == []
+    assert store.vector_file.count == 0
+
+    store.add_document(doc_file, ["c"], [[0.0, 1.0]])
+    assert store.search([0.0, 1.0], top_k=1)[0]["content"] == "c"
+
+
+def test_identical_chunks_share_one_vector(store, doc_file):
+    """
+    测试内容相同的文本块共用向量
+
+    验证内容：
+    1. 第二个文档中重复的文本块不写入向量文件和索引，向量可以省略
+    2. 按文档过滤时命中共用向量，返回该文档自己的文本块
+    3. 删除持有向量的文档后向量仍被保留，两个文档都删除后才写墓碑并在压缩时移除
+    """
+    first = store.add_document(doc_file, ["shared", "a"], [[1.0, 0.0], [0.0, 1.0]])
+    second = store.add_document(doc_file, ["shared", "b"], [None, [0.6, 0.8]])
+    assert store.vector_file.count == 3
+    assert store.index.ntotal == 3
+    assert store.get_stats()["deduplicated_chunk_count"] == 1
+
+    hit = store.search([1.0, 0.0], top_k=1, filters={"document_ids": [second]})[0]
+    assert (hit["content"], hit["document_id"]) == ("shared", second)
+    assert hit["chunk_id"] == 3
+
+    store.delete_document(first)
+    assert store.index.tombstones.tolist() == [2]
+    hit = store.search([1.0, 0.0], top_k=1)[0]
+    assert (hit["content"], hit["document_id"]) == ("shared", second)
+    store.compact(force=True)
+    assert store.vector_file.count == 2
+    assert store.search([1.0, 0.0], top_k=1)[0]["document_id"] == second
+    _, contents, vectors = store.get_chunk_vectors()
+    assert contents == ["shared", "b"]
+    np.testing.assert_allclose(vectors[0], [1.0, 0.0])
+
+    store.delete_document(second)
+    assert store.compact(force=True)["removed_vectors"] == 2
+    assert store.vector_file.count == 0
+    assert store.get_stats()["chunk_count"] == 0
+
+    with pytest.raises(ValueError):
+        store.add_document(doc_file, ["new"], [None])
+
+
+def test_content_hash_columns_migrated(tmp_path, doc_file):
+    """测试旧版本数据库增加内容哈希列，已有文本块补算哈希后可被复用"""
+    import sqlite3
+
+    from rag_core.vector_store import chunk_hash, document_hash
+
+    db_path = tmp_path / "old" / "vector_store.db"
+    db_path.parent.mkdir()
+    store = VectorStore(str(db_path))
+    store.add_document(doc_file, ["a"], [[1.0, 0.0]])
+    store.close()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DROP INDEX idx_chunks_content_hash")
+        conn.execute("DROP INDEX idx_documents_content_hash")
+        conn.execute("DROP INDEX idx_chunks_canonical_chunk_id")
+        conn.execute("ALTER TABLE chunks DROP COLUMN content_hash")
+        conn.execute("ALTER TABLE chunks DROP COLUMN canonical_chunk_id")
+        conn.execute("ALTER TABLE documents DROP COLUMN content_hash")
+
+    from rag_core.connection_manager import close_all_connections
+
+    close_all_connections()
+    reopened = VectorStore(str(db_path))
+    assert reopened.find_chunks_by_hash([chunk_hash("a")]) == {chunk_hash("a"): 1}
+    assert reopened.find_document_by_hash(document_hash(doc_file)) is None
+    reopened.add_document(doc_file, ["a"], [None])
+    assert reopened.vector_file.count == 1
+    assert reopened.find_document_by_hash(document_hash(doc_file)) == 2
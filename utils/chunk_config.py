@@ -197,6 +197,24 @@ class DocumentChunkConfig:
             depends_on="merge_short_chunks",
         )
 
+        params["collapse_near_duplicates"] = ChunkParameter(
+            name="collapse_near_duplicates",
+            value=False,
+            description="是否合并近似重复的文本块（MinHash/LSH），适合页眉页脚、模板段落大量重复的扫描件和wiki导出",
+            category="高级配置",
+        )
+
+        params["near_duplicate_threshold"] = ChunkParameter(
+            name="near_duplicate_threshold",
+            value=0.9,
+            description="近似重复阈值，两个文本块字符5-gram的Jaccard相似度不低于此值时合并为一个",
+            category="高级配置",
+            min_value=0.5,
+            max_value=1.0,
+            step=0.05,
+            depends_on="collapse_near_duplicates",
+        )
+
         return params
 
     def get_default_config(self) -> Dict[str, Any]:
@@ -102,6 +102,39 @@ RETRIEVAL_CONFIG = {
     },
 }
 
+# embedding 缓存配置（config.json 中的 embedding_cache 字段可覆盖）
+EMBEDDING_CACHE_CONFIG = {
+    "enabled": os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true",
+    # 缓存数据库路径，默认位于项目根目录 knowledge_base/embedding_cache.db
+    "path": os.getenv(
+        "EMBEDDING_CACHE_PATH",
+        os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "..",
+            "knowledge_base",
+            "embedding_cache.db",
+        ),
+    ),
+    # 最多缓存的向量条数，超出后按最近最少使用淘汰
+    "max_entries": int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")),
+}
+
+# 混合检索的内存语料视图（文本块ID、内容和向量）缓存配置
+CORPUS_CACHE_CONFIG = {
+    "enabled": os.getenv("CORPUS_CACHE_ENABLED", "true").lower() == "true",
+    # 所有知识库的语料视图合计占用的内存上限（MB），超出后按最近最少使用淘汰；
+    # 单个知识库超出上限时文本内容按需读取，向量按需从向量文件读取
+    "max_memory_mb": int(os.getenv("CORPUS_CACHE_MAX_MEMORY_MB", "1024")),
+}
+
+# 进程内已打开知识库的注册表配置（Web服务在请求间复用 KnowledgeBase 实例）
+KB_REGISTRY_CONFIG = {
+    # 同时保持打开的知识库数量上限，超出时关闭最近最少使用的知识库
+    "max_open": int(os.getenv("KB_REGISTRY_MAX_OPEN", "16")),
+    # 超过该时间（秒）未使用的知识库被关闭，释放索引和语料视图
+    "idle_timeout": float(os.getenv("KB_REGISTRY_IDLE_TIMEOUT", "1800")),
+}
+
 CONFIG_JSON_PATH = os.path.join(os.path.dirname(__file__), "../config.json")
 
 
@@ -194,3 +227,33 @@ def get_embedding_config():
     config = embedding_configs.get(provider, {})
     print(f"[config] 当前EMBEDDING_PROVIDER: {provider}, model: {config.get('model_name', config.get('model_path', ''))}")
     return provider, config
+
+
+def get_embedding_cache_config():
+    """
+    获取 embedding 缓存配置（config.json 中的 embedding_cache 优先）。
+    :return: dict，包含 enabled、path、max_entries
+    """
+    config = EMBEDDING_CACHE_CONFIG.copy()
+    config.update(load_global_config().get("embedding_cache", {}))
+    return config
+
+
+def get_corpus_cache_config():
+    """
+    获取语料视图缓存配置（config.json 中的 corpus_cache 优先）。
+    :return: dict，包含 enabled、max_memory_mb
+    """
+    config = CORPUS_CACHE_CONFIG.copy()
+    config.update(load_global_config().get("corpus_cache", {}))
+    return config
+
+
+def get_kb_registry_config():
+    """
+    获取知识库注册表配置（config.json 中的 kb_registry 优先）。
+    :return: dict，包含 max_open、idle_timeout
+    """
+    config = KB_REGISTRY_CONFIG.copy()
+    config.update(load_global_config().get("kb_registry", {}))
+    return config
@@ -11,10 +11,12 @@ from rag_core.retriever import retrieve
 from rag_core.generator import generate_answer
 from rag_core.knowledge_base import (
     KnowledgeBase,
-    create_knowledge_base,
+    get_knowledge_base,
     list_knowledge_bases,
 )
 from rag_core.conversation_manager import get_conversation_manager
+from rag_core.corpus_cache import reset_corpus_cache
+from rag_core.embedding_cache import reset_embedding_cache
 from utils.config import get_llm_config, LLM_PROVIDER, get_retrieval_params
 from rag_core.llm_api import call_llm_api
 from utils.config import get_text_chunk_config
@@ -178,7 +180,7 @@ def knowledge_base():
     """知识库管理页面"""
     kb_name = request.args.get("kb_name", "default")
     try:
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         documents = kb.list_documents()
         stats = kb.get_stats()
         all_kbs = list_knowledge_bases()
@@ -270,12 +272,17 @@ def kb_add_document():
         preserve_formatting = request.form.get("preserve_formatting", "false") == "true"
         merge_short_chunks = request.form.get("merge_short_chunks", "true") == "true"
         merge_threshold = request.form.get("merge_threshold", type=float)
+        collapse_near_duplicates = request.form.get("collapse_near_duplicates", "false") == "true"
+        near_duplicate_threshold = request.form.get("near_duplicate_threshold", type=float)
 
         chunk_config["smart_split"] = smart_split
         chunk_config["preserve_formatting"] = preserve_formatting
         chunk_config["merge_short_chunks"] = merge_short_chunks
         if merge_threshold:
             chunk_config["merge_threshold"] = merge_threshold
+        chunk_config["collapse_near_duplicates"] = collapse_near_duplicates
+        if near_duplicate_threshold:
+            chunk_config["near_duplicate_threshold"] = near_duplicate_threshold
 
         # 后端参数校验
         errors = validate_chunk_config(chunk_config)
@@ -285,7 +292,7 @@ def kb_add_document():
             )
 
         # 添加到知识库
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         result = kb.add_document(file_path, chunk_config=chunk_config, embedding_provider=embedding_provider)
 
         # 清理临时文件
@@ -310,7 +317,7 @@ def kb_search():
         return jsonify({"success": False, "error": "查询内容不能为空"})
 
     try:
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         results = kb.search(query, top_k=top_k, use_enhanced=use_enhanced)
 
         return jsonify({"success": True, "results": results, "count": len(results)})
@@ -330,7 +337,7 @@ def kb_suggestions():
         return jsonify({"success": True, "suggestions": []})
 
     try:
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         suggestions = kb.get_search_suggestions(query, limit)
 
         return jsonify({"success": True, "suggestions": suggestions})
@@ -346,7 +353,7 @@ def kb_history():
     limit = request.args.get("limit", type=int, default=20)
 
     try:
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         history = kb.get_search_history(limit)
 
         return jsonify({"success": True, "history": history})
@@ -361,7 +368,7 @@ def kb_clear_history():
     kb_name = request.form.get("kb_name", "default")
 
     try:
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         kb.clear_search_history()
 
         return jsonify({"success": True})
@@ -382,7 +389,7 @@ def kb_export_results():
 
         results = json.loads(results_json)
 
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         file_path = kb.export_search_results(results, format)
 
         if file_path:
@@ -404,7 +411,7 @@ def kb_delete_document():
         return jsonify({"success": False, "error": "文档ID不能为空"})
 
     try:
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         success = kb.delete_document(doc_id)
         return jsonify({"success": success})
     except Exception as e:
@@ -416,7 +423,7 @@ def kb_stats():
     """获取知识库统计信息"""
     kb_name = request.args.get("kb_name", "default")
     try:
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         stats = kb.get_stats()
         return jsonify({"success": True, "stats": stats})
     except Exception as e:
@@ -428,7 +435,7 @@ def kb_clear():
     """清空知识库"""
     kb_name = request.form.get("kb_name", "default")
     try:
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         success = kb.clear()
         return jsonify({"success": success})
     except Exception as e:
@@ -439,7 +446,7 @@ def kb_clear():
 def kb_config_info():
     """获取切片配置信息"""
     try:
-        kb = create_knowledge_base("default")
+        kb = get_knowledge_base("default")
         config_info = kb.get_chunk_config_info()
         return jsonify(config_info)
     except Exception as e:
@@ -451,7 +458,7 @@ def kb_validate_config():
     """验证切片配置"""
     try:
         config = request.get_json()
-        kb = create_knowledge_base("default")
+        kb = get_knowledge_base("default")
         errors = kb.validate_chunk_config(config)
         return jsonify({"errors": errors, "valid": len(errors) == 0})
     except Exception as e:
@@ -531,7 +538,7 @@ def chat_send():
         context = conv_manager.get_conversation_context(session_id)
 
         # 在知识库中搜索相关内容
-        kb = create_knowledge_base(kb_name)
+        kb = get_knowledge_base(kb_name)
         search_results = kb.search(message, top_k=3, use_enhanced=True)
 
         # 构建增强的查询（包含上下文）
@@ -699,13 +706,14 @@ def result():
             "min_chunk_length",
             "max_chunk_length",
         ]
-        float_keys = ["merge_threshold"]
+        float_keys = ["merge_threshold", "near_duplicate_threshold"]
         bool_keys = [
             "remove_empty_chunks",
             "remove_whitespace_only",
             "smart_split",
             "preserve_formatting",
             "merge_short_chunks",
+            "collapse_near_duplicates",
         ]
         for k, v in raw_config.items():
             if k in int_keys:
@@ -899,6 +907,9 @@ def api_set_config():
                 {"success": False, "error": "参数校验失败", "detail": errors}
             )
         save_global_config(data)
+        # 缓存配置只在首次使用时读取，保存后重新读取
+        reset_embedding_cache()
+        reset_corpus_cache()
         print("[api_set_config] config saved successfully.")
         return jsonify({"success": True})
     except Exception as e: